@@ -0,0 +1,29 @@
+"""
+Add a fingerprint to every supernetwork in the database that doesn't have one.
+
+Supernetworks deposited before fingerprints were introduced are invisible to
+SuperNetwork.getIsomorphs, which only queries supernetworks sharing its fingerprint.
+Run this once, after addUniqueCompoundPartialIndices.py has created the fingerprint index.
+"""
+import pymongo
+from proteinnetworks.database import getSuperNetworkFingerprint
+
+if __name__ == "__main__":
+    password = input("password: ").strip()
+    client = pymongo.MongoClient(
+        "mongodb://writeAccess:" + password + "@s7.tcm.phy.private.cam.ac.uk/proteinnetworks",
+        serverSelectionTimeoutMS=1000)
+    db = client.proteinnetworks
+    collection = db.proteinnetworks
+
+    updates = []
+    for doc in collection.find({"doctype": "supernetwork", "fingerprint": {"$exists": False}},
+                               {"data": 1}):
+        updates.append(pymongo.UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"fingerprint": getSuperNetworkFingerprint(doc["data"])}}))
+        if len(updates) == 1000:
+            collection.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        collection.bulk_write(updates, ordered=False)
@@ -9,11 +9,15 @@ parameters cannot be repeated.
 But different documents have different fields.
 So we want partial, compound, unique indices covering all documents.
 
-Four unique partial indices:
+Five unique partial indices:
 (pdbref) if doctype==pdbfile
 (pdbref, edgelisttype, hydrogenstatus, scaling) if doctype == edgelist
 (pdbref. edgelistid, detectionmethod, r) if detectionmethod == "AFG"
 (pdbref, edgelistid, detectionmethod) if detectionmethod == "Infomap
+(supernetworkid1, supernetworkid2) if doctype == weakisomorph
+
+Plus a (non-unique) index on the supernetwork fingerprint, so isomorphism queries only fetch
+candidate supernetworks.
 """
 import pymongo
 
@@ -38,6 +42,12 @@ if __name__ == "__main__":
          ("level", pymongo.ASCENDING)],
         unique=True,
         partialFilterExpression={"doctype": "supernetwork"})
+    collection.create_index(
+        "fingerprint", unique=False, partialFilterExpression={"doctype": "supernetwork"})
+    collection.create_index(
+        [("supernetworkid1", pymongo.ASCENDING), ("supernetworkid2", pymongo.ASCENDING)],
+        unique=True,
+        partialFilterExpression={"doctype": "weakisomorph"})
     collection.create_index(
         [("pdbref", pymongo.ASCENDING), ("edgelisttype", pymongo.ASCENDING),
          ("hydrogenstatus", pymongo.ASCENDING),
@@ -0,0 +1,58 @@
+"""
+Benchmark the neighbour search backends used to generate edgelists.
+
+Random "proteins" (atoms scattered at roughly protein density, with a protein-like mix of
+elements) of increasing size are searched with each backend, and the best time of a few
+repeats printed. The crossover between the backends sets selectBackend in network.py.
+
+Typical results (seconds):
+   scaling 4.5                         scaling 2.0
+   atoms     dense      grid    kdtree    dense      grid    kdtree
+     250    0.0041    0.0033    0.0026   0.0030    0.0076    0.0008
+    1000    0.0485    0.0179    0.0169   0.0350    0.0162    0.0027
+    4000    0.5194    0.0880    0.0826   0.4478    0.0838    0.0149
+    8000    1.8516    0.1596    0.1927   1.7500    0.1076    0.0226
+   16000    5.8999    0.4497    0.4663   6.0758    0.2560    0.0555
+   32000   22.6433    1.0226    1.0940
+
+Usage: python benchmarkNeighbourSearch.py [--scaling 4.5] [--repeats 3] [--maxatoms 100000]
+"""
+import argparse
+import time
+import numpy as np
+from proteinnetworks.network import getContactPairs, getAtomicRadii
+
+# Roughly one heavy atom per 12 cubic angstroms in a folded protein
+VOLUME_PER_ATOM = 12.0
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-s", "--scaling", type=float, help="the cutoff scaling (default=4.5)",
+                    default=4.5)
+parser.add_argument("-r", "--repeats", type=int, help="repeats per timing (default=3)",
+                    default=3)
+parser.add_argument("-m", "--maxatoms", type=int, help="largest structure (default=100000)",
+                    default=100000)
+args = parser.parse_args()
+
+random = np.random.RandomState(0)
+backends = ["dense", "grid", "kdtree"]
+print("{:>8}  {}".format("atoms", "  ".join("{:>8}".format(x) for x in backends)))
+numberOfAtoms = 250
+while numberOfAtoms <= args.maxatoms:
+    side = (numberOfAtoms * VOLUME_PER_ATOM)**(1 / 3)
+    positions = random.uniform(0, side, (numberOfAtoms, 3))
+    elements = random.choice(["C", "N", "O", "S"], p=[0.63, 0.17, 0.19, 0.01],
+                             size=numberOfAtoms)
+    radii = getAtomicRadii(elements)
+
+    timings = []
+    for backend in backends:
+        best = np.inf
+        for repeat in range(args.repeats):
+            start = time.perf_counter()
+            getContactPairs(positions, radii, args.scaling, backend)
+            best = min(best, time.perf_counter() - start)
+        timings.append(best)
+    print("{:>8}  {}".format(numberOfAtoms,
+                             "  ".join("{:>8.4f}".format(x) for x in timings)))
+    numberOfAtoms *= 2
@@ -16,11 +16,9 @@ with open("./pdbswithstoredpartitions.dat") as flines:
 size = len(pdbs)
 for i, pdb in enumerate(pdbs):
     print(f"{i} of {size} completed")
-    pdbdata = db.extractPDBFile(pdb)
-            
-    if not pdbdata:
-        pdbdata = db.fetchPDBFileFromWeb(pdb)
-    pdbChains = set(x[21] for x in pdbdata if x[:4] == "ATOM")
+    # Parsed once: the Networks for each chain reuse the cached structure
+    structure = proteinnetworks.structure.getStructure(pdb, db)
+    pdbChains = set(structure.chains)
     for chainref in pdbChains:
         inputArgs = {"scaling": 4.0,
                 "edgelisttype": "residue",
@@ -0,0 +1,36 @@
+"""
+importStructures.py
+
+Parse every structure in a local mirror of the PDB archive (e.g. pdb/xy/pdb1xyz.ent.gz,
+or mmCIF/xy/1xyz.cif.gz) into a StructureStore, so that later runs read them memory mapped.
+Files are decompressed as they are parsed, and structures already in the store skipped.
+
+Usage: python importStructures.py mirror store
+"""
+import argparse
+import os
+import proteinnetworks
+
+parser = argparse.ArgumentParser()
+parser.add_argument("mirror", help="the directory holding the PDB or mmCIF files")
+parser.add_argument("store", help="the directory of the StructureStore")
+args = parser.parse_args()
+
+store = proteinnetworks.structure.StructureStore(args.store)
+for directory, subdirectories, filenames in os.walk(args.mirror):
+    subdirectories.sort()
+    for filename in sorted(filenames):
+        pdbref = proteinnetworks.structure.getPDBRef(filename)
+        if pdbref is None or os.path.isdir(store.getPath(pdbref)):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            structure = proteinnetworks.structure.Structure.fromFile(path)
+        except (OSError, ValueError) as err:
+            print(f"{path}: skipped ({err})")
+            continue
+        if not len(structure.positions):
+            print(f"{path}: skipped (no atoms)")
+            continue
+        store.depositStructure(pdbref, structure)
+        print(f"{pdbref}: {len(structure.positions)} atoms")
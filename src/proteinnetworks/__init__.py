@@ -4,3 +4,4 @@ import proteinnetworks.network
 import proteinnetworks.database
 import proteinnetworks.insight
 import proteinnetworks.partition
+import proteinnetworks.structure
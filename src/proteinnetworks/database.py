@@ -30,25 +30,81 @@ if doctype == partition:
         N : the number of iterations of Infomap run
 
 if doctype == pdbfile:
-    data: The PDBfile itself (sans headers) as an array of strings
+    data: The PDBfile itself (sans headers) as an array of strings, or for structures only
+          released as mmCIF, the mmCIF file reduced to the atoms read (see
+          getReducedAtomSiteLines)
+
+if doctype == supernetwork:
+    partitionid: The _id of the partition used in generating the supernetwork
+    level: The level of the partition used
+    data: The supernetwork edgelist
+    fingerprint: An isomorphism-invariant fingerprint of data (see getSuperNetworkFingerprint)
+
+if doctype == weakisomorph:
+    supernetworkids: The _ids of the two supernetworks compared, in ascending order
+    supernetworkid1, supernetworkid2: The same _ids as separate fields, uniquely indexed
+    similarity: The size of their maximum common subgraph over the size of the larger
+    optimal: Whether the similarity is exact, rather than a lower bound from an MCS search
+        that ran out of time
 
 """
 
 import pymongo
 import datetime
+import urllib.error
 import urllib.request
 import logging
+import hashlib
+import networkx as nx
+import bson
 
 from pymongo.errors import ConnectionFailure, OperationFailure, DuplicateKeyError
 from bson.errors import InvalidId
 from bson.objectid import ObjectId
 
+from .structure import getReducedAtomSiteLines
+
 
 loggingLevels = {0: logging.ERROR, 1: logging.WARNING, 2: logging.INFO, 3: logging.DEBUG}
 
 # MongoDB params
 MONGO_USER = "writeAccess"
 MONGO_LOCATION = "s7.tcm.phy.private.cam.ac.uk/proteinnetworks"
+# The largest document MongoDB will store
+MONGO_MAX_DOCUMENT_BYTES = 16 * 1024**2
+
+
+def getSuperNetworkFingerprint(data, iterations=3):
+    """
+    Return a fingerprint of a supernetwork edgelist, used to index isomorphism queries.
+
+    The fingerprint is the sorted degree sequence followed by a Weisfeiler-Lehman hash of
+    the (unweighted) graph, so isomorphic supernetworks always share a fingerprint.
+    Different graphs very rarely do, and exact isomorphism tests only run on those.
+
+    The hash is computed here rather than by networkx, whose hashes have changed between
+    versions: stored fingerprints must stay comparable.
+    """
+    G = nx.Graph()
+    G.add_edges_from((i, j) for i, j, _ in data)
+    degrees = sorted((degree for _, degree in G.degree()), reverse=True)
+
+    # Start from the degrees, then repeatedly relabel each node by its own label and the
+    # sorted labels of its neighbours. The hash covers the label counts of every round.
+    labels = {node: str(degree) for node, degree in G.degree()}
+    rounds = [sorted(labels.values())]
+    for i in range(iterations):
+        labels = {
+            node: hashlib.blake2b("{}|{}".format(
+                labels[node], ",".join(sorted(labels[j] for j in G[node]))).encode(),
+                                  digest_size=8).hexdigest()
+            for node in G
+        }
+        rounds.append(sorted(labels.values()))
+    wlhash = hashlib.blake2b(repr(rounds).encode(), digest_size=16).hexdigest()
+
+    return "{}:{}".format(",".join(str(degree) for degree in degrees), wlhash)
+
 
 class Database:
     """A wrapper around MongoDB."""
@@ -87,6 +143,7 @@ class Database:
 
         else:
             self.collection = LocalCollection()
+            self.collection.create_index("fingerprint")
 
     def extractEdgelist(self,
                         pdbref,
@@ -169,6 +226,49 @@ class Database:
             result = self.collection.insert_one(edgelist)
             return result.inserted_id
 
+    def depositEdgelists(self,
+                         pdbref,
+                         edgelisttype,
+                         hydrogenstatus,
+                         scalings,
+                         edgelists,
+                         chainref=None):
+        """
+        Deposit a batch of edgelists, one per scaling, for the same structure.
+
+        Check that none of the edgelists are already in the database, then deposit them
+        all in one insert and return the list of _ids.
+        """
+        documents = []
+        for scaling, edges in zip(scalings, edgelists):
+            edgelist = {
+                "pdbref": pdbref,
+                "doctype": "edgelist",
+                "edgelisttype": edgelisttype,
+                "hydrogenstatus": hydrogenstatus,
+                "scaling": scaling
+            }
+            query = edgelist.copy()
+            if chainref is not None:
+                edgelist["chainref"] = chainref
+                query["chainref"] = chainref
+            else:
+                # Explictly pass a "doesn't have a chainref field" to the query
+                query["chainref"] = {"$exists": False}
+
+            if self.collection.find(query).count():
+                raise IOError(
+                    "Edgelist already exists in the database! Something has gone terribly wrong!"
+                )
+            edgelist["date"] = datetime.datetime.utcnow()
+            edgelist["data"] = edges
+            self.validateEdgelist(edgelist)
+            documents.append(edgelist)
+
+        self.logger.info("adding {} edgelists to database...".format(len(documents)))
+        result = self.collection.insert_many(documents)
+        return result.inserted_ids
+
     def extractPDBFile(self, pdbref):
         """
         Validate the PDB reference and attempt to extract the PDB file corresponding to the PDB ref.
@@ -194,7 +294,11 @@ class Database:
         """
         Pull the PDB file from the web, deposit, and return.
 
-        Fetched from the RCSB, and the headers stripped to save disk space
+        Fetched from the RCSB, and the headers stripped to save disk space.
+        Structures too large for the PDB format are only released as mmCIF files: if there
+        is no PDB file, the mmCIF file is fetched instead, and reduced to the atoms read.
+        Files too large for a MongoDB document are returned without being deposited; use a
+        StructureStore (see structure.useStructureStore) to keep them parsed locally.
         """
         # Validate the pdbref
         if not (type(pdbref) == str and len(pdbref) == 4):
@@ -207,22 +311,33 @@ class Database:
             "SPRSDE", "JRNL", "REMARKS", "REMARK"
         ]
         url = "http://www.rcsb.org/pdb/files/{}.pdb".format(pdbref)
-        data = urllib.request.urlopen(url).readlines()
-        pdbfile = []
-        for line in data:
-            line = line.decode().strip()
-            # Strip out the headers.
-            for header in headers:
-                if line.startswith(header):
-                    break
-            else:
-                pdbfile.append(line)
+        try:
+            data = urllib.request.urlopen(url).readlines()
+        except urllib.error.HTTPError:
+            url = "https://files.rcsb.org/download/{}.cif".format(pdbref)
+            data = urllib.request.urlopen(url).readlines()
+            pdbfile = getReducedAtomSiteLines(line.decode() for line in data)
+        else:
+            pdbfile = []
+            for line in data:
+                line = line.decode().strip()
+                # Strip out the headers.
+                for header in headers:
+                    if line.startswith(header):
+                        break
+                else:
+                    pdbfile.append(line)
 
         document = {
             "pdbref": pdbref,
             "doctype": "pdbfile",
             "data": pdbfile,
         }
+        if (not isinstance(self.collection, LocalCollection)
+                and len(bson.encode(document)) > MONGO_MAX_DOCUMENT_BYTES):
+            self.logger.warning("PDB file too large for the database, so not deposited: %s",
+                                pdbref)
+            return pdbfile
         self.logger.info("adding PDB file to database...")
         try:
             self.collection.insert_one(document)
@@ -508,20 +623,50 @@ class Database:
             )
         else:
             supernetwork['data'] = data
+            supernetwork['fingerprint'] = getSuperNetworkFingerprint(data)
 
             self.logger.info("adding supernetwork to database...")
 
             result = self.collection.insert_one(supernetwork)
             return result.inserted_id
 
-    def extractAllSuperNetworks(self, pdbref=None):
-        """Extract all supernetworks, except the one specified by pdbref."""
+    def depositWeakIsomorphs(self, weakIsomorphs):
+        """
+        Deposit weak isomorph similarities into the database in bulk.
+
+        weakIsomorphs is a list of (supernetworkid, supernetworkid, similarity, optimal),
+        where optimal is False if the similarity is only a lower bound.
+        Each pair is upserted on its sorted _ids, so depositing the same pairs again updates
+        their similarities rather than duplicating them.
+        Return the _ids of the new documents, keyed by their position in weakIsomorphs.
+        """
+        updates = []
+        for id1, id2, similarity, optimal in weakIsomorphs:
+            id1, id2 = sorted([ObjectId(id1), ObjectId(id2)])
+            updates.append(pymongo.UpdateOne(
+                {"doctype": "weakisomorph", "supernetworkid1": id1, "supernetworkid2": id2},
+                {"$set": {"supernetworkids": [id1, id2], "similarity": float(similarity),
+                          "optimal": bool(optimal)}},
+                upsert=True))
+
+        self.logger.info("adding {} weak isomorphs to database...".format(len(updates)))
+        result = self.collection.bulk_write(updates, ordered=False)
+        return result.upserted_ids
+
+    def extractAllSuperNetworks(self, pdbref=None, fingerprint=None):
+        """
+        Extract all supernetworks, except the one specified by pdbref.
+
+        If a fingerprint is given, only supernetworks with that fingerprint are returned.
+        """
         query = {
             "pdbref": {
                 "$ne": pdbref
             },
             "doctype": "supernetwork",
         }
+        if fingerprint is not None:
+            query['fingerprint'] = fingerprint
         cursor = self.collection.find(query)
         return cursor
 
@@ -532,7 +677,7 @@ class LocalCollection:
 
     Stores records as a list of dicts, manipulated with the following methods:
     - collection.find():
-        given a set of parameters (including wildcards such as $exists etc) as a dict,
+        given a set of parameters (including wildcards such as $exists and $ne) as a dict,
         return a list of the dicts in the database matching this description.
 
     - collection.find_one():
@@ -541,6 +686,20 @@ class LocalCollection:
     - collection.insert_one():
         given a dict, add an ObjectId, push the record, return the id.
 
+    - collection.insert_many():
+        as above, for a list of dicts, returning all the ids.
+
+    - create_index():
+        index the records by the value of a field, so queries giving that field only
+        scan the records sharing its value.
+
+    - update_one():
+        given a query and a {"$set": ...} update, update the first matching record, or
+        (with upsert) insert one made from the query and the update.
+
+    - bulk_write():
+        apply a list of pymongo.UpdateOne requests, as update_one does.
+
     - count():
         return the number of records in the db.
     """
@@ -548,6 +707,15 @@ class LocalCollection:
     def __init__(self):
         """Initialise the empty list of dicts."""
         self.storageList = []
+        self.indices = {}
+
+    def create_index(self, key):
+        """Index the records by the value of the given field (a single field name)."""
+        index = {}
+        for record in self.storageList:
+            if key in record:
+                index.setdefault(record[key], []).append(record)
+        self.indices[key] = index
 
     def find(self, query):
         """
@@ -560,11 +728,16 @@ class LocalCollection:
             def count(self):
                 return len(self)
 
+        # Only scan the records sharing the value of an indexed field, if the query gives one
+        records = self.storageList
+        for key, index in self.indices.items():
+            if key in query and type(query[key]) != dict:
+                records = index.get(query[key], [])
+                break
+
         subset = []
-        for record in self.storageList:
+        for record in records:
             for key, value in query.items():
-                if key not in record:
-                    break
                 if type(value) == dict and "$exists" in value:
                     exists = value["$exists"]
                     # match if "exists" is False and key isn't in the record
@@ -573,9 +746,11 @@ class LocalCollection:
                                                            (key not in record))
                     if not match:
                         break
-                else:
-                    if record[key] != value:
+                elif type(value) == dict and "$ne" in value:
+                    if key in record and record[key] == value["$ne"]:
                         break
+                elif key not in record or record[key] != value:
+                    break
             else:
                 subset.append(record)
 
@@ -609,8 +784,62 @@ class LocalCollection:
 
         record["_id"] = ObjectId()
         self.storageList.append(record)
+        for key, index in self.indices.items():
+            if key in record:
+                index.setdefault(record[key], []).append(record)
         result = Result(record["_id"])
         return result
 
+    def update_one(self, query, update, upsert=False):
+        """
+        Set the fields in update["$set"] on the first record matching the query.
+
+        If there is none and upsert is True, insert a record made of the query's fields
+        and the update's. Return the _id of the inserted record, or None.
+        """
+        for record in self.find(query):
+            record.update(update["$set"])
+            return None
+        if upsert:
+            record = {key: value for key, value in query.items() if type(value) != dict}
+            record.update(update["$set"])
+            return self.insert_one(record).inserted_id
+
+    def bulk_write(self, requests, ordered=True):
+        """
+        Apply a list of pymongo.UpdateOne requests, and return a Result (with an
+        upserted_ids attribute, mapping the position of each request that inserted a
+        record to its _id).
+        """
+
+        class Result:
+            """A container for the upserted_ids, necessary to match the pymongo collection."""
+
+            def __init__(self, ids):
+                self.upserted_ids = ids
+
+        ids = {}
+        for position, request in enumerate(requests):
+            # UpdateOne keeps its arguments in these attributes
+            id = self.update_one(request._filter, request._doc, request._upsert)
+            if id is not None:
+                ids[position] = id
+        return Result(ids)
+
+    def insert_many(self, records):
+        """
+        Push a list of dictionaries to the "database", and return a Result (with an
+        inserted_ids attribute, in the same order as the records).
+        """
+
+        class Result:
+            """A container for the inserted_ids, necessary to match the pymongo collection."""
+
+            def __init__(self, ids):
+                self.inserted_ids = ids
+
+        ids = [self.insert_one(record).inserted_id for record in records]
+        return Result(ids)
+
     def count(self):
         return len(self.storageList)
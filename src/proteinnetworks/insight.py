@@ -8,30 +8,54 @@ The modified Jaccard for each level of the partition is calculated, and the leve
 best correspondence to the PFAM domains is chosen to generate a supernetwork.
 """
 import numpy as np
+import scipy.sparse
 import networkx as nx
 import matplotlib.pyplot as plt
 import warnings
-import itertools
 import math
 import logging
+import time
+import functools
+import itertools
+import concurrent.futures
 from .partition import Partition
 from .network import Network
+from .database import getSuperNetworkFingerprint
 from typing import List
 
 loggingLevels = {0: logging.ERROR, 1: logging.WARNING, 2: logging.INFO, 3: logging.DEBUG}
 
+# Null-model trials per independent random stream (and per task sent to a worker) in getZScore
+ZSCORE_TRIALS_PER_CHUNK = 1000
+# Null models whose supernetworks are built together in SuperNetworkNullEnsemble
+NULL_ENSEMBLE_MODELS_PER_BLOCK = 64
+# Supernetwork pairs compared per task sent to a worker in weakIsomorphMatrix
+WEAK_ISOMORPH_PAIRS_PER_CHUNK = 200
+# Chunks queued per worker at a time in weakIsomorphMatrix, so the pairs are never all held
+WEAK_ISOMORPH_CHUNKS_PER_WORKER = 4
+# Seconds an MCS search runs by default before settling for the best subgraph found
+MCS_TIMEOUT = 10
+
 
-class SuperNetwork:
+class BaseSuperNetwork:
     """
-    A network generated from the community structure of the protein.
+    The parts of a supernetwork shared by SuperNetwork and SuperNetworkNullModel.
 
-    Pull from the database if possible: otherwise generate anew.
-    Includes a single-chain reference, for use in the getIsomorphs function
+    The community edges are stored as NumPy arrays (src, dst, weight); data gives them as an
+    edgelist [[i, j, weight], ...]. The NetworkX graph and the invariants used to rule out
+    isomorphisms (the fingerprint and node count) are built on first use and cached, so
+    repeated isomorph queries against the same supernetwork build no graphs. Assigning data
+    resets these cached views.
     """
 
-    def __init__(self, inputPartition, level=None, verbosity=1):
-        """Generate the network from an existing Partition."""
-        # Get the input partition and edgelist
+    def loadPartition(self, inputPartition, level, verbosity, edgelistdocument=None):
+        """
+        Store the details of the partition, and choose the level to use.
+
+        If no level is given, the level best matching the PFAM domains is used.
+        The edgelist document is extracted from the database, unless already given.
+        Returns the edgelist and the partition at that level.
+        """
         self.pdbref = inputPartition.pdbref  # Save the details on the partition used
         self.database = inputPartition.database
         self.partitionid = inputPartition.partitionid
@@ -39,17 +63,17 @@ class SuperNetwork:
         # Reset the verbosity
         for handler in logging.root.handlers[:]:
             logging.root.removeHandler(handler)
-        logger = logging.getLogger(__name__)
-        logger.setLevel(loggingLevels[verbosity])
-        for handler in logger.handlers[:]:
-            logger.removeHandler(handler)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(loggingLevels[verbosity])
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
 
         ch = logging.StreamHandler()
         # ch.setFormatter()
-        logger.addHandler(ch)
+        self.logger.addHandler(ch)
 
         partition = inputPartition.data
-        edgelistDoc = inputPartition.database.extractDocumentGivenId(
+        edgelistDoc = edgelistdocument or inputPartition.database.extractDocumentGivenId(
             inputPartition.edgelistid)
         edgelist = edgelistDoc['data']
         self.chainref = edgelistDoc.get(
@@ -60,23 +84,19 @@ class SuperNetwork:
                 pfamDomains = np.asarray(
                     inputPartition.getPFAMDomainArray(), dtype=int)
             except ValueError:
-                logger.error("No PFAM entry -> cannot generate supernetwork")
+                self.logger.error("No PFAM entry -> cannot generate supernetwork")
                 raise ValueError
 
-            maxJaccard = -1
-            maxI = -1
-            for i, col in enumerate(partition):
-                jaccard = getModifiedJaccard(pfamDomains,
-                                             np.asarray(col, dtype=int))
-                logger.info("Level {} has Jaccard {}".format(i, jaccard))
-                if jaccard > maxJaccard:
-                    maxJaccard = jaccard
-                    maxI = i
-            logger.info("Using level {}".format(maxI))
+            jaccards = getModifiedJaccardBatch(pfamDomains,
+                                               np.asarray(partition, dtype=int))
+            for i, jaccard in enumerate(jaccards):
+                self.logger.info("Level {} has Jaccard {}".format(i, jaccard))
+            maxI = int(np.argmax(jaccards))
+            self.logger.info("Using level {}".format(maxI))
             self.level = maxI
 
         else:
-            logger.info("Using specified level:", level)
+            self.logger.info("Using specified level: {}".format(level))
             try:
                 self.level = int(level)
             except ValueError as err:
@@ -85,92 +105,75 @@ class SuperNetwork:
             partition = partition[self.level]
         except IndexError:
             raise IndexError(f"Level passed: {self.level}. level should be between 0 and {len(partition)}") 
-        # Attempt to extract the supernetwork matching the given params
-        doc = self.database.extractSuperNetwork(self.pdbref, self.partitionid,
-                                                level)
-
-        if doc:
-            self.data = doc['data']
-            logger.info("supernetwork found")
-
-
-        else:
-            # Generate the supernetwork
-            communityEdgeList = {}
-            for i, j, _ in edgelist:
-                com_i, com_j = partition[int(i) - 1], partition[int(j) - 1]
-                if com_i != com_j:
-                    if not (com_i, com_j) in communityEdgeList:
-                        if (com_j, com_i) in communityEdgeList:
-                            communityEdgeList[(com_j, com_i)] += 1
-                        else:
-                            communityEdgeList[(com_i, com_j)] = 1
-                    else:
-                        communityEdgeList[(com_i, com_j)] += 1
-
-            communityEdgeListSorted = []
-            for row, weight in communityEdgeList.items():
-                i, j = row
-                communityEdgeListSorted.append([i, j, weight])
-            communityEdgeListSorted.sort()
-
-            self.data = communityEdgeListSorted
-            self.database.depositSuperNetwork(self.pdbref, self.partitionid,
-                                              self.level, self.data)
+        return edgelist, partition
 
-    @classmethod
-    def fromPartitionId(SuperNetwork, partitionid, database, level=None):
+    @property
+    def data(self):
         """
-        Given a database and a partitionid, generate the Partition class.
+        The supernetwork as an edgelist [[i, j, weight], ...].
 
-        Then generate the SuperNetwork as normal from the partition.
-        FIXME: this is really very convoluted.
+        The communities and weights (edge counts) must be integers: assigning an edgelist
+        with any other values raises a ValueError. Assigning data replaces the edges, and
+        resets the cached graph, fingerprint and numberOfNodes built from the old ones.
         """
-        partitionDetails = database.extractDocumentGivenId(partitionid)
+        return np.column_stack((self.src, self.dst, self.weight)).tolist()
+
+    @data.setter
+    def data(self, data):
+        edges = np.asarray(data).reshape(-1, 3)
+        if not np.all(np.mod(edges, 1) == 0):
+            raise ValueError("supernetwork edges must be integer [i, j, weight] triples")
+        edges = edges.astype(np.int64)
+        self.src = edges[:, 0].copy()
+        self.dst = edges[:, 1].copy()
+        self.weight = edges[:, 2].copy()
+        # Anything cached was built from the old edges
+        for key in ("graph", "fingerprint", "numberOfNodes"):
+            self.__dict__.pop(key, None)
+
+    @functools.cached_property
+    def graph(self):
+        """The supernetwork as a weighted NetworkX graph."""
+        G = nx.Graph()
+        G.add_weighted_edges_from(
+            zip(self.src.tolist(), self.dst.tolist(), self.weight.tolist()))
+        return G
 
-        if 'r' in partitionDetails:
-            inputPartition = Partition(
-                partitionDetails['pdbref'],
-                partitionDetails['edgelistid'],
-                partitionDetails['detectionmethod'],
-                r=partitionDetails['r'],
-                database=database)
-        elif 'N' in partitionDetails:
-            inputPartition = Partition(
-                partitionDetails['pdbref'],
-                partitionDetails['edgelistid'],
-                partitionDetails['detectionmethod'],
-                N=partitionDetails['N'],
-                database=database)
-        return SuperNetwork(inputPartition=inputPartition, level=level)
+    @functools.cached_property
+    def fingerprint(self):
+        """The fingerprint shared by all supernetworks isomorphic to this one."""
+        return getSuperNetworkFingerprint(self.data)
+
+    @functools.cached_property
+    def numberOfNodes(self):
+        """The number of communities linked by the supernetwork."""
+        return len(np.unique(np.concatenate((self.src, self.dst))))
 
     def draw(self):
         """Draw the reduced edgelist using NetworkX."""
-        G = nx.Graph()
-        for i, j, weight in self.data:
-            G.add_edge(i, j, weight=weight)
-
-        pos = nx.spring_layout(G, k=10)
+        pos = nx.spring_layout(self.graph, k=10)
         fig, ax = plt.subplots(figsize=(5, 5))
 
         # Suppress MPL's complaining, as it's a NetworkX problem.
         warnings.filterwarnings("ignore")
-        nx.draw(G, pos=pos, node_color="grey")
+        nx.draw(self.graph, pos=pos, node_color="grey")
         ax.set_title("Community network for {}".format(self.pdbref))
         plt.show()
 
     def getIsomorphs(self, subset=None):
-        """Get all proteins in the database with an isomorphic supernetwork."""
-        # Generate the NetworkX graph for the supernetwork
-        G = nx.Graph()
-        for i, j, weight in self.data:
-            G.add_edge(i, j, weight=weight)
+        """
+        Get all proteins in the database with an isomorphic supernetwork.
 
-        # Get a cursor for all supernetworks in the database
+        If a subset of the supernetworks (dicts or supernetworks) are given, this is used.
+        Only those sharing the fingerprint are tested for isomorphism.
+        Throws a ValueError if there are no other supernetworks to compare against.
+        """
+        # Only supernetworks sharing the fingerprint can be isomorphic: get a cursor for those
         if subset is None:
             proteins = self.database.extractAllSuperNetworks(
-                pdbref=self.pdbref)
-            if proteins.count() == 0:
+                pdbref=self.pdbref, fingerprint=self.fingerprint)
+            if proteins.count() == 0 and self.database.extractAllSuperNetworks(
+                    pdbref=self.pdbref).count() == 0:
                 raise ValueError("no protein supernetworks in database!")
         else:
             proteins = subset
@@ -178,39 +181,36 @@ class SuperNetwork:
                 raise ValueError("no protein supernetworks in subset ")
         isomorphs = []
         for protein in proteins:
-            G2 = nx.Graph()
             if type(protein) is dict:
-                for i, j, weight in protein['data']:
-                    G2.add_edge(i, j, weight=weight)
-                if nx.faster_could_be_isomorphic(G, G2) and nx.is_isomorphic(
-                        G, G2):
+                # Supernetworks deposited without a fingerprint need it computing
+                fingerprint = protein.get('fingerprint') or getSuperNetworkFingerprint(
+                    protein['data'])
+                if fingerprint == self.fingerprint and nx.is_isomorphic(
+                        self.graph, edgelistToGraph(protein['data'])):
                     isomorphs.append(protein['pdbref'])
-            elif type(protein) is SuperNetwork:
-                for i, j, weight in protein.data:
-                    G2.add_edge(i, j, weight=weight)
-                if nx.faster_could_be_isomorphic(G, G2) and nx.is_isomorphic(
-                        G, G2):
+            elif isinstance(protein, BaseSuperNetwork):
+                if protein.fingerprint == self.fingerprint and nx.is_isomorphic(
+                        self.graph, protein.graph):
                     isomorphicProtein = protein.pdbref
                     if protein.chainref is not None:
                         isomorphicProtein += "_{}".format(protein.chainref)
                     isomorphs.append(isomorphicProtein)
+            else:
+                raise TypeError("either a dict or a supernetwork must be provided!")
         return isomorphs
 
-    def getWeakIsomorphs(self, subset=None):
+    def getWeakIsomorphs(self, subset=None, timeout=MCS_TIMEOUT):
         """
         Get all proteins in the database with an weakly isomorphic supernetwork.
 
-        Returns a list [self.pdbref, otherpdbref, simscore] for all proteins with
+        Returns a list [self.pdbref, otherpdbref, simscore, optimal] for all proteins with
         a simscore > 0.5.
 
-        If a subset of the supernetworks are given, this is used
+        If a subset of the supernetworks (dicts or supernetworks) are given, this is used.
+        Each MCS search runs for at most timeout seconds (None for no limit). One that runs
+        out gives a simscore from the best common subgraph found, a lower bound, and optimal
+        is False.
         """
-        # Generate the NetworkX graph for the supernetwork
-        G = nx.Graph()
-        for i, j, weight in self.data:
-            G.add_edge(i, j)
-
-        G = nx.convert_node_labels_to_integers(G)
         # Get a cursor for all supernetworks in the database
         if subset is None:
             proteins = self.database.extractAllSuperNetworks(
@@ -221,265 +221,285 @@ class SuperNetwork:
             proteins = subset
             if len(proteins) == 0:
                 raise ValueError("no protein supernetworks in subset ")
-
         weakIsomorphs = []
         for protein in proteins:
-            G2 = nx.Graph()
             if type(protein) is dict:
-                for i, j, weight in protein['data']:
-                    G2.add_edge(i, j, weight=weight)
-
-                G2 = nx.convert_node_labels_to_integers(G2)
-                # Get the maximum common subgraph for the two supernetworks
-                try:
-                    MCS = getMCS(G, G2)
-                except ValueError:
-                    continue
-                if MCS:
-                    similarity = MCS.number_of_nodes() / (
-                        max(G.number_of_nodes(), G2.number_of_nodes()))
-                else:
-                    similarity = 0
-
-                if similarity > 0.5:
-                    weakIsomorphs.append(
-                        [self.pdbref, protein['pdbref'],
-                        str(similarity)])
-            elif type(protein) is SuperNetwork:
-                for i, j, weight in protein.data:
-                    G2.add_edge(i, j, weight=weight)
-
-                G2 = nx.convert_node_labels_to_integers(G2)
-                # Get the maximum common subgraph for the two supernetworks
-                try:
-                    MCS = getMCS(G, G2)
-                except ValueError:
+                # No graph is needed if the node counts alone put the simscore below 0.5
+                numberOfNodes = len(np.unique(
+                    np.asarray(protein['data'], dtype=np.int64).reshape(-1, 3)[:, :2]))
+                if min(numberOfNodes, self.numberOfNodes) <= 0.5 * max(
+                        numberOfNodes, self.numberOfNodes):
                     continue
-                if MCS:
-                    similarity = MCS.number_of_nodes() / (
-                        max(G.number_of_nodes(), G2.number_of_nodes()))
-                else:
-                    similarity = 0
+                G2 = edgelistToGraph(protein['data'])
+                otherpdbref = protein['pdbref']
+            elif isinstance(protein, BaseSuperNetwork):
+                G2 = protein.graph
+                otherpdbref = protein.pdbref
+            else:
+                raise TypeError("either dicts or supernetworks must be supplied!")
+
+            # Get the similarity from the maximum common subgraph of the two supernetworks
+            similarity, optimal = getWeakIsomorphSimilarity(self.graph, G2, 0.5, timeout)
 
-                if similarity > 0.5:
-                    weakIsomorphs.append(
-                        [self.pdbref, protein.pdbref,
-                        str(similarity)]) 
+            if similarity > 0.5:
+                weakIsomorphs.append([self.pdbref, otherpdbref, str(similarity), optimal])
 
         return weakIsomorphs
 
 
-class SuperNetworkNullModel:
+class SuperNetwork(BaseSuperNetwork):
     """
-    A network generated from a null model, using a given community structure as a base.
+    A network generated from the community structure of the protein.
 
-    Never store in the database
+    Pull from the database if possible: otherwise generate anew.
     Includes a single-chain reference, for use in the getIsomorphs function
     """
 
-    def __init__(self, inputPartition, level=None, verbosity=1):
-        """Generate the network from an existing Partition."""
+    def __init__(self, inputPartition, level=None, verbosity=1, communityedgelist=None,
+                 edgelistdocument=None):
+        """
+        Generate the network from an existing Partition.
+
+        If the supernetwork isn't in the database it is generated, unless already given as
+        communityedgelist. The partition's edgelist document can be given as
+        edgelistdocument, to save extracting it again (see fromAllLevels).
+        """
         # Get the input partition and edgelist
-        self.pdbref = inputPartition.pdbref  # Save the details on the partition used
-        self.database = inputPartition.database
-        self.partitionid = inputPartition.partitionid
-        
-        # Reset the verbosity
-        for handler in logging.root.handlers[:]:
-            logging.root.removeHandler(handler)
-        logger = logging.getLogger(__name__)
-        logger.setLevel(loggingLevels[verbosity])
-        for handler in logger.handlers[:]:
-            logger.removeHandler(handler)
+        edgelist, partition = self.loadPartition(inputPartition, level, verbosity,
+                                                 edgelistdocument)
+        # Attempt to extract the supernetwork matching the given params
+        doc = self.database.extractSuperNetwork(self.pdbref, self.partitionid,
+                                                level)
 
-        ch = logging.StreamHandler()
-        # ch.setFormatter()
-        logger.addHandler(ch)
+        if doc:
+            self.data = doc['data']
+            self.logger.info("supernetwork found")
 
-        partition = inputPartition.data
-        edgelistDoc = inputPartition.database.extractDocumentGivenId(
+        else:
+            # Generate the supernetwork
+            if communityedgelist is None:
+                communityedgelist = getCommunityEdgeList(edgelist, partition)
+            self.data = communityedgelist
+            self.database.depositSuperNetwork(self.pdbref, self.partitionid,
+                                              self.level, self.data)
+
+    @classmethod
+    def fromPartitionId(SuperNetwork, partitionid, database, level=None):
+        """
+        Given a database and a partitionid, generate the Partition class.
+
+        Then generate the SuperNetwork as normal from the partition.
+        FIXME: this is really very convoluted.
+        """
+        partitionDetails = database.extractDocumentGivenId(partitionid)
+
+        if 'r' in partitionDetails:
+            inputPartition = Partition(
+                partitionDetails['pdbref'],
+                partitionDetails['edgelistid'],
+                partitionDetails['detectionmethod'],
+                r=partitionDetails['r'],
+                database=database)
+        elif 'N' in partitionDetails:
+            inputPartition = Partition(
+                partitionDetails['pdbref'],
+                partitionDetails['edgelistid'],
+                partitionDetails['detectionmethod'],
+                N=partitionDetails['N'],
+                database=database)
+        return SuperNetwork(inputPartition=inputPartition, level=level)
+
+    @classmethod
+    def fromAllLevels(SuperNetwork, inputPartition, verbosity=1):
+        """
+        Generate the supernetworks for every level of the Partition, in order of level.
+
+        The edgelist is extracted from the database and converted to arrays once, and the
+        supernetworks of every level built from it in one pass (see getCommunityEdgeArrays).
+        """
+        edgelistDocument = inputPartition.database.extractDocumentGivenId(
             inputPartition.edgelistid)
-        edgelist = edgelistDoc['data']
-        self.chainref = edgelistDoc.get('chainref')  # None if no chainref found
-        if level is None:
-            try:
-                pfamDomains = np.asarray(
-                    inputPartition.getPFAMDomainArray(), dtype=int)
-            except ValueError:
-                logger.error("No PFAM entry -> cannot generate supernetwork")
-                raise ValueError
+        edgelist = np.asarray(edgelistDocument['data'], dtype=float)
+        communityEdgeLists = getCommunityEdgeLists(edgelist, inputPartition.data)
+        return [
+            SuperNetwork(inputPartition, level, verbosity, communityedgelist=communityEdgeList,
+                         edgelistdocument=edgelistDocument)
+            for level, communityEdgeList in enumerate(communityEdgeLists)
+        ]
 
-            maxJaccard = -1
-            maxI = -1
-            for i, col in enumerate(partition):
-                jaccard = getModifiedJaccard(pfamDomains,
-                                            np.asarray(col, dtype=int))
-                logger.info("Level {} has Jaccard {}".format(i, jaccard))
-                if jaccard > maxJaccard:
-                    maxJaccard = jaccard
-                    maxI = i
-            logger.info("Using level {}".format(maxI))
-            self.level = maxI
 
-        else:
-            logger.info("Using specified level:", level)
-            try:
-                self.level = int(level)
-            except ValueError as err:
-                raise TypeError(f"{level} is not a valid level for the supernetwork")
-        try:
-            partition = partition[self.level]
-        except IndexError:
-            raise IndexError(f"Level passed: {self.level}. level should be between 0 and {len(partition)}") 
+class SuperNetworkNullModel(BaseSuperNetwork):
+    """
+    A network generated from a null model, using a given community structure as a base.
+
+    Never store in the database
+    Includes a single-chain reference, for use in the getIsomorphs function
+    """
+
+    def __init__(self, inputPartition, level=None, verbosity=1):
+        """Generate the network from an existing Partition."""
+        # Get the input partition and edgelist
+        edgelist, partition = self.loadPartition(inputPartition, level, verbosity)
 
         partition = generateNullModel(np.asarray(partition))
 
         # Generate the supernetwork
-        communityEdgeList = {}
-        for i, j, _ in edgelist:
-            com_i, com_j = partition[int(i) - 1], partition[int(j) - 1]
-            if com_i != com_j:
-                if not (com_i, com_j) in communityEdgeList:
-                    if (com_j, com_i) in communityEdgeList:
-                        communityEdgeList[(com_j, com_i)] += 1
-                    else:
-                        communityEdgeList[(com_i, com_j)] = 1
-                else:
-                    communityEdgeList[(com_i, com_j)] += 1
-
-        communityEdgeListSorted = []
-        for row, weight in communityEdgeList.items():
-            i, j = row
-            communityEdgeListSorted.append([i, j, weight])
-        communityEdgeListSorted.sort()
-
-        self.data = communityEdgeListSorted
+        self.data = getCommunityEdgeList(edgelist, partition)
 
-    def draw(self):
-        """Draw the reduced edgelist using NetworkX."""
-        G = nx.Graph()
-        for i, j, weight in self.data:
-            G.add_edge(i, j, weight=weight)
 
-        pos = nx.spring_layout(G, k=10)
-        fig, ax = plt.subplots(figsize=(5, 5))
+class SuperNetworkNullEnsemble(BaseSuperNetwork):
+    """
+    An ensemble of null-model supernetworks, for testing the significance of a supernetwork.
 
-        # Suppress MPL's complaining, as it's a NetworkX problem.
-        warnings.filterwarnings("ignore")
-        nx.draw(G, pos=pos, node_color="grey")
-        ax.set_title("Community network for {}".format(self.pdbref))
-        plt.show()
+    The supernetwork of the partition itself is the data (and graph, fingerprint, ...) of
+    the ensemble. Never store in the database.
+    Includes a single-chain reference, for use in the getIsomorphs function
+    """
 
-    def getIsomorphs(self, subset=None):
-        """Get all proteins in the database with an isomorphic supernetwork."""
-        # Generate the NetworkX graph for the supernetwork
-        G = nx.Graph()
-        for i, j, weight in self.data:
-            G.add_edge(i, j, weight=weight)
-        # Get a cursor for all supernetworks in the database
-        if subset is None:
-            proteins = self.database.extractAllSuperNetworks(
-                pdbref=self.pdbref)
-            if proteins.count() == 0:
-                raise ValueError("no protein supernetworks in database!")
-        else:
-            proteins = subset
-            if len(proteins) == 0:
-                raise ValueError("no protein supernetworks in subset ")
-        isomorphs = []
-        for protein in proteins:
-            G2 = nx.Graph()
-            if type(protein) is dict:
-                for i, j, weight in protein['data']:
-                    G2.add_edge(i, j, weight=weight)
-                if nx.faster_could_be_isomorphic(G, G2) and nx.is_isomorphic(
-                        G, G2):
-                    isomorphs.append(protein['pdbref'])
-            elif type(protein) is SuperNetwork or type(protein) is SuperNetworkNullModel :
-                for i, j, weight in protein.data:
-                    G2.add_edge(i, j, weight=weight)
-                if nx.faster_could_be_isomorphic(G, G2) and nx.is_isomorphic(
-                        G, G2):
-                    isomorphicProtein = protein.pdbref
-                    if protein.chainref is not None:
-                        isomorphicProtein += "_{}".format(protein.chainref)
-                    isomorphs.append(isomorphicProtein)
-            else:
-                raise TypeError("either a dict or a supernetwork must be provided!")
-        return isomorphs
+    def __init__(self, inputPartition, numberofmodels, level=None, seed=None, verbosity=1):
+        """
+        Generate numberofmodels null-model supernetworks from an existing Partition.
+
+        The edgelist is loaded and the level chosen once, then every null partition drawn in
+        one batch (see generateNullModels) and the supernetworks built in blocks of
+        NULL_ENSEMBLE_MODELS_PER_BLOCK (see getCommunityEdgeArrays). seed is anything taken
+        by np.random.default_rng.
 
-    def getWeakIsomorphs(self, subset=None):
+        The null supernetworks are stacked as arrays: those of null model i are
+        nullsrc, nulldst, nullweight[nulloffsets[i]:nulloffsets[i + 1]], and its partition
+        is nullmodels[i].
         """
-        Get all proteins in the database with an weakly isomorphic supernetwork.
+        # Get the input partition and edgelist
+        edgelist, partition = self.loadPartition(inputPartition, level, verbosity)
+        partition = np.asarray(partition)
+
+        self.nullmodels = generateNullModels(partition, numberofmodels,
+                                             np.random.default_rng(seed))
+
+        # Build the null models' supernetworks a block at a time, bounding the (models x
+        # edges) temporaries of getCommunityEdgeArrays, and stack them
+        edgelist = np.asarray(edgelist, dtype=float)
+        offsets, src, dst, weight = getCommunityEdgeArrays(edgelist, partition[None, :])
+        self.data = np.column_stack((src, dst, weight))
+        blocks = [(np.zeros(1, dtype=np.int64), src[:0], dst[:0], weight[:0])]
+        for start in range(0, numberofmodels, NULL_ENSEMBLE_MODELS_PER_BLOCK):
+            offsets, src, dst, weight = getCommunityEdgeArrays(
+                edgelist, self.nullmodels[start:start + NULL_ENSEMBLE_MODELS_PER_BLOCK])
+            blocks.append((offsets[1:] + blocks[-1][0][-1], src, dst, weight))
+        self.nulloffsets, self.nullsrc, self.nulldst, self.nullweight = (
+            np.concatenate(arrays) for arrays in zip(*blocks))
+
+    def getNullEdgeList(self, i):
+        """Return the supernetwork of null model i as an edgelist [[i, j, weight], ...]."""
+        start, end = self.nulloffsets[i], self.nulloffsets[i + 1]
+        return np.column_stack((self.nullsrc[start:end], self.nulldst[start:end],
+                                self.nullweight[start:end])).tolist()
+
+    @functools.cached_property
+    def nullfingerprints(self):
+        """The fingerprint of each null-model supernetwork."""
+        return [getSuperNetworkFingerprint(self.getNullEdgeList(i))
+                for i in range(len(self.nullmodels))]
+
+    def getIsomorphClassFrequencies(self):
+        """
+        Group the null-model supernetworks into isomorphism classes.
 
-        Returns a list [self.pdbref, otherpdbref, simscore] for all proteins with
-        a simscore > 0.5.
+        Returns (representatives, frequencies), most frequent class first: the index of one
+        null model in each class, and the fraction of the null models in that class.
+        Exact checks only run between supernetworks sharing a fingerprint.
+        """
+        buckets = {}
+        for i, fingerprint in enumerate(self.nullfingerprints):
+            buckets.setdefault(fingerprint, []).append(i)
+
+        classes = []
+        for indices in buckets.values():
+            edgeArrays = [
+                np.column_stack((self.nullsrc[self.nulloffsets[i]:self.nulloffsets[i + 1]],
+                                 self.nulldst[self.nulloffsets[i]:self.nulloffsets[i + 1]]))
+                for i in indices
+            ]
+            classes.extend([indices[j] for j in isomorphClass]
+                           for isomorphClass in getIsomorphClasses(edgeArrays))
+
+        classes.sort(key=len, reverse=True)
+        representatives = np.asarray([isomorphClass[0] for isomorphClass in classes], dtype=int)
+        frequencies = np.asarray([len(isomorphClass) for isomorphClass in classes]) / len(
+            self.nullmodels)
+        return representatives, frequencies
+
+    def getIsomorphPValue(self):
+        """
+        Return the p-value of the supernetwork's shape under the null model.
 
-        If a subset of the supernetworks are given, this is used. (subset must be a numpy array)
+        This is the empirical p-value (r + 1) / (n + 1) of the n null models, r of which
+        have a supernetwork isomorphic to that of the partition: small values mean the
+        shape recurs less often by chance than it is found.
         """
-        # Generate the NetworkX graph for the supernetwork
-        G = nx.Graph()
-        for i, j, weight in self.data:
-            G.add_edge(i, j)
+        isomorphs = 0
+        for i, fingerprint in enumerate(self.nullfingerprints):
+            if fingerprint == self.fingerprint and nx.is_isomorphic(
+                    self.graph, edgelistToGraph(self.getNullEdgeList(i))):
+                isomorphs += 1
+        return (isomorphs + 1) / (len(self.nullmodels) + 1)
 
-        G = nx.convert_node_labels_to_integers(G)
-        # Get a cursor for all supernetworks in the database
-        if subset is None:
-            proteins = self.database.extractAllSuperNetworks(
-                pdbref=self.pdbref)
-            if proteins.count() == 0:
-                raise ValueError("no protein supernetworks in database!")
-        else:
-            proteins = subset
-            if len(proteins) == 0:
-                raise ValueError("no protein supernetworks in subset ")
-        weakIsomorphs = []
-        for protein in proteins:
-            G2 = nx.Graph()
-            if type(protein) is dict:
-                for i, j, weight in protein['data']:
-                    G2.add_edge(i, j)
-
-                G2 = nx.convert_node_labels_to_integers(G2)
-                # Get the maximum common subgraph for the two supernetworks
-                try:
-                    MCS = getMCS(G, G2)
-                except ValueError:
-                    continue
-                if MCS:
-                    similarity = MCS.number_of_nodes() / (
-                        max(G.number_of_nodes(), G2.number_of_nodes()))
-                else:
-                    similarity = 0
-
-                if similarity > 0.5:
-                    weakIsomorphs.append(
-                        [self.pdbref, protein['pdbref'],
-                        str(similarity)])
-            elif type(protein) is SuperNetwork or type(protein) is SuperNetworkNullModel:
-                for i, j, weight in protein.data:
-                    G2.add_edge(i, j)
-
-                G2 = nx.convert_node_labels_to_integers(G2)
-                # Get the maximum common subgraph for the two supernetworks
-                try:
-                    MCS = getMCS(G, G2)
-                except ValueError:
-                    continue
-                if MCS:
-                    similarity = MCS.number_of_nodes() / (
-                        max(G.number_of_nodes(), G2.number_of_nodes()))
-                else:
-                    similarity = 0
-
-                if similarity > 0.5:
-                    weakIsomorphs.append(
-                        [self.pdbref, protein.pdbref,
-                        str(similarity)])
-            else:
-                raise TypeError("either dicts or supernetworks must be supplied!")
 
-        return weakIsomorphs
+def getCommunityEdgeList(edgelist, partition):
+    """
+    Return the supernetwork of an edgelist: the edges between communities of the partition.
+
+    The edgelist is [[i, j, weight], ...] with 1-indexed nodes, and partition[i - 1] is the
+    community of node i. Each pair of communities is given once, as (smaller, larger) and
+    weighted by the number of edges between them, in a sorted list [[com_i, com_j, count], ...].
+    """
+    return getCommunityEdgeLists(edgelist, [partition])[0]
+
+
+def getCommunityEdgeLists(edgelist, partitions):
+    """
+    Return the supernetworks of an edgelist for every level of a partition at once.
+
+    partitions is a list of levels, each as taken by getCommunityEdgeList.
+    See getCommunityEdgeArrays.
+    """
+    offsets, src, dst, weight = getCommunityEdgeArrays(edgelist, partitions)
+    communityEdgeLists = np.column_stack((src, dst, weight))
+    return [communityEdgeLists[offsets[i]:offsets[i + 1]].tolist()
+            for i in range(len(partitions))]
+
+
+def getCommunityEdgeArrays(edgelist, partitions):
+    """
+    Return the supernetworks of an edgelist for many partitions, stacked as arrays.
+
+    Each edge's endpoints are mapped to their communities in every partition, put in
+    (smaller, larger) order, and the pairs joining different communities counted with a
+    single np.unique.
+
+    Returns (offsets, src, dst, weight): the edges of the supernetwork of partitions[i] are
+    src, dst, weight[offsets[i]:offsets[i + 1]], sorted by community pair.
+    """
+    edges = np.asarray(edgelist, dtype=float).reshape(-1, 3)[:, :2].astype(np.int64) - 1
+    # Relabel the communities 0..K-1, so that each (partition, com_i, com_j) has a unique code
+    labels, communities = np.unique(np.asarray(partitions), return_inverse=True)
+    communities = communities.reshape(len(partitions), -1).astype(np.int64)
+    numberOfLabels = len(labels)
+
+    endpoints = communities[:, edges]  # partitions x edges x 2
+    smaller = endpoints.min(axis=2)
+    larger = endpoints.max(axis=2)
+    level = np.broadcast_to(np.arange(len(partitions))[:, None], smaller.shape)
+    between = smaller != larger
+    codes, counts = np.unique(
+        (level[between] * numberOfLabels + smaller[between]) * numberOfLabels +
+        larger[between], return_counts=True)
+
+    # Codes are sorted by partition, then by the community pair
+    levelOfCode, pair = np.divmod(codes, numberOfLabels**2)
+    offsets = np.searchsorted(levelOfCode, np.arange(len(partitions) + 1))
+    return (offsets, labels[pair // numberOfLabels], labels[pair % numberOfLabels],
+            counts.astype(np.int64))
 
 
 def getModifiedJaccard(expectedArray, generatedArray):
@@ -514,35 +534,117 @@ def getModifiedJaccard(expectedArray, generatedArray):
         set(expectedArray))  # NB this include "1", the base counter
     if numPFAMdomains == 1:
         raise ValueError("Input expected array has no domains")
-    jaccards = []
-    for i in range(2, numPFAMdomains + 1):
-        # Get the modules with some overlap.
-        jaccard = []
-        intersections = []
-        overlappingModules = set(generatedArray[expectedArray == i])
-        for j in overlappingModules:
-            intersection = np.count_nonzero(
-                np.logical_and(generatedArray == j, expectedArray == i))
-            union = np.count_nonzero(
-                np.logical_or(generatedArray == j, expectedArray == i))
-            jaccard.append(intersection / union)
-            intersections.append(intersection)
-
-        # weight the terms according to the overlap proportion.
-        jaccard = [
-            x * y / sum(intersections) for x, y in zip(jaccard, intersections)
-        ]
-        jaccard = sum(jaccard)
-        jaccards.append(jaccard)
-    return np.mean(jaccards)
 
+    # Each nonzero cell of the contingency table is a (domain, module) overlap
+    expectedLabels, _, table = getContingencyTable(expectedArray, generatedArray)
+    expectedSizes = np.bincount(table.row, weights=table.data, minlength=table.shape[0])
+    generatedSizes = np.bincount(table.col, weights=table.data, minlength=table.shape[1])
+    intersections = table.data
+    unions = expectedSizes[table.row] + generatedSizes[table.col] - intersections
+
+    # weight the terms according to the overlap proportion.
+    weightedJaccards = intersections / unions * intersections / expectedSizes[table.row]
+    domainJaccards = np.bincount(table.row, weights=weightedJaccards,
+                                 minlength=table.shape[0])
 
-def getZScore(expectedArray, generatedArray, numTrials=100):
+    jaccards = np.zeros(numPFAMdomains + 1)
+    isDomain = (expectedLabels >= 2) & (expectedLabels <= numPFAMdomains)
+    jaccards[expectedLabels[isDomain]] = domainJaccards[isDomain]
+    return np.mean(jaccards[2:])
+
+
+def getModifiedJaccardBatch(expectedArray, generatedMatrix):
+    """
+    Score many generated partitions against the same expected (PFAM) array.
+
+    generatedMatrix is a 2D array with one partition per row, e.g. the levels of
+    Partition.data or a batch of null models. Returns the modified Jaccard (see
+    getModifiedJaccard) of each row as a numpy array.
+
+    The domains of the expected array are found once. The overlaps of every row are then
+    counted by a single bincount over combined (row, domain, module) labels.
+    """
+    if not type(expectedArray) == np.ndarray or not type(generatedMatrix) == np.ndarray:
+        raise TypeError("both inputs must be numpy arrays") 
+    if not np.equal(np.mod(expectedArray, 1),0).all() or not np.equal(np.mod(generatedMatrix, 1),0).all():
+        raise TypeError("both inputs must be arrays of integers") 
+    generatedMatrix = np.atleast_2d(generatedMatrix)
+    if len(expectedArray) == 0 or generatedMatrix.shape[1] == 0:
+        raise ValueError("both arrays must have non-zero length")
+    if len(expectedArray) != generatedMatrix.shape[1]:
+        raise ValueError("both arrays must have the same length")
+
+    numPFAMdomains = len(
+        set(expectedArray))  # NB this include "1", the base counter
+    if numPFAMdomains == 1:
+        raise ValueError("Input expected array has no domains")
+
+    expectedLabels, expectedCommunities = np.unique(expectedArray, return_inverse=True)
+    expectedCommunities = expectedCommunities.ravel()
+    expectedSizes = np.bincount(expectedCommunities)
+    generatedLabels, generatedCommunities = np.unique(generatedMatrix, return_inverse=True)
+    generatedCommunities = generatedCommunities.reshape(generatedMatrix.shape)
+
+    numberOfRows = len(generatedMatrix)
+    numberOfExpected = len(expectedLabels)
+    numberOfGenerated = len(generatedLabels)
+    rows = np.arange(numberOfRows)[:, np.newaxis]
+    generatedSizes = np.bincount(
+        (rows * numberOfGenerated + generatedCommunities).ravel(),
+        minlength=numberOfRows * numberOfGenerated).reshape(numberOfRows, 1, numberOfGenerated)
+    intersections = np.bincount(
+        ((rows * numberOfExpected + expectedCommunities) * numberOfGenerated +
+         generatedCommunities).ravel(),
+        minlength=numberOfRows * numberOfExpected * numberOfGenerated).reshape(
+            numberOfRows, numberOfExpected, numberOfGenerated)
+
+    # Only the modules overlapping each domain contribute
+    unions = expectedSizes[:, np.newaxis] + generatedSizes - intersections
+    weightedJaccards = np.divide(intersections * intersections,
+                                 unions * expectedSizes[:, np.newaxis],
+                                 out=np.zeros(intersections.shape), where=intersections > 0)
+    domainJaccards = weightedJaccards.sum(axis=2)
+
+    jaccards = np.zeros((numberOfRows, numPFAMdomains + 1))
+    isDomain = (expectedLabels >= 2) & (expectedLabels <= numPFAMdomains)
+    jaccards[:, expectedLabels[isDomain]] = domainJaccards[:, isDomain]
+    return np.mean(jaccards[:, 2:], axis=1)
+
+
+def getContingencyTable(partitionA, partitionB):
+    """
+    Return the contingency table of two partitions of the same nodes.
+
+    Returns (labelsA, labelsB, table), where labelsA and labelsB are the sorted community
+    labels of each partition and table is a scipy.sparse.coo_matrix whose entry [i, j] is
+    the number of nodes in community labelsA[i] of A and community labelsB[j] of B.
+    Only nonzero cells are stored, in row-major order.
+
+    Built with a single bincount over combined labels, so is O(N + k_A k_B).
+    """
+    labelsA, communitiesA = np.unique(partitionA, return_inverse=True)
+    labelsB, communitiesB = np.unique(partitionB, return_inverse=True)
+    numberOfCells = len(labelsA) * len(labelsB)
+    counts = np.bincount(communitiesA.ravel() * len(labelsB) + communitiesB.ravel(),
+                         minlength=numberOfCells)
+    cells = np.flatnonzero(counts)
+    table = scipy.sparse.coo_matrix(
+        (counts[cells], (cells // len(labelsB), cells % len(labelsB))),
+        shape=(len(labelsA), len(labelsB)))
+    return labelsA, labelsB, table
+
+
+def getZScore(expectedArray, generatedArray, numTrials=100, seed=None, workers=1):
     """
     Get the z-score.
 
     Defined as: z = (J - mu ) / sigma . Find mu and sigma by generating
     null models.
+
+    seed may be an int, a numpy SeedSequence or a Generator; the null models are then
+    reproducible. Trials are split into fixed chunks, each drawn from its own child of the
+    seed's SeedSequence, and with workers > 1 the chunks are scored across a process pool.
+    The chunking doesn't depend on workers, so neither does the result for a given seed.
     """
 
     if numTrials < 1:
@@ -550,10 +652,21 @@ def getZScore(expectedArray, generatedArray, numTrials=100):
 
     J = getModifiedJaccard(expectedArray, generatedArray)
 
-    nullJaccard = []
-    for i in range(numTrials):
-        nullmodel = generateNullModel(generatedArray)
-        nullJaccard.append(getModifiedJaccard(expectedArray, nullmodel))
+    if isinstance(seed, np.random.Generator):
+        seed = seed.integers(2**63, size=4)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    chunks = [min(ZSCORE_TRIALS_PER_CHUNK, numTrials - i)
+              for i in range(0, numTrials, ZSCORE_TRIALS_PER_CHUNK)]
+    chunkArgs = [(expectedArray, generatedArray, chunk, childSeed)
+                 for chunk, childSeed in zip(chunks, seed.spawn(len(chunks)))]
+
+    if workers > 1 and len(chunks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            nullJaccards = list(executor.map(getNullJaccards, *zip(*chunkArgs)))
+    else:
+        nullJaccards = [getNullJaccards(*args) for args in chunkArgs]
+    nullJaccard = np.concatenate(nullJaccards)
 
     mu = np.mean(nullJaccard)
     sigma = np.std(nullJaccard)
@@ -563,15 +676,37 @@ def getZScore(expectedArray, generatedArray, numTrials=100):
         return (J - mu) / sigma
 
 
-def generateNullModel(testPartition):
+def getNullJaccards(expectedArray, generatedArray, numTrials, seed):
+    """Return the modified Jaccards of numTrials null models of generatedArray, drawn from seed."""
+    nullModels = generateNullModels(generatedArray, numTrials, np.random.default_rng(seed))
+    return getModifiedJaccardBatch(expectedArray, nullModels)
+
+
+def generateNullModel(testPartition, rng=None):
     """
     From a given partition, generate a null model.
 
     Here the null model has the same number of boundaries as the generated partition, but with
     the boundaries arbitrarily placed (and the same number of communities in total.)
+    rng is a numpy Generator (a new one if None).
+    """
+    return generateNullModels(testPartition, 1, rng)[0]
+
+
+def generateNullModels(testPartition, n, rng=None):
     """
-    # Get the total number of communities in the partition
+    From a given partition, generate n null models as an (n x N) integer array.
 
+    Each null model has the same number of boundaries as the partition, placed arbitrarily,
+    and the same communities [1,m]. rng is a numpy Generator (a new one if None).
+
+    The boundaries of every model are drawn at once (without replacement, from the ranks of
+    random keys). The labellings of the segments are then drawn uniformly from those in
+    which adjacent segments never share a label and all m communities appear. They are
+    built in one constructive forward pass over the segments, for all the models at once,
+    with no rejection sampling: each segment's label is drawn using counts of the ways the
+    labelling so far can be completed.
+    """
     if not type(testPartition) == np.ndarray:
         raise TypeError("input must be a numpy array") 
     if not np.equal(np.mod(testPartition, 1),0).all():
@@ -584,79 +719,81 @@ def generateNullModel(testPartition):
     if set(testPartition) != set(range(1,numCommunities+1)):
         raise ValueError("communities must be labelled [1,m] where m is the number of communities")
 
-    # Get the number of boundaries
-    prevI = -1
-    numBoundaries = -1  # Start from -1 to avoid counting the start as a boundary
-    for i in testPartition:
-        if i != prevI:
-            numBoundaries += 1
-        prevI = i
-
-    # Place the boundaries arbitrarily, and assign each segment to a randomly chosen community
-    newBoundaries = []
-    for i in range(numBoundaries):
-        randint = np.random.randint(low=1, high=len(testPartition))
-        while randint in newBoundaries:
-            randint = np.random.randint(low=1, high=len(testPartition))
-        newBoundaries.append(randint)
-    newBoundaries.sort()
-    newBoundaries = [0] + newBoundaries + [len(testPartition) - 1]
-    # Fill the gaps with communities in the range 1... numComs.
-
-    # We want to randomly assign, but ensure the same number of communities.
-    # So assign minimum number of communities, then add to reach quota.
-    # FIXME this currently sometimes hangs forever, if e.g [1, 2, 1, 1]
-    # FIXME then no way of subsequently shuffling to make it work
-
-    newCommunities = [i + 1 for i in range(numCommunities)]
-    while len(newCommunities) != len(newBoundaries) - 1:
-        newCommunities.append(np.random.randint(numCommunities) + 1)
-
-    # Shuffle until no two numbers are together
-    np.random.shuffle(newCommunities)
-    valid = False
-    counter = 0
-    while not valid:
-        counter += 1
-        if counter == 10:
-            # FIXME dirty hack to break out of "too-many-repeats" problem case.
-            newCommunities = [i + 1 for i in range(numCommunities)]
-            while len(newCommunities) != len(newBoundaries) - 1:
-                newCommunities.append(np.random.randint(numCommunities) + 1)
-            counter = 0
-        valid = True
-        np.random.shuffle(newCommunities)
-        for i in range(len(newCommunities) - 1):
-            if newCommunities[i] == newCommunities[i + 1]:
-                valid = False
-
-    nullModel = np.zeros(len(testPartition), dtype=int)
-    for i in range(len(newBoundaries) - 1):
-        nullModel[newBoundaries[i]:newBoundaries[i + 1] + 1] = newCommunities[
-            i]
-
-    # Check the null model
-    # Get the number of boundaries
-    prevI = -1
-    nullModelNumBoundaries = -1  # Start from -1 to avoid counting the start as a boundary
-    for i in nullModel:
-        if i != prevI:
-            nullModelNumBoundaries += 1
-        prevI = i
-    assert set(nullModel) == set(testPartition)
-    assert len(nullModel) == len(testPartition)
-    if nullModelNumBoundaries != numBoundaries: # pragma: no cover
-        logging.error(newBoundaries)
-        logging.error(newCommunities)
-        logging.error(testPartition.tolist())
-        logging.error()
-        logging.error(nullModel.tolist())
-        raise NotImplementedError 
-    return nullModel
-
-
-def getMCS(G1, G2):
-    """Take two networkx graphs, return the MCS as a networkx graph."""
+    if rng is None:
+        rng = np.random.default_rng()
+
+    numberOfNodes = len(testPartition)
+    numBoundaries = np.count_nonzero(np.diff(testPartition))
+    numSegments = numBoundaries + 1
+
+    # Place the boundaries arbitrarily: the first numBoundaries ranks of random keys over
+    # positions [1, N-1] are a sample without replacement. Each node then takes the index of
+    # the segment it falls in.
+    isBoundary = np.zeros((n, numberOfNodes), dtype=bool)
+    if numBoundaries:
+        keys = rng.random((n, numberOfNodes - 1))
+        boundaries = np.argpartition(keys, numBoundaries - 1, axis=1)[:, :numBoundaries] + 1
+        np.put_along_axis(isBoundary, boundaries, True, axis=1)
+    segments = np.cumsum(isBoundary, axis=1)
+
+    if numCommunities == 1:
+        return np.ones((n, numberOfNodes), dtype=int)
+
+    # Fill the segments with communities in the range 1... numComs, uniformly over the
+    # labellings where no two adjacent segments repeat and every community appears.
+    # logCompletions[t, k] is the log of the number of ways to label the segments after t,
+    # given k distinct communities up to t, such that all m appear: the next segment takes
+    # a new community (m - k ways) or one already used, other than the current (k - 1).
+    distinctCounts = np.arange(numCommunities + 1)
+    with np.errstate(divide="ignore"):
+        logNewWays = np.log(np.maximum(numCommunities - distinctCounts, 0))
+        logOldWays = np.log(np.maximum(distinctCounts - 1, 0))
+    logCompletions = np.full((numSegments, numCommunities + 1), -np.inf)
+    logCompletions[-1, numCommunities] = 0
+    newProbabilities = np.zeros((numSegments, numCommunities + 1))
+    for t in range(numSegments - 2, -1, -1):
+        logNew = logNewWays + np.append(logCompletions[t + 1, 1:], -np.inf)
+        logCompletions[t] = np.logaddexp(logNew, logOldWays + logCompletions[t + 1])
+        reachable = np.isfinite(logCompletions[t])
+        newProbabilities[t, reachable] = np.exp(logNew[reachable] -
+                                                logCompletions[t, reachable])
+
+    # Communities are introduced in the order of a random permutation, so each new one is
+    # uniform over those unused; a repeated one is uniform over the others used so far.
+    order = rng.permuted(np.tile(np.arange(1, numCommunities + 1), (n, 1)), axis=1)
+    draws = rng.random((2, n, numSegments))
+    rows = np.arange(n)
+    distinct = np.ones(n, dtype=int)
+    current = np.zeros(n, dtype=int)
+    newCommunities = np.empty((n, numSegments), dtype=int)
+    newCommunities[:, 0] = order[:, 0]
+    for t in range(1, numSegments):
+        isNew = draws[0, :, t] < newProbabilities[t - 1, distinct]
+        repeated = (draws[1, :, t] * (distinct - 1)).astype(int)
+        repeated += repeated >= current
+        current = np.where(isNew, distinct, repeated)
+        distinct += isNew
+        newCommunities[:, t] = order[rows, current]
+
+    return np.take_along_axis(newCommunities, segments, axis=1)
+
+
+def getMCS(G1, G2, timeout=MCS_TIMEOUT, lowerbound=0):
+    """
+    Take two networkx graphs, return the MCS as a networkx graph.
+
+    The maximum common (induced) subgraph is found by McSplit-style branch and bound
+    (McCreesh, Prosser & Trimble, IJCAI 2017). Unmatched nodes are kept in label classes,
+    pairs of node sets that are still compatible with every match made so far, and a branch
+    is pruned once the matches plus sum_classes min(|left|, |right|) can't beat the best
+    subgraph found. Nodes are tried in order of degree.
+
+    The search runs for at most timeout seconds (None for no limit), after which the best
+    subgraph found so far is returned. The returned graph's graph['optimal'] records whether
+    the search finished, i.e. whether the subgraph is known to be maximum.
+    Only common subgraphs of more than lowerbound nodes are searched for: if there are none,
+    an empty graph is returned (much faster, when all that matters is a threshold).
+    """
 
     if not type(G1) == nx.Graph or not type(G2) == nx.Graph:
         raise TypeError("inputs for graph isomorphism must be undirected graphs")
@@ -667,25 +804,297 @@ def getMCS(G1, G2):
         G2 = G1
         G1 = temp
 
-    G1 = nx.relabel.convert_node_labels_to_integers(G1)
-    G2 = nx.relabel.convert_node_labels_to_integers(G2)
-
-    N_G1 = G1.number_of_nodes()
-    N_G2 = G2.number_of_nodes()
-    if N_G2 > 35:
-        raise ValueError("Graph is too large")
-    nodelist_G1 = list(range(N_G1))
-    nodelist_G2 = list(range(N_G2))
-    for i in range(N_G1, 0, -1):
-        # Get all choose(N_G1, i) possible selections of [1... N_G1]
-        # print(i)
-        for subgraph_G1_nodelist in itertools.combinations(nodelist_G1, i):
-            subgraph_G1 = G1.subgraph(subgraph_G1_nodelist)
-            # Check whether subgraph_G1 is isomorphic to any subgraph of the same size in G2
-            for subgraph_G2_nodelist in itertools.combinations(nodelist_G2, i):
-                subgraph_G2 = G2.subgraph(subgraph_G2_nodelist)
-                if nx.is_isomorphic(subgraph_G1, subgraph_G2):
-                    return nx.Graph(subgraph_G1)
+    # Node sets are held as bitsets (python ints). Nodes are numbered in order of degree,
+    # highest first, so the highest-degree node of a set is its lowest set bit
+    nodes_G1 = sorted(G1, key=G1.degree, reverse=True)
+    nodes_G2 = sorted(G2, key=G2.degree, reverse=True)
+    G1 = nx.relabel_nodes(G1, {node: i for i, node in enumerate(nodes_G1)})
+    G2 = nx.relabel_nodes(G2, {node: i for i, node in enumerate(nodes_G2)})
+    degrees_G1 = [G1.degree(i) for i in range(len(G1))]
+    degrees_G2 = [G2.degree(i) for i in range(len(G2))]
+    neighbours_G1 = [sum(1 << j for j in G1[i] if j != i) for i in range(len(G1))]
+    neighbours_G2 = [sum(1 << j for j in G2[i] if j != i) for i in range(len(G2))]
+    # A self-loop must map to a self-loop in an induced subgraph
+    loops_G1 = sum(1 << i for i in nx.nodes_with_selfloops(G1))
+    loops_G2 = sum(1 << i for i in nx.nodes_with_selfloops(G2))
+    all_G1 = (1 << len(G1)) - 1
+    all_G2 = (1 << len(G2)) - 1
+    popcount = int.bit_count if hasattr(int, "bit_count") else lambda x: bin(x).count("1")
+
+    def labelClass(left, right):
+        leftSize, rightSize = popcount(left), popcount(right)
+        if leftSize < rightSize:
+            return left, right, leftSize, rightSize
+        return left, right, rightSize, leftSize
+
+    def getNodes(bitset):
+        nodes = []
+        while bitset:
+            lowest = bitset & -bitset
+            nodes.append(lowest.bit_length() - 1)
+            bitset ^= lowest
+        return nodes
+
+    labelClasses = [labelClass(left, right)
+                    for left, right in [(all_G1 & ~loops_G1, all_G2 & ~loops_G2),
+                                        (loops_G1, loops_G2)]
+                    if left and right]
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    best = []
+    # The size a subgraph has to beat, to be kept
+    target = lowerbound
+    timedOut = False
+
+    def search(labelClasses, matches, bound):
+        # bound is the most nodes any extension of matches could reach, checked by the caller
+        nonlocal best, target, timedOut
+        if len(matches) > target:
+            best = matches
+            target = len(matches)
+        if not labelClasses:
+            return
+        if deadline is not None and time.monotonic() > deadline:
+            timedOut = True
+            return
+
+        # Branch on the class with fewest choices, and its highest-degree node in G1
+        k = min(range(len(labelClasses)), key=lambda x: labelClasses[x][3])
+        left, right, smaller, _ = labelClasses[k]
+        v = (left & -left).bit_length() - 1
+        bit_v, neighbours_v, degree_v = 1 << v, neighbours_G1[v], degrees_G1[v]
+        # Try the nodes of G2 with the closest degree first
+        candidates = sorted(getNodes(right), key=lambda j: abs(degrees_G2[j] - degree_v))
+        for w in candidates:
+            # Split every class by adjacency to v and w
+            notBit_w, neighbours_w = ~(1 << w), neighbours_G2[w]
+            newClasses = []
+            newBound = len(matches) + 1
+            for l, r, _, _ in labelClasses:
+                l &= ~bit_v
+                r &= notBit_w
+                l_adjacent, r_adjacent = l & neighbours_v, r & neighbours_w
+                if l_adjacent and r_adjacent:
+                    newClass = labelClass(l_adjacent, r_adjacent)
+                    newClasses.append(newClass)
+                    newBound += newClass[2]
+                l_other, r_other = l ^ l_adjacent, r ^ r_adjacent
+                if l_other and r_other:
+                    newClass = labelClass(l_other, r_other)
+                    newClasses.append(newClass)
+                    newBound += newClass[2]
+            if newBound > target:
+                search(newClasses, matches + [(v, w)], newBound)
+                if timedOut:
+                    return
+            if bound <= target:
+                return
+
+        # Finally, leave v unmatched
+        remaining = labelClasses[:k] + labelClasses[k + 1:]
+        newBound = bound - smaller
+        if left ^ bit_v:
+            newClass = labelClass(left ^ bit_v, right)
+            remaining.append(newClass)
+            newBound += newClass[2]
+        if newBound > target:
+            search(remaining, matches, newBound)
+
+    bound = sum(smaller for _, _, smaller, _ in labelClasses)
+    if bound > target:
+        search(labelClasses, [], bound)
+
+    MCS = nx.Graph(G1.subgraph([v for v, w in best]))
+    MCS.graph['optimal'] = not timedOut
+    return MCS
+
+
+def getWeakIsomorphSimilarity(G1, G2, threshold=0.5, timeout=MCS_TIMEOUT):
+    """
+    Return the similarity of two graphs, the size of their MCS over the size of the larger.
+
+    Only similarities above the threshold are computed; lower ones are returned as 0.
+    The MCS search is skipped when the node counts alone rule the threshold out, and is
+    otherwise bounded below by it.
+    Returns (similarity, optimal), where optimal is False if the MCS search ran out of time,
+    making the similarity a lower bound.
+    """
+    largest = max(G1.number_of_nodes(), G2.number_of_nodes())
+    if largest == 0 or min(G1.number_of_nodes(), G2.number_of_nodes()) <= threshold * largest:
+        return 0, True
+    MCS = getMCS(G1, G2, timeout, lowerbound=math.floor(threshold * largest))
+    similarity = MCS.number_of_nodes() / largest
+    return (similarity if similarity > threshold else 0), MCS.graph['optimal']
+
+
+def weakIsomorphMatrix(database, threshold=0.5, timeout=MCS_TIMEOUT, workers=1, deposit=True):
+    """
+    Find the similarity of every pair of supernetworks in the database above the threshold.
+
+    The similarity is that of getWeakIsomorphs (the MCS size over the larger supernetwork
+    size), for pairs from different proteins. Pairs whose node counts can't reach the
+    threshold are never compared: supernetworks are sorted by size, so each is only paired
+    with those not too much smaller. The remaining MCS searches run in chunks, across a
+    process pool if workers > 1, each bounded below by the threshold and running for at most
+    timeout seconds per pair (None for no limit). The pairs are generated chunk by chunk as
+    the work proceeds, so only the similarities found are held.
+
+    Returns (ids, similarities), the supernetwork _ids and a symmetric scipy.sparse CSR
+    matrix of the similarities above the threshold. If deposit is True these are also
+    written to the database in bulk (see Database.depositWeakIsomorphs), each marked as
+    optimal or not. Pairs whose search ran out of time are deposited even if nothing above
+    the threshold was found (with a similarity of 0), so they can be told from pairs known
+    to fall below it.
+    """
+    ids = []
+    pdbrefs = []
+    edgeArrays = []
+    for doc in database.extractAllSuperNetworks():
+        ids.append(doc['_id'])
+        pdbrefs.append(doc['pdbref'])
+        edgeArrays.append(np.asarray([[i, j] for i, j, _ in doc['data']], dtype=np.int32))
+    numberOfNodes = np.asarray([len(np.unique(edges)) for edges in edgeArrays])
+
+    # Pair each supernetwork with the smaller ones having more than threshold x its nodes
+    order = np.argsort(numberOfNodes, kind="stable")
+    sortedNumberOfNodes = numberOfNodes[order]
+    starts = np.searchsorted(sortedNumberOfNodes, threshold * sortedNumberOfNodes, side="right")
+
+    def getChunks():
+        chunk = []
+        for position, i in enumerate(order):
+            for j in order[starts[position]:position]:
+                if pdbrefs[i] != pdbrefs[j]:
+                    chunk.append((j, i))
+                    if len(chunk) == WEAK_ISOMORPH_PAIRS_PER_CHUNK:
+                        yield chunk
+                        chunk = []
+        if chunk:
+            yield chunk
+
+    # The chunks are generated as they are needed, and queued a few per worker at a time
+    chunks = getChunks()
+    batchSize = max(workers, 1) * WEAK_ISOMORPH_CHUNKS_PER_WORKER
+    results = []
+    executor = None
+    try:
+        for batch in iter(lambda: list(itertools.islice(chunks, batchSize)), []):
+            edgePairs = ([(edgeArrays[j], edgeArrays[i]) for j, i in chunk] for chunk in batch)
+            if workers > 1 and (executor or len(batch) > 1):
+                if executor is None:
+                    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                similarities = executor.map(getWeakIsomorphSimilarities, edgePairs,
+                                            itertools.repeat(threshold),
+                                            itertools.repeat(timeout))
+            else:
+                similarities = (getWeakIsomorphSimilarities(x, threshold, timeout)
+                                for x in edgePairs)
+            results.extend((j, i, similarity, optimal)
+                           for chunk, chunkSimilarities in zip(batch, similarities)
+                           for (j, i), (similarity, optimal) in zip(chunk, chunkSimilarities)
+                           if similarity or not optimal)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    rows = np.asarray([j for j, i, _, _ in results], dtype=int)
+    cols = np.asarray([i for j, i, _, _ in results], dtype=int)
+    values = np.asarray([similarity for j, i, similarity, _ in results], dtype=float)
+    matrix = scipy.sparse.coo_matrix(
+        (np.concatenate((values, values)),
+         (np.concatenate((rows, cols)), np.concatenate((cols, rows)))),
+        shape=(len(ids), len(ids))).tocsr()
+    matrix.eliminate_zeros()
+
+    if deposit and results:
+        database.depositWeakIsomorphs([(ids[j], ids[i], similarity, optimal)
+                                       for j, i, similarity, optimal in results])
+    return ids, matrix
+
+
+def getWeakIsomorphSimilarities(edgePairs, threshold=0.5, timeout=MCS_TIMEOUT):
+    """Return getWeakIsomorphSimilarity (similarity, optimal) for each pair of edge arrays."""
+    similarities = []
+    for edges1, edges2 in edgePairs:
+        G1 = nx.Graph()
+        G1.add_edges_from(edges1.tolist())
+        G2 = nx.Graph()
+        G2.add_edges_from(edges2.tolist())
+        similarities.append(getWeakIsomorphSimilarity(G1, G2, threshold, timeout))
+    return similarities
+
+
+def clusterIsomorphs(database, workers=1):
+    """
+    Group every supernetwork in the database into classes of isomorphic supernetworks.
+
+    All supernetworks are loaded once, each kept as a compact (edges x 2) array, and
+    bucketed by fingerprint (degree sequence and Weisfeiler-Lehman hash, see
+    getSuperNetworkFingerprint). Isomorphic supernetworks always share a bucket, so exact
+    checks only run within buckets; with workers > 1 the buckets are shared across a
+    process pool.
+
+    Returns a list of classes, largest first, each a list of supernetwork _ids. Every
+    supernetwork is in exactly one class.
+    """
+    buckets = {}
+    for doc in database.extractAllSuperNetworks():
+        fingerprint = doc.get('fingerprint') or getSuperNetworkFingerprint(doc['data'])
+        edges = np.asarray([[i, j] for i, j, _ in doc['data']], dtype=np.int32)
+        ids, edgeArrays = buckets.setdefault(fingerprint, ([], []))
+        ids.append(doc['_id'])
+        edgeArrays.append(edges)
+
+    # Singleton buckets need no checks
+    classes = [ids for ids, edgeArrays in buckets.values() if len(ids) == 1]
+    buckets = [bucket for bucket in buckets.values() if len(bucket[0]) > 1]
+    if workers > 1 and len(buckets) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            bucketClasses = list(executor.map(getIsomorphClasses,
+                                              [edgeArrays for ids, edgeArrays in buckets],
+                                              chunksize=max(1, len(buckets) // (4 * workers))))
+    else:
+        bucketClasses = [getIsomorphClasses(edgeArrays) for ids, edgeArrays in buckets]
+    for (ids, edgeArrays), indices in zip(buckets, bucketClasses):
+        classes.extend([ids[i] for i in isomorphClass] for isomorphClass in indices)
+
+    classes.sort(key=len, reverse=True)
+    return classes
+
+
+def getIsomorphClasses(edgeArrays):
+    """
+    Given a list of (edges x 2) arrays, group their graphs into isomorphism classes.
+
+    Returns a list of classes, each a list of indices into edgeArrays. As isomorphism is
+    transitive, each graph is only tested against one representative of each class.
+    """
+    representatives = []
+    classes = []
+    for index, edges in enumerate(edgeArrays):
+        G = nx.Graph()
+        G.add_edges_from(edges.tolist())
+        for representative, isomorphClass in zip(representatives, classes):
+            if nx.is_isomorphic(G, representative):
+                isomorphClass.append(index)
+                break
+        else:
+            representatives.append(G)
+            classes.append([index])
+    return classes
+
+
+def validateCommunityLabels(partition):
+    """Check the communities of a partition are labelled [1,m], throw a ValueError if not."""
+    labels = np.unique(np.asarray(partition))
+    if not np.array_equal(labels, np.arange(1, len(labels) + 1)):
+        raise ValueError("communities must be labelled [1,m] where m is the number of communities")
+
+
+def getEntropyFromSizes(comSize):
+    """Return the Shannon entropy of a partition, given its community sizes."""
+    p = np.asarray(comSize) / np.sum(comSize)
+    return -np.sum(p * np.log(p))
 
 
 def getShannonEntropy(partition):
@@ -694,21 +1103,19 @@ def getShannonEntropy(partition):
 
     Here n_i is the number of nodes in community i, and N the total number of nodes.
     """
-    N = len(partition)
-    H = 0
-    totalComNumber = len(set(partition))
-    if set(partition) != set(range(1,totalComNumber+1)):
-        raise ValueError("communities must be labelled [1,m] where m is the number of communities")
+    validateCommunityLabels(partition)
+    # Counted by label, so float labels such as [1., 1., 2.] work as well as integers
+    comSize = np.unique(np.asarray(partition), return_counts=True)[1]
+    return getEntropyFromSizes(comSize)
+
 
-    comSize = np.zeros(totalComNumber, dtype=int)
-    for i in range(1, totalComNumber + 1):
-        for j in range(0, N):
-            if partition[j] == i:
-                comSize[i - 1] += 1
-    logComSize = np.log(comSize / N)
-    for i in range(0, totalComNumber):
-        H -= comSize[i] / N * logComSize[i]
-    return H
+def getMutualInfoFromTable(table):
+    """Return the mutual information given a contingency table (see getContingencyTable)."""
+    N = table.data.sum()
+    rowsums = np.bincount(table.row, weights=table.data, minlength=table.shape[0])
+    colsums = np.bincount(table.col, weights=table.data, minlength=table.shape[1])
+    return np.sum(table.data / N * np.log(
+        table.data * N / (rowsums[table.row] * colsums[table.col])))
 
 
 def getMutualInfo(generated, expected):
@@ -724,76 +1131,94 @@ def getMutualInfo(generated, expected):
                 by information-based replica correlations.
                 Phys. Rev. E 80, 016109 (2009)
     """
-    N1 = len(generated)
-    N2 = len(expected)
-    if N1 != N2:
+    if len(generated) != len(expected):
         raise(TypeError("partitions must be the same length"))
-    comNumber1 = len(set(generated))
-    comNumber2 = len(set(expected))
-    if set(generated) != set(range(1,comNumber1+1)) or set(expected) != set(range(1,comNumber2+1)):
-        raise ValueError("communities must be labelled [1,m] where m is the number of communities")
+    validateCommunityLabels(generated)
+    validateCommunityLabels(expected)
 
-
-    confusionmatrix = np.zeros((comNumber1, comNumber2), dtype=int)
-    for i in range(N1):
-        confusionmatrix[generated[i] - 1, expected[i] - 1] += 1
-    rowsums = np.sum(confusionmatrix, axis=1)
-    colsums = np.sum(confusionmatrix, axis=0)
-
-    mutualinfo = 0
-    for i in range(0, comNumber1):
-        for j in range(0, comNumber2):
-            if confusionmatrix[i, j] != 0:
-                mutualinfo += confusionmatrix[i, j] / N1 * math.log(
-                    confusionmatrix[i, j] * N1 / (rowsums[i] * colsums[j]))
-    return mutualinfo
+    _, _, table = getContingencyTable(generated, expected)
+    return getMutualInfoFromTable(table)
 
 
 def getNMI(partitionA, partitionB):
     """Given two partitions, return the NMI."""
-    HA = getShannonEntropy(partitionA)
-    mutualinfo = getMutualInfo(partitionA, partitionB)
-    HB = getShannonEntropy(partitionB)
+    if len(partitionA) != len(partitionB):
+        raise(TypeError("partitions must be the same length"))
+    validateCommunityLabels(partitionA)
+    validateCommunityLabels(partitionB)
+
+    # The entropies are the marginals of the same contingency table
+    _, _, table = getContingencyTable(partitionA, partitionB)
+    HA = getEntropyFromSizes(np.bincount(table.row, weights=table.data))
+    HB = getEntropyFromSizes(np.bincount(table.col, weights=table.data))
+    mutualinfo = getMutualInfoFromTable(table)
     NMI = 2 * mutualinfo / (HA + HB)
     return NMI
 
 
 def getConductanceFromPartition(network: Network,
-                                partition: Partition) -> List[float]:
-    """Given a Network and Partition, return a conductance for each level of the partition.
-    
-    Assumes """
-    generatedArray = partition.data
-    adjacency_matrix = network.getAdjacencyMatrix()
+                                partition: Partition,
+                                sparse: bool = False) -> List[List[float]]:
+    """Given a Network and Partition, return a conductance for each community of each level.
 
+    If sparse is True, a sparse (float-weighted) adjacency matrix is used.
+    Assumes communities are labelled from 1 to m."""
     if network.edgelistid != partition.edgelistid:
         raise ValueError("network and partition must correspond to the same system!")
 
-    # NB this assumes labelling from 1 to m
-    conductances = []
-    for col in generatedArray:
-        conductance = [
-            getConductanceFromNodeSubset(
-                np.where(np.asarray(col, dtype=int) == j + 1)[0],
-                adjacency_matrix) for j in range(len(set(col)))
-        ]
-        conductances.append(conductance)
-    return conductances
+    generatedArray = np.atleast_2d(np.asarray(partition.data, dtype=int))
+    adjacency_matrix = network.getAdjacencyMatrix(sparse=sparse)
+    return [list(conductances) for conductances in
+            getConductancesFromAdjacencyMatrix(adjacency_matrix, generatedArray)]
 
 
-def getConductanceFromNodeSubset(node_subset, adjacency_matrix):
+def getConductancesFromAdjacencyMatrix(adj, comlists):
     """
-    Return conductance given an adjacency matrix and a node_subset.
+    Given an adjacency matrix and a 2D array of community lists (one row per level, as in
+    Partition.data), return a list with an array of community conductances for each level.
 
-    The node-subset is a 1D array which lists the node indices.
+    Communities are assumed to be labelled from 1 to m. The cut and volume of every
+    community come from bincounts over the nonzero adjacency entries, so each level costs
+    O(E + N) and the adjacency matrix is only validated once.
+    """
+    validateAdjacencyMatrix(adj)
+    comlists = np.atleast_2d(np.asarray(comlists, dtype=int))
+    if comlists.shape[1] != np.shape(adj)[0]:
+        raise ValueError("partition length doesn't match adjacency matrix size")
 
-    Conductance is defined for a subset S, and its complement Sbar :
+    rows, cols, weights = getAdjacencyEntries(adj)
+    strengths = np.bincount(rows, weights=weights, minlength=np.shape(adj)[0])
+    totalStrength = strengths.sum()
 
-    C = sum_{i in S, j in Sbar} (a_{ij}) / min (a(S), a(Sbar))
+    conductances = []
+    for comlist in comlists:
+        numberOfCommunities = len(np.unique(comlist))
+        rowCommunities = comlist[rows]
+        isCut = rowCommunities != comlist[cols]
+        cuts = np.bincount(rowCommunities[isCut], weights=weights[isCut],
+                           minlength=numberOfCommunities + 1)
+        volumes = np.bincount(comlist, weights=strengths, minlength=numberOfCommunities + 1)
+        communities = slice(1, numberOfCommunities + 1)
+        conductances.append(cuts[communities] / np.minimum(
+            volumes[communities], totalStrength - volumes[communities]))
+    return conductances
 
-    where a is the adjacency matrix, and a(S) is sum_{i in S, j in V} a_ij
-    i.e. the total weight of edges incident with S.
+
+def validateAdjacencyMatrix(adjacency_matrix):
+    """
+    Check the adjacency matrix is a square, symmetric, non-negative numpy array or
+    scipy.sparse matrix.
+
+    Throw a TypeError or ValueError if not.
     """
+    if scipy.sparse.issparse(adjacency_matrix):
+        if adjacency_matrix.shape[0] != adjacency_matrix.shape[1]:
+            raise ValueError("adjacency matrix must be square")
+        if (adjacency_matrix != adjacency_matrix.T).nnz:
+            raise ValueError("adjacency matrix must be symmetric")
+        if np.any(adjacency_matrix.data < 0):
+            raise ValueError("all weights must be positive")
+        return
 
     if type(adjacency_matrix) != np.ndarray or adjacency_matrix.ndim != 2:
         raise TypeError("adjacency matrix must be a 2D numpy array")
@@ -804,6 +1229,23 @@ def getConductanceFromNodeSubset(node_subset, adjacency_matrix):
     if np.any(adjacency_matrix < 0):
         raise ValueError("all weights must be positive")
 
+
+def getConductanceFromNodeSubset(node_subset, adjacency_matrix):
+    """
+    Return conductance given an adjacency matrix and a node_subset.
+
+    The node-subset is a 1D array which lists the node indices.
+    The adjacency matrix may be a numpy array or a scipy.sparse matrix.
+
+    Conductance is defined for a subset S, and its complement Sbar :
+
+    C = sum_{i in S, j in Sbar} (a_{ij}) / min (a(S), a(Sbar))
+
+    where a is the adjacency matrix, and a(S) is sum_{i in S, j in V} a_ij
+    i.e. the total weight of edges incident with S.
+    """
+    validateAdjacencyMatrix(adjacency_matrix)
+
     # check node subset map to valid indices.
     numberOfNodes = np.shape(adjacency_matrix)[0]
     for node in node_subset:
@@ -812,23 +1254,14 @@ def getConductanceFromNodeSubset(node_subset, adjacency_matrix):
                 f"total number of nodes is {numberOfNodes}, index in node_subset is {node}"
                 )
 
-    node_complement = [
-        i for i in range(len(adjacency_matrix)) if i not in node_subset
-    ]
-    numerator = 0
-    for i in node_subset:
-        for j in node_complement:
-            numerator += adjacency_matrix[i, j]
-
-    denominator_1 = 0
-    for i in node_subset:
-        for j in range(len(adjacency_matrix)):
-            denominator_1 += adjacency_matrix[i, j]
-
-    denominator_2 = 0
-    for i in node_complement:
-        for j in range(len(adjacency_matrix)):
-            denominator_2 += adjacency_matrix[i, j]
+    if scipy.sparse.issparse(adjacency_matrix):
+        adjacency_matrix = adjacency_matrix.tocsr()
+    inSubset = np.zeros(numberOfNodes, dtype=bool)
+    inSubset[np.asarray(node_subset, dtype=int)] = True
+    strengths = np.asarray(adjacency_matrix.sum(axis=1)).ravel()
+    numerator = adjacency_matrix[inSubset][:, ~inSubset].sum()
+    denominator_1 = strengths[inSubset].sum()
+    denominator_2 = strengths[~inSubset].sum()
 
     conductance = numerator / min(denominator_1, denominator_2)
 
@@ -836,17 +1269,30 @@ def getConductanceFromNodeSubset(node_subset, adjacency_matrix):
 
 
 def getModularityFromPartition(network: Network,
-                               partition: Partition) -> List[float]:
-    """Given a Network and Partition, return Newman's modularity for each level of the partition."""
+                               partition: Partition,
+                               sparse: bool = False) -> List[float]:
+    """
+    Given a Network and Partition, return Newman's modularity for each level of the partition.
+
+    If sparse is True, a sparse (float-weighted) adjacency matrix is used.
+    """
     generatedArray = np.atleast_2d(np.asarray(partition.data, dtype=int))
-    adjacency_matrix = network.getAdjacencyMatrix()
-    # Calculate Q for each level
-    Qs = []
-    for col in generatedArray:
+    adjacency_matrix = network.getAdjacencyMatrix(sparse=sparse)
+    # Calculate Q for every level in a single pass over the edges
+    return list(getModularitiesFromAdjacencyMatrix(adjacency_matrix, generatedArray))
 
-        Q = getModularityFromAdjacencyMatrix(adjacency_matrix, col)
-        Qs.append(Q)
-    return Qs
+
+def getAdjacencyEntries(adjacency_matrix):
+    """
+    Return the nonzero entries of an adjacency matrix as arrays (rows, columns, weights).
+
+    Accepts a numpy array or a scipy.sparse matrix; both directions of each edge are returned.
+    """
+    if scipy.sparse.issparse(adjacency_matrix):
+        adjacency_matrix = adjacency_matrix.tocoo()
+        return adjacency_matrix.row, adjacency_matrix.col, adjacency_matrix.data
+    rows, cols = np.nonzero(adjacency_matrix)
+    return rows, cols, adjacency_matrix[rows, cols]
 
 
 def getModularityFromAdjacencyMatrix(adj, comlist):
@@ -856,33 +1302,49 @@ def getModularityFromAdjacencyMatrix(adj, comlist):
     Q = 1/2w \sum_{i,j}( A_ij - A_i A _j / 2w  \delta( C_i, C_j))
 
       = \sum_{s} (w_{ss}/w = (w_s/2w)**2)
+
+    The adjacency matrix may be a numpy array or a scipy.sparse matrix.
     """
-    if type(adj) != np.ndarray or adj.ndim != 2:
-        raise TypeError("adjacency matrix must be a 2D numpy array")
-    if np.shape(adj)[0] != np.shape(adj)[1]:
-        raise ValueError("adjacency matrix must be square")
-    if len(comlist) != np.shape(adj)[0]:
+    return getModularitiesFromAdjacencyMatrix(adj, [comlist])[0]
+
+
+def getModularitiesFromAdjacencyMatrix(adj, comlists):
+    """
+    Given an adjacency matrix and a 2D array of community lists (one row per level, as in
+    Partition.data), return the modularity of every level as a numpy array.
+
+    Rather than summing over pairs of nodes, Q is aggregated by community:
+
+    Q = (w_in - sum_s w_s**2 / 2w) / 2w
+
+    where w_in is the total weight of edges within communities and w_s the strength of
+    community s. This is O(levels x (E + N)) with a single pass over the edges.
+    """
+    validateAdjacencyMatrix(adj)
+    comlists = np.atleast_2d(np.asarray(comlists))
+    if comlists.shape[1] != np.shape(adj)[0]:
         raise ValueError("partition length doesn't match adjacency matrix size")
-    if not np.all(adj == adj.T):
-        raise ValueError("adjacency matrix must be symmetric")
-    if np.any(adj < 0):
-        raise ValueError("all weights must be positive")
-    rowsums = np.sum(adj, axis=0)
-    N = len(adj)
-    inversestrength = 1 / np.sum(adj)
-    Q = 0.0
-    for i in range(0, N):
-        wi = rowsums[i]
-        pi = comlist[i]
-        for j in range(0, i):
-            wj = rowsums[j]
-            if pi == comlist[j]:  # if nodes i and j are in the same community
-                Q += (adj[i, j] - wi * wj * inversestrength)
-
-    ondiagonals = sum(
-        [adj[i, i] - (rowsums[i]**2) * inversestrength for i in range(N)])
-
-    return (Q * 2 + ondiagonals) * inversestrength
+
+    rows, cols, weights = getAdjacencyEntries(adj)
+    inversestrength = 1 / weights.sum()
+    strengths = np.bincount(rows, weights=weights, minlength=np.shape(adj)[0])
+
+    # Weight within communities, for all levels at once
+    sameCommunity = comlists[:, rows] == comlists[:, cols]
+    internalWeights = sameCommunity @ weights
+
+    # Strength of each community: relabel every level 0..k-1, then offset each level's
+    # labels so one bincount covers them all
+    labels, communities = np.unique(comlists, return_inverse=True)
+    numberOfLevels = len(comlists)
+    communities = communities.reshape(comlists.shape) + \
+        len(labels) * np.arange(numberOfLevels)[:, np.newaxis]
+    communityStrengths = np.bincount(
+        communities.ravel(), weights=np.tile(strengths, numberOfLevels),
+        minlength=numberOfLevels * len(labels)).reshape(numberOfLevels, len(labels))
+
+    return (internalWeights - np.sum(communityStrengths**2, axis=1) * inversestrength
+            ) * inversestrength
 
 
 def edgelistToGraph(edgelist):
@@ -2,18 +2,30 @@
 
 import numpy as np
 import math
+import itertools
 import networkx as nx
 import warnings
 import subprocess
 import os
 import logging
 import matplotlib.pyplot as plt
+import scipy.sparse
+from scipy.spatial import cKDTree
 from .database import Database
 from .atomicradii import atomicRadii
+from .structure import Structure, getStructure, writeStructureFile
 
 
 loggingLevels = {0: logging.ERROR, 1: logging.WARNING, 2: logging.INFO, 3: logging.DEBUG}
 
+# Approximate bytes of temporary storage per atom pair compared by getContactsInBlock
+TILE_BYTES_PER_PAIR = 42
+# Tile size used by the dense neighbour search if no memory ceiling is given
+DEFAULT_MAX_MEMORY_BYTES = 2**28
+# The grid search only beats the tree search for large structures at large scalings
+GRID_BACKEND_MIN_ATOMS = 8000
+GRID_BACKEND_MIN_SCALING = 4.0
+
 
 class Network:
     """Holds a edgelist and its parameters, and offers network inspection methods."""
@@ -25,7 +37,9 @@ class Network:
                  scaling,
                  chainref=None,
                  database=None,
-                 verbosity=1):
+                 verbosity=1,
+                 maxmemorybytes=None,
+                 backend="auto"):
         """
         Initialise the edgelist with a given parameter set.
 
@@ -35,6 +49,12 @@ class Network:
             - status of hydrogen atoms
             - PDB reference
             - chain (whether the network describes a full protein or a chain)
+
+        If an edgelist has to be generated, backend picks the neighbour search used
+        ("dense", "grid", "kdtree" or "auto", see getContactPairs), and maxmemorybytes
+        caps the size of each distance tile in the dense search. Giving maxmemorybytes
+        alone selects the dense search; combining it with "grid" or "kdtree" raises a
+        ValueError.
         """
         self.scaling = scaling
         self.edgelisttype = edgelisttype
@@ -69,14 +89,32 @@ class Network:
         else:
             self.logger.info("no edgelist fitting those parameters found: generating")
             edgelist = self.generateEdgelist(pdbref, edgelisttype,
-                                             hydrogenstatus, scaling, chainref)
+                                             hydrogenstatus, scaling, chainref,
+                                             maxmemorybytes, backend)
             self.edgelist = edgelist
             self.edgelistid = self.database.depositEdgelist(
                 pdbref, edgelisttype, hydrogenstatus, scaling, edgelist,
                 chainref)
 
-    def getAdjacencyMatrix(self):
-        """Return the adjacency matrix as a numpy array."""
+    def getAdjacencyMatrix(self, sparse=False):
+        """
+        Return the adjacency matrix as a numpy array.
+
+        If sparse is True, return a scipy.sparse.csr_matrix instead, built in one go from
+        the edgelist and keeping the (possibly non-integer) edge weights as floats.
+        """
+        if sparse:
+            edges = np.asarray(self.edgelist, dtype=float)
+            i = edges[:, 0].astype(int) - 1
+            j = edges[:, 1].astype(int) - 1
+            weights = edges[:, 2]
+            n = max(i.max(), j.max()) + 1
+            # Duplicate entries are summed when converting to CSR
+            return scipy.sparse.coo_matrix(
+                (np.concatenate((weights, weights)),
+                 (np.concatenate((i, j)), np.concatenate((j, i)))),
+                shape=(n, n)).tocsr()
+
         n = max([max(i, j) for i, j, k in self.edgelist])
         adj = np.zeros((n, n), dtype=int)
 
@@ -92,7 +130,9 @@ class Network:
                          edgelisttype,
                          hydrogenstatus,
                          scaling,
-                         chainref=None):
+                         chainref=None,
+                         maxmemorybytes=None,
+                         backend="auto"):
         r"""
         Generate the edgelist using the supplied parameters.
 
@@ -104,12 +144,15 @@ class Network:
         Where $ c_{ij} = s(r_i + r_j) $, and $ r_i $ is the atomic radius of atom i.
         s is here the "scaling".
 
+        The work is done by getEdgelists. The atom pairs within their cutoffs are found
+        by the neighbour search named by backend (see getContactPairs), and the cutoffs
+        are applied to whole blocks of atoms at once.
+
         FIXME this only currently works for single-atom elements in the pdb file (due to HAAD)
         FIXME I should integrate HAAD.
         FIXME I should sort out STRIDE
 
         """
-        edges = []
         assert hydrogenstatus == "noH"  # for now
         # TODO HYDROGENSTATUS STUFF GOES HERE
         # if hydrogenstatus :
@@ -122,58 +165,45 @@ class Network:
         #     # been added and all non-ATOM files (and the element info) stripped out.
         #     filename = filename + ".h"
 
-        pdbdata = self.database.extractPDBFile(pdbref)
-        if not pdbdata:
-            pdbdata = self.database.fetchPDBFileFromWeb(pdbref)
-        positions, elements, residues = extractAtomicData(pdbdata, chainref)
-        assert len(positions) == len(residues) == len(elements)
-        # get matrix of square distances
-        distance_squared = np.sum(
-            (positions[:, np.newaxis, :] - positions[np.newaxis, :, :])**2,
-            axis=-1)
-
-        n = np.shape(positions)[0]
-
-        if edgelisttype == "atomic":
-            # Then use atoms as vertices
-            for i in range(0, n):
-                for j in range(0, i):
-                    # distance = getDistance(positions, i, j)
-                    cutoff = (
-                        atomicRadii[elements[i]] + atomicRadii[elements[j]]
-                    ) * scaling
-                    # cutoff = cutoffs[i,j]
-                    if distance_squared[i, j] < cutoff * cutoff:
-                        weight = (cutoff - math.sqrt(distance_squared[i, j])
-                                  ) / cutoff
-                        edges.append([i + 1, j + 1, weight])
+        return getEdgelists(getStructure(pdbref, self.database), edgelisttype, [scaling],
+                            chainref, maxmemorybytes, backend)[0]
+
+    @classmethod
+    def sweep(cls,
+              pdbref,
+              edgelisttype,
+              hydrogenstatus,
+              scalings,
+              chainref=None,
+              database=None,
+              verbosity=1,
+              maxmemorybytes=None,
+              backend="auto"):
+        """
+        Return a Network for each of the given scalings.
 
-        elif edgelisttype == "residue":
-            # use the residues as vertices
-            edgeList = {}
-            for i in range(0, n):
-                for j in range(0, i):
-                    cutoff = (
-                        atomicRadii[elements[i]] + atomicRadii[elements[j]]
-                    ) * scaling
-                    if distance_squared[i, j] < cutoff * cutoff:
-                        res1, res2 = residues[i], residues[j]
-                        if res1 != res2:
-                            if not (res1, res2) in edgeList:
-                                edgeList[(res1, res2)] = 1
-                            else:
-                                edgeList[(res1, res2)] += 1
-
-            # Push to a list and sort by first value
-            edges = []
-            for row, weight in edgeList.items():
-                i, j = row
-                edges.append([i, j, weight])
-            edges.sort()
-        else:
-            raise RuntimeError("edgelist type must be 'atomic' or 'residue'")
-            # need to handle this in a more principled manner, with full validation.
-        return edges
+        Any edgelists not already in the database are generated together from a single
+        neighbour search (see getEdgelists), and deposited in one batch, rather than
+        parsing the PDB file and searching it once per scaling.
+        """
+        if not database:
+            database = Database(local=True)
+        missing = [
+            scaling for scaling in sorted(set(scalings))
+            if not database.extractEdgelist(pdbref, edgelisttype, hydrogenstatus,
+                                            scaling, chainref)
+        ]
+        if missing:
+            assert hydrogenstatus == "noH"  # for now
+            edgelists = getEdgelists(getStructure(pdbref, database), edgelisttype, missing,
+                                     chainref, maxmemorybytes, backend)
+            database.depositEdgelists(pdbref, edgelisttype, hydrogenstatus, missing,
+                                      edgelists, chainref)
+
+        return [
+            cls(pdbref, edgelisttype, hydrogenstatus, scaling, chainref, database,
+                verbosity, maxmemorybytes, backend) for scaling in scalings
+        ]
 
     def draw(self):
         """Draw the edgelist using NetworkX."""
@@ -213,13 +243,9 @@ class Network:
             selector = "index"
 
         # Write the pdb file out as a temp file for PyMol FIXME
-        pdb = self.database.extractPDBFile(self.pdbref)
-        if not pdb:
-            pdb = self.database.fetchPDBFileFromWeb(self.pdbref)
-        with open("temp.pdb", mode='w') as flines:
-            flines.write("\n".join(pdb))
+        structureFile = writeStructureFile(self.pdbref, self.database)
 
-        pymolScript = "load temp.pdb, {0}".format(self.pdbref)
+        pymolScript = "load {0}, {1}".format(structureFile, self.pdbref)
         pymolScript += "\n"
         if edgelisttype == "residue":
             pymolScript += "remove name ! ca\n"
@@ -277,7 +303,320 @@ png {self.pdbref}.png, width=10cm, dpi=300, ray=1
             # Run quietly
             subprocess.run(["pymol", "-c", "temp.pml"])
         os.remove("temp.pml")
-        os.remove("temp.pdb")
+        os.remove(structureFile)
+
+
+def getEdgelists(pdbdata,
+                 edgelisttype,
+                 scalings,
+                 chainref=None,
+                 maxmemorybytes=None,
+                 backend="auto"):
+    """
+    Generate the edgelists for a PDB file at each of the given scalings.
+
+    A single neighbour search is run at the largest scaling: a pair within its cutoff at
+    a smaller scaling must also be within it at the largest, so the edgelists for the
+    other scalings are found by filtering those contacts, without searching again.
+
+    pdbdata is a parsed Structure, or the PDB or mmCIF file as a list of lines.
+    Returns a list of edgelists, in the same order as scalings.
+    """
+    structure = pdbdata if isinstance(pdbdata, Structure) else Structure(pdbdata)
+    positions, elements, residues = structure.getAtomicData(chainref)
+    assert len(positions) == len(residues) == len(elements)
+    radii = getAtomicRadii(elements)
+    i, j, distance_squared = getContactPairs(positions, radii, max(scalings), backend,
+                                             maxmemorybytes)
+    pairRadii = radii[i] + radii[j]
+
+    edgelists = []
+    for scaling in scalings:
+        cutoff = pairRadii * scaling
+        within = distance_squared < cutoff * cutoff
+        if edgelisttype == "atomic":
+            # Then use atoms as vertices
+            cutoff = cutoff[within]
+            weight = (cutoff - np.sqrt(distance_squared[within])) / cutoff
+            edges = [
+                list(edge) for edge in zip((i[within] + 1).tolist(),
+                                           (j[within] + 1).tolist(), weight.tolist())
+            ]
+        elif edgelisttype == "residue":
+            # use the residues as vertices
+            edges = getResidueEdges(residues, i[within], j[within])
+        else:
+            raise RuntimeError("edgelist type must be 'atomic' or 'residue'")
+            # need to handle this in a more principled manner, with full validation.
+        edgelists.append(edges)
+    return edgelists
+
+
+def getAtomicRadii(elements):
+    """Map a list of element symbols to a numpy array of their atomic radii."""
+    symbols, inverse = np.unique(np.asarray(elements, dtype=str), return_inverse=True)
+    return np.asarray([atomicRadii[symbol] for symbol in symbols],
+                      dtype=float)[inverse.reshape(-1)]
+
+
+def getContactsInBlock(positions, radii, scaling, rowAtoms, colAtoms):
+    """
+    Return the pairs (i, j) from rowAtoms x colAtoms that lie within their cutoff.
+
+    The cutoffs for the whole block are built by broadcasting the radii, i.e.
+    c_ij = s(r_i + r_j), and compared against the squared separations in one go.
+    If rowAtoms and colAtoms are the same array, only pairs with i > j are considered.
+
+    Returns three arrays (i, j, distance_squared), with i > j, in no particular order.
+    """
+    rowPositions = positions[rowAtoms]
+    colPositions = positions[colAtoms]
+    distance_squared = np.zeros((len(rowAtoms), len(colAtoms)))
+    for axis in range(3):
+        separation = (rowPositions[:, axis, np.newaxis] -
+                      colPositions[np.newaxis, :, axis])
+        distance_squared += separation * separation
+
+    cutoff = (radii[rowAtoms][:, np.newaxis] + radii[colAtoms][np.newaxis, :]) * scaling
+    within = distance_squared < cutoff * cutoff
+    if rowAtoms is colAtoms:
+        within &= rowAtoms[:, np.newaxis] > colAtoms[np.newaxis, :]
+    a, b = np.nonzero(within)
+    i = np.maximum(rowAtoms[a], colAtoms[b])
+    j = np.minimum(rowAtoms[a], colAtoms[b])
+    return i, j, distance_squared[a, b]
+
+
+def getContactPairs(positions, radii, scaling, backend="auto", maxMemoryBytes=None):
+    """
+    Return every atom pair (i, j), with i > j, within c_ij = s(r_i + r_j) of each other.
+
+    The search is done by one of the following backends, which all give the same result:
+        - dense: every pair is compared, in tiles of at most maxMemoryBytes
+                 (getTiledPairs, defaulting to DEFAULT_MAX_MEMORY_BYTES)
+        - grid: a cell-list search (getNeighbourPairs)
+        - kdtree: a scipy cKDTree search (getKDTreePairs)
+        - auto: whichever of the above is fastest for this search (selectBackend)
+
+    Giving maxMemoryBytes asks for the tiled dense search, the only one whose memory is
+    bounded: "auto" then picks it, and the grid or tree searches raise a ValueError.
+
+    Returns three arrays (i, j, distance_squared), sorted by i and then by j.
+    """
+    if backend == "auto":
+        backend = selectBackend(len(positions), scaling, maxMemoryBytes)
+    if maxMemoryBytes is not None and backend in ("grid", "kdtree"):
+        raise ValueError("maxMemoryBytes only bounds the 'dense' backend, not", backend)
+    if backend == "dense":
+        if maxMemoryBytes is None:
+            maxMemoryBytes = DEFAULT_MAX_MEMORY_BYTES
+        return getTiledPairs(positions, radii, scaling, maxMemoryBytes)
+    elif backend == "grid":
+        return getNeighbourPairs(positions, radii, scaling)
+    elif backend == "kdtree":
+        return getKDTreePairs(positions, radii, scaling)
+    else:
+        raise ValueError("backend must be one of 'dense', 'grid', 'kdtree' or 'auto'")
+
+
+def selectBackend(numberOfAtoms, scaling, maxMemoryBytes=None):
+    """
+    Return the fastest neighbour search backend for numberOfAtoms atoms at this scaling.
+
+    If a memory ceiling (maxMemoryBytes) is given, the tiled dense search is the only one
+    to respect it, so it is always chosen.
+
+    Taken from scripts/benchmarkNeighbourSearch.py: the tree search is fastest, or level
+    with the dense search, below a few thousand atoms. The grid search only pulls ahead
+    (by 5-15%) for large structures with the long cutoffs of scalings of 4 and above.
+    The dense search never wins, and is only worth choosing to bound memory.
+    """
+    if maxMemoryBytes is not None:
+        return "dense"
+    if numberOfAtoms >= GRID_BACKEND_MIN_ATOMS and scaling >= GRID_BACKEND_MIN_SCALING:
+        return "grid"
+    return "kdtree"
+
+
+def getKDTreePairs(positions, radii, scaling):
+    """
+    Return every atom pair (i, j), with i > j, separated by less than c_ij = s(r_i + r_j).
+
+    A cKDTree is queried for all pairs within the largest cutoff any pair can have, and the
+    cutoff for each pair is then applied to the pairs it returns.
+
+    Returns three arrays (i, j, distance_squared), sorted by i and then by j.
+    """
+    positions = np.asarray(positions, dtype=float)
+    radii = np.asarray(radii, dtype=float)
+    empty = (np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=float))
+    if len(positions) < 2:
+        return empty
+    maxRadius = radii.max()
+    maxCutoff = (maxRadius + maxRadius) * scaling
+    if maxCutoff <= 0:
+        return empty
+
+    # Pad the query radius slightly, as the tree's rounding may differ from ours.
+    pairs = cKDTree(positions).query_pairs(maxCutoff * (1 + 1e-6), output_type="ndarray")
+    i = pairs[:, 0].astype(int)
+    j = pairs[:, 1].astype(int)
+    i, j = np.maximum(i, j), np.minimum(i, j)
+
+    distance_squared = np.zeros(len(i))
+    for axis in range(3):
+        separation = positions[i, axis] - positions[j, axis]
+        distance_squared += separation * separation
+    cutoff = (radii[i] + radii[j]) * scaling
+    within = distance_squared < cutoff * cutoff
+    i = i[within]
+    j = j[within]
+    distance_squared = distance_squared[within]
+    order = np.lexsort((j, i))
+    return i[order], j[order], distance_squared[order]
+
+
+def getNeighbourPairs(positions, radii, scaling):
+    """
+    Return every atom pair (i, j), with i > j, separated by less than c_ij = s(r_i + r_j).
+
+    The atoms are binned into a grid of cubic cells whose side is the largest cutoff any
+    pair can have, so that each atom need only be compared with the atoms in its own cell
+    and the 26 cells surrounding it. Each pair of neighbouring cells is visited once.
+
+    Returns three arrays (i, j, distance_squared), sorted by i and then by j (i.e. the
+    order in which a double loop over the lower triangle would find them).
+    """
+    positions = np.asarray(positions, dtype=float)
+    radii = np.asarray(radii, dtype=float)
+    n = len(positions)
+    empty = (np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=float))
+    if n < 2:
+        return empty
+    maxRadius = radii.max()
+    maxCutoff = (maxRadius + maxRadius) * scaling
+    if maxCutoff <= 0:
+        return empty
+
+    # Pad the cell size slightly, so rounding can't push a pair within the cutoff
+    # into non-adjacent cells.
+    cellSize = maxCutoff * (1 + 1e-6)
+    cellCoords = np.floor(
+        (positions - positions.min(axis=0)) / cellSize).astype(np.int64)
+    gridShape = cellCoords.max(axis=0) + 1
+    cellIndex = np.ravel_multi_index(cellCoords.T, gridShape)
+
+    # Sort the atoms by cell, so that each cell is a contiguous slice of atomOrder.
+    atomOrder = np.argsort(cellIndex, kind="stable")
+    occupiedCells, cellStarts, cellCounts = np.unique(
+        cellIndex[atomOrder], return_index=True, return_counts=True)
+    occupiedCoords = np.stack(np.unravel_index(occupiedCells, gridShape), axis=1)
+
+    # Half of the 26 surrounding cells: the other half are covered by symmetry.
+    offsets = np.asarray([
+        offset for offset in itertools.product((-1, 0, 1), repeat=3)
+        if offset > (0, 0, 0)
+    ])
+
+    # For each occupied cell, the position in occupiedCells of each neighbour (or -1)
+    neighbourCoords = occupiedCoords[:, np.newaxis, :] + offsets[np.newaxis, :, :]
+    inGrid = np.all((neighbourCoords >= 0) & (neighbourCoords < gridShape), axis=-1)
+    neighbourIndex = np.ravel_multi_index(
+        np.moveaxis(np.where(inGrid[..., np.newaxis], neighbourCoords, 0), -1, 0),
+        gridShape)
+    location = np.searchsorted(occupiedCells, neighbourIndex)
+    location[location == len(occupiedCells)] = 0
+    neighbours = np.where(
+        inGrid & (occupiedCells[location] == neighbourIndex), location, -1)
+
+    rows, cols, distances = [], [], []
+    for cell in range(len(occupiedCells)):
+        atoms = atomOrder[cellStarts[cell]:cellStarts[cell] + cellCounts[cell]]
+        others = [
+            atomOrder[cellStarts[k]:cellStarts[k] + cellCounts[k]]
+            for k in neighbours[cell] if k != -1
+        ]
+        # Compare within the cell (lower triangle only), then with the neighbours
+        blocks = [(atoms, atoms)]
+        if others:
+            blocks.append((atoms, np.concatenate(others)))
+        for rowAtoms, colAtoms in blocks:
+            i, j, distance_squared = getContactsInBlock(positions, radii, scaling,
+                                                        rowAtoms, colAtoms)
+            rows.append(i)
+            cols.append(j)
+            distances.append(distance_squared)
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    distances = np.concatenate(distances)
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], distances[order]
+
+
+def getTiledPairs(positions, radii, scaling, maxMemoryBytes):
+    """
+    Return every atom pair (i, j), with i > j, separated by less than c_ij = s(r_i + r_j).
+
+    A dense search, but performed in square tiles of row atoms against column atoms so
+    that the temporary arrays for each tile take up at most maxMemoryBytes. Only tiles on
+    or below the diagonal are visited, and the pairs found are accumulated tile by tile.
+
+    Returns three arrays (i, j, distance_squared), sorted by i and then by j.
+    """
+    positions = np.asarray(positions, dtype=float)
+    radii = np.asarray(radii, dtype=float)
+    n = len(positions)
+    blockSize = max(1, int(math.sqrt(maxMemoryBytes / TILE_BYTES_PER_PAIR)))
+
+    rows = [np.zeros(0, dtype=int)]
+    cols = [np.zeros(0, dtype=int)]
+    distances = [np.zeros(0, dtype=float)]
+    for rowStart in range(0, n, blockSize):
+        rowAtoms = np.arange(rowStart, min(rowStart + blockSize, n))
+        for colStart in range(0, rowStart + 1, blockSize):
+            if colStart == rowStart:
+                colAtoms = rowAtoms
+            else:
+                colAtoms = np.arange(colStart, min(colStart + blockSize, n))
+            i, j, distance_squared = getContactsInBlock(positions, radii, scaling,
+                                                        rowAtoms, colAtoms)
+            rows.append(i)
+            cols.append(j)
+            distances.append(distance_squared)
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    distances = np.concatenate(distances)
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], distances[order]
+
+
+def getResidueEdges(residues, i, j):
+    """
+    Collapse atom-atom contacts (i, j) onto the residues, giving a residue edgelist.
+
+    Each edge is weighted by the number of atom pairs in contact between the two residues;
+    contacts within a residue are dropped. The residue pairs are counted in one
+    np.unique call, which also leaves the edgelist sorted.
+    """
+    residues = np.asarray(residues, dtype=int)
+    res1 = residues[i]
+    res2 = residues[j]
+    between = res1 != res2
+    res1 = res1[between]
+    res2 = res2[between]
+    if not len(res1):
+        return []
+
+    # Encode each residue pair as a single integer, ordered by res1 then res2
+    base = max(res1.max(), res2.max()) + 1
+    pairs, weights = np.unique(res1 * base + res2, return_counts=True)
+    return [
+        list(edge)
+        for edge in zip((pairs // base).tolist(), (pairs % base).tolist(),
+                        weights.tolist())
+    ]
 
 
 def extractAtomicData(pdbdata, chainref=None):
@@ -292,51 +631,9 @@ def extractAtomicData(pdbdata, chainref=None):
         to be returned are non-empty.
         if the arrays are empty (i.e. a chainref has been given that the pdb doesn't
         have) then throw a RuntimeError
+
+    Only the first model is read. Residues are numbered from 1, in order of appearance.
+    The records are parsed as whole columns (see Structure), and returned as arrays.
+    mmCIF files are read from their _atom_site loop, giving the same arrays.
     """
-    positions = []
-    elements = []
-    residues = []
-    residueCounter = 0
-    prevRes = 0
-    if chainref is None:
-        for line in pdbdata:
-            if line.strip() == "ENDMDL":
-                break
-            linelist = line.rstrip()
-            if linelist[0:4] == "ATOM":
-                residueNumber = int(linelist[22:26].strip())
-                if residueNumber != prevRes:
-                    residueCounter += 1
-                prevRes = residueNumber
-                positions.append(
-                    [linelist[30:38], linelist[38:46], linelist[46:54]])
-                # elements.append(linelist[76:78].strip())
-                if linelist[12].strip():
-                    elements.append(linelist[12])
-                else:
-                    elements.append(linelist[13])
-                residues.append(residueCounter)
-        positions = np.asarray(positions, dtype=float)
-        return positions, elements, residues
-    else:
-        for line in pdbdata:
-            if line.strip() == "ENDMDL":
-                break
-            linelist = line.rstrip()
-            if linelist[0:4] == "ATOM" and linelist[21] == chainref:
-                residueNumber = int(linelist[22:26].strip())
-                if residueNumber != prevRes:
-                    residueCounter += 1
-                prevRes = residueNumber
-                positions.append(
-                    [linelist[30:38], linelist[38:46], linelist[46:54]])
-                # elements.append(linelist[76:78].strip())
-                if linelist[12].strip():
-                    elements.append(linelist[12])
-                else:
-                    elements.append(linelist[13])
-                residues.append(residueCounter)
-        positions = np.asarray(positions, dtype=float)
-        if not (positions.any() and elements and residues):
-            raise RuntimeError
-        return positions, elements, residues
+    return Structure(pdbdata).getAtomicData(chainref)
@@ -10,6 +10,7 @@ import matplotlib.pyplot as plt
 import re
 from palettable.colorbrewer.qualitative import Set3_12
 from .database import Database
+from .structure import getStructure, writeStructureFile
 
 loggingLevels = {0: logging.ERROR, 1: logging.WARNING, 2: logging.INFO, 3: logging.DEBUG}
 
@@ -184,34 +185,20 @@ class Partition:
         else:
             residues = [x['data'] for x in mappings]
 
-        # Read the pdb file, find the actual residue numbers.
+        # Find the residue counters (the node indices) of the first and last residues
+        structure = getStructure(self.pdbref, self.database)
         nodes = []
-        pdb = self.database.extractPDBFile(self.pdbref)
-        if not pdb:
-            pdb = self.database.fetchPDBFileFromWeb(self.pdbref)
         for residue in residues:
-            chain = residue['chainid']
-            startResidue = int(residue['startresidue'])
-            endResidue = int(residue['endresidue'])
-            residueCounter = 0
-            prevRes = 0
-            firstNode = -1
-            lastNode = -1
-            for line in pdb:
-                if line == "ENDMDL":
-                    break
-                if line[0:4] == "ATOM":
-                    residueNumber = int(line[22:26])
-                    if residueNumber != prevRes:
-                        residueCounter += 1
-                    prevRes = residueNumber
-                    # now we have the node index.
-                    if line[21] == chain and residueNumber == startResidue:
-                        firstNode = residueCounter
-                        startResidue = -1
-                    if line[21] == chain and residueNumber == endResidue:
-                        lastNode = residueCounter
-                        break
+            inChain = structure.chains == residue['chainid']
+            starts = np.flatnonzero(inChain & (structure.residuenumbers == int(
+                residue['startresidue'])))
+            ends = np.flatnonzero(inChain & (structure.residuenumbers == int(
+                residue['endresidue'])))
+            # The scan for the domain stops at the first atom of its last residue
+            end = ends[0] if len(ends) else len(structure.residues)
+            firstNode = structure.residues[starts[0]] if len(
+                starts) and starts[0] <= end else -1
+            lastNode = structure.residues[ends[0]] if len(ends) else -1
             nodes.append([firstNode, lastNode])
 
         # Get the size of the array, given that the list may be nested
@@ -281,14 +268,10 @@ class Partition:
         then run the bfactor alterations.
         """
         # Write the pdb file out as a temp file for PyMol FIXME
-        pdb = self.database.extractPDBFile(self.pdbref)
-        if not pdb:
-            pdb = self.database.fetchPDBFileFromWeb(self.pdbref)
-        with open("temp.pdb", mode='w') as flines:
-            flines.write("\n".join(pdb))
+        structureFile = writeStructureFile(self.pdbref, self.database)
 
         pymolScript = "\n".join([
-            "load temp.pdb, {0}_{1}".format(self.pdbref, i)
+            "load {0}, {1}_{2}".format(structureFile, self.pdbref, i)
             for i in range(len(pymolCommands))
         ])
         pymolScript += "\n"
@@ -347,7 +330,7 @@ png {self.pdbref}.png, width=10cm, dpi=300, ray=1
             # Run quietly
             subprocess.run(["pymol", "-c", "temp.pml"])
         os.remove("temp.pml")
-        os.remove("temp.pdb")
+        os.remove(structureFile)
 
     def draw(self):
         """Draw the underlying network as a NetworkX graph, colour by community."""
@@ -0,0 +1,521 @@
+"""
+Parsed protein structures, and a process-wide cache of them.
+
+A Structure holds the ATOM records of a PDB or mmCIF file as NumPy arrays, parsed once. Structures
+are shared through an LRU cache keyed by pdbref (see getStructure), so generating networks
+for several scalings or chains, finding PFAM domains and plotting all parse each file once.
+The cache can be backed by a StructureStore, a local directory of memory-mapped arrays, so
+that each structure is only parsed once at all.
+Local files, such as a mirror of the PDB archive, are read with Structure.fromFile, which
+decompresses them as it parses.
+"""
+
+import bz2
+import collections
+import gzip
+import itertools
+import operator
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+
+# Layout of the fixed-width PDB ATOM record (0-indexed columns)
+PDB_RECORD_WIDTH = 80
+PDB_ATOM_NAME_COLUMN = 12
+PDB_CHAIN_COLUMN = 21
+PDB_RESIDUE_NUMBER_COLUMNS = slice(22, 26)
+PDB_COORDINATE_COLUMNS = slice(30, 54)
+# The mmCIF category holding the atoms, and the lines that end a CIF loop
+MMCIF_ATOM_SITE = "_atom_site."
+CIF_LOOP_ENDS = ("_", "loop_", "data_", "save_", "stop_", "global_")
+# A CIF value: quoted (the quote closing only before whitespace), or bare
+CIF_TOKEN = re.compile(r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(\S+)""")
+# Values that have to be quoted in CIF if they begin with these
+CIF_QUOTED_STARTS = ("_", "#", "$", "'", '"', ";", "[", "]")
+# The _atom_site items read: coordinates, atom name, chain ID and residue number, each
+# with the items used in its place where it is missing
+MMCIF_ITEMS = (("Cartn_x", ), ("Cartn_y", ), ("Cartn_z", ), ("auth_atom_id", "label_atom_id"),
+               ("auth_asym_id", "label_asym_id"), ("auth_seq_id", "label_seq_id"))
+# Rows of an mmCIF file gathered before converting them to arrays
+MMCIF_CHUNK_ROWS = 2**16
+# Leading bytes of gzip and bzip2 files
+GZIP_MAGIC = b"\x1f\x8b"
+BZIP2_MAGIC = b"BZh"
+# The PDB reference in the name of a file from the PDB archive (e.g. pdb1abc.ent.gz, 1abc.cif)
+PDB_FILENAME = re.compile(r"^(?:pdb)?([0-9][a-z0-9]{3})\.(?:ent|pdb|cif)(?:\.gz|\.bz2)?$",
+                          re.IGNORECASE)
+# Cap on the memory held by the structure cache (about 2 million atoms)
+DEFAULT_STRUCTURE_CACHE_BYTES = 2**28
+
+
+class Structure:
+    """
+    The ATOM records of the first model of a PDB or mmCIF file, parsed into arrays.
+
+    Members (one entry per atom):
+        - positions: (atoms x 3) coordinates
+        - elements: element symbols
+        - chains: chain IDs
+        - residuenumbers: residue numbers, as given in the file
+        - residues: residues counted from 1 in order of appearance, over all chains
+        - records: the ATOM records themselves, as an (atoms x 80) byte array, or None
+          for mmCIF files, whose atoms may not fit the fixed-width format
+    """
+
+    def __init__(self, pdbdata):
+        """
+        Parse a PDB or mmCIF file, given as an iterable of lines.
+
+        mmCIF files are told apart by their first line, which opens a data block.
+        """
+        lines = iter(pdbdata)
+        first = next(lines, "")
+        while first and not first.strip():
+            first = next(lines, "")
+        lines = itertools.chain([first], lines)
+        if first.startswith("data_"):
+            self.records = None
+            (self.positions, self.elements, self.chains,
+             self.residuenumbers) = getAtomSiteColumns(lines)
+            self.residues = getResidueCounters(self.residuenumbers)
+            self.lockArrays()
+            return
+
+        self.records = getAtomRecords(lines)
+
+        # Fields are parsed by casting whole columns of fixed-width byte strings
+        self.positions = np.ascontiguousarray(
+            self.records[:, PDB_COORDINATE_COLUMNS]).view("S8").astype(float)
+        # The element is the first character of the atom name, unless that is blank
+        name = self.records[:, PDB_ATOM_NAME_COLUMN]
+        elements = np.where((name == ord(" ")) | (name == ord("\t")),
+                            self.records[:, PDB_ATOM_NAME_COLUMN + 1], name)
+        self.elements = elements.view("S1").astype(str)
+        self.chains = self.records[:, PDB_CHAIN_COLUMN].view("S1").astype(str)
+        self.residuenumbers = np.ascontiguousarray(
+            self.records[:, PDB_RESIDUE_NUMBER_COLUMNS]).view("S4").ravel().astype(int)
+        self.residues = getResidueCounters(self.residuenumbers)
+        self.lockArrays()
+
+    @classmethod
+    def fromArrays(cls, records, positions, elements, chains, residuenumbers, residues):
+        """Create a Structure from arrays already parsed, e.g. by a StructureStore."""
+        structure = cls.__new__(cls)
+        structure.records = records
+        structure.positions = positions
+        structure.elements = elements
+        structure.chains = chains
+        structure.residuenumbers = residuenumbers
+        structure.residues = residues
+        structure.lockArrays()
+        return structure
+
+    @classmethod
+    def fromFile(cls, path):
+        """
+        Parse a local PDB or mmCIF file, which may be gzip- or bzip2-compressed.
+
+        The file is decompressed and decoded as it is read, and its lines passed straight
+        to the parser, so only the ATOM records (or _atom_site values) are ever held.
+        """
+        with openStructureFile(path) as lines:
+            return cls(lines)
+
+    def lockArrays(self):
+        """
+        Make the arrays read-only, and note their size.
+
+        Structures are shared through the cache, so an array changed in place by one caller
+        would be changed for every other.
+        """
+        for array in (self.records, self.positions, self.elements, self.chains,
+                      self.residuenumbers, self.residues):
+            if array is not None:
+                array.flags.writeable = False
+        self.nbytes = self.getNBytes()
+
+    def getNBytes(self):
+        """Return the size of the arrays held."""
+        return sum(array.nbytes for array in (self.records, self.positions, self.elements,
+                                              self.chains, self.residuenumbers, self.residues)
+                   if array is not None)
+
+    def getAtomicData(self, chainref=None):
+        """
+        Return the (positions, elements, residues) of the atoms, as in extractAtomicData.
+
+        The arrays are read-only, as they are the ones held by the Structure; copy them to
+        change them.
+
+        If a chainref is given, only that chain's atoms are returned, with the residues
+        counted within the chain; a RuntimeError is thrown if there are none.
+        """
+        if chainref is None:
+            return self.positions, self.elements, self.residues
+
+        inChain = self.chains == chainref
+        positions = self.positions[inChain]
+        elements = self.elements[inChain]
+        residues = getResidueCounters(self.residuenumbers[inChain])
+        if not (positions.any() and len(elements) and len(residues)):
+            raise RuntimeError
+        return positions, elements, residues
+
+    def getPDBLines(self):
+        """Return the ATOM records as a list of lines, e.g. for loading into PyMol."""
+        if self.records is None:
+            raise ValueError("PDB lines are only held for structures read from PDB files")
+        return [bytes(record).decode("latin-1").rstrip() for record in self.records]
+
+
+class StructureStore:
+    """
+    A local directory of parsed structures, read with memory mapping.
+
+    Each Structure is written once, to <directory>/<pdbref>/, as raw .npy files: float64
+    coordinates, as parsed (so mmCIF coordinates with more than the PDB's three decimals
+    are kept exactly), element symbols and chain IDs as fixed-width strings, int32 residue
+    numbers and counters, and the ATOM records (for structures read from PDB files).
+    Reads map the files with np.load(mmap_mode='r'), and the mapped arrays are used as they
+    are, without any conversion, so only the pages used are read from disk.
+    """
+
+    def __init__(self, directory):
+        """Use (and if need be create) the given directory."""
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def getPath(self, pdbref):
+        """Return the directory holding the structure for pdbref."""
+        if not (type(pdbref) == str and len(pdbref) == 4 and pdbref.isalnum()):
+            raise IOError("Malformed PDB reference:", pdbref)
+        return os.path.join(self.directory, pdbref)
+
+    def extractStructure(self, pdbref):
+        """Return the Structure for pdbref, or None if it hasn't been deposited."""
+        path = self.getPath(pdbref)
+        if not os.path.isdir(path):
+            return None
+
+        def load(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode='r')
+
+        records = load("records") if os.path.exists(os.path.join(path, "records.npy")) else None
+        return Structure.fromArrays(records, load("positions"), load("elements"),
+                                    load("chains"), load("residuenumbers"), load("residues"))
+
+    def depositStructure(self, pdbref, structure):
+        """
+        Write a Structure to the store, unless it is there already.
+
+        The files are written to a temporary directory, which is then renamed into place,
+        so that readers never see a partly written structure.
+        """
+        path = self.getPath(pdbref)
+        if os.path.isdir(path):
+            return
+        arrays = {
+            "positions": np.asarray(structure.positions, dtype=np.float64),
+            "elements": np.asarray(structure.elements, dtype=str),
+            "chains": np.asarray(structure.chains, dtype=str),
+            "residuenumbers": np.asarray(structure.residuenumbers, dtype=np.int32),
+            "residues": np.asarray(structure.residues, dtype=np.int32),
+        }
+        if structure.records is not None:
+            arrays["records"] = np.asarray(structure.records, dtype=np.uint8)
+
+        temporaryPath = tempfile.mkdtemp(prefix=pdbref + ".", dir=self.directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(temporaryPath, name + ".npy"), array)
+        try:
+            os.rename(temporaryPath, path)
+        except OSError:
+            # Deposited by someone else in the meantime
+            shutil.rmtree(temporaryPath)
+
+
+class StructureCache:
+    """
+    A least-recently-used cache of Structures, keyed by pdbref.
+
+    Once the Structures held take more than maxbytes, the least recently used are dropped.
+    A Structure bigger than maxbytes by itself is returned but never held.
+    If a StructureStore is given, misses are read from it where possible, and structures
+    parsed from PDB files are deposited in it.
+    """
+
+    def __init__(self, maxbytes=DEFAULT_STRUCTURE_CACHE_BYTES, store=None):
+        """Create an empty cache."""
+        self.maxbytes = maxbytes
+        self.store = store
+        self.nbytes = 0
+        self.structures = collections.OrderedDict()
+
+    def getStructure(self, pdbref, database):
+        """
+        Return the Structure for pdbref, parsing it on a cache miss.
+
+        The structure is taken from the store, if there is one and it is there. Otherwise
+        the PDB (or mmCIF) file is taken from the database, or from the web if it isn't there.
+        """
+        if pdbref in self.structures:
+            self.structures.move_to_end(pdbref)
+            return self.structures[pdbref]
+
+        structure = self.store.extractStructure(pdbref) if self.store else None
+        if structure is None:
+            pdbdata = database.extractPDBFile(pdbref)
+            if not pdbdata:
+                pdbdata = database.fetchPDBFileFromWeb(pdbref)
+            structure = Structure(pdbdata)
+            if self.store:
+                self.store.depositStructure(pdbref, structure)
+        if structure.nbytes <= self.maxbytes:
+            self.structures[pdbref] = structure
+            self.nbytes += structure.nbytes
+            while self.nbytes > self.maxbytes:
+                pdbref, dropped = self.structures.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+        return structure
+
+    def clear(self):
+        """Drop every Structure."""
+        self.structures.clear()
+        self.nbytes = 0
+
+
+# The cache shared by everything in the process
+structureCache = StructureCache()
+
+
+def getStructure(pdbref, database):
+    """Return the Structure for pdbref from the process-wide cache (see StructureCache)."""
+    return structureCache.getStructure(pdbref, database)
+
+
+def writeStructureFile(pdbref, database, basename="temp"):
+    """
+    Write the whole PDB (or mmCIF) file for pdbref out for PyMol, and return its name.
+
+    Every record is kept (HETATM, HELIX, SHEET, CONECT...), as the file is taken from the
+    database, or from the web if it isn't there, rather than rebuilt from a Structure.
+    mmCIF files are given a .cif extension so that PyMol reads them as such.
+    """
+    pdbdata = database.extractPDBFile(pdbref)
+    if not pdbdata:
+        pdbdata = database.fetchPDBFileFromWeb(pdbref)
+    first = next((line for line in pdbdata if line.strip()), "")
+    filename = basename + (".cif" if first.startswith("data_") else ".pdb")
+    with open(filename, mode='w') as flines:
+        flines.write("\n".join(pdbdata))
+    return filename
+
+
+def useStructureStore(directory):
+    """
+    Back the process-wide cache with a StructureStore in the given directory.
+
+    Passing None stops using a store. Returns the store.
+    """
+    structureCache.store = None if directory is None else StructureStore(directory)
+    return structureCache.store
+
+
+def openStructureFile(path):
+    """
+    Open a PDB or mmCIF file for reading as lines of text.
+
+    Compressed files are recognised by their leading bytes rather than their names, and
+    decompressed as they are read.
+    """
+    with open(path, "rb") as structureFile:
+        magic = structureFile.read(len(BZIP2_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, "rt", encoding="latin-1")
+    if magic == BZIP2_MAGIC:
+        return bz2.open(path, "rt", encoding="latin-1")
+    return open(path, encoding="latin-1")
+
+
+def getPDBRef(path):
+    """Return the pdbref of a file named as in the PDB archive, or None for other files."""
+    match = PDB_FILENAME.match(os.path.basename(path))
+    return match.group(1).lower() if match else None
+
+
+def getAtomRecords(pdbdata):
+    """
+    Return the ATOM records of the first model of a PDB file as an (atoms x 80) byte array.
+
+    The records are filtered out in one pass and joined into a single buffer, each padded
+    to the fixed width of 80 columns, so that fields can be read as whole columns with
+    NumPy rather than by slicing each line.
+    """
+    atomLines = []
+    for line in pdbdata:
+        if line.startswith("ATOM"):
+            atomLines.append(line.rstrip("\r\n")[:PDB_RECORD_WIDTH].ljust(PDB_RECORD_WIDTH))
+        elif line.strip() == "ENDMDL":
+            break
+    buffer = "".join(atomLines).encode("latin-1", "replace")
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(-1, PDB_RECORD_WIDTH)
+
+
+def getAtomSiteLines(mmcifdata):
+    """
+    Yield the lines of an mmCIF file opening a data block or in its _atom_site loop.
+
+    These are all that Structure reads, so files are stripped down to them for storage.
+    """
+    previous = ""
+    inLoop = False
+    for line in mmcifdata:
+        stripped = line.strip()
+        if inLoop:
+            if stripped.startswith(CIF_LOOP_ENDS) and not stripped.startswith(MMCIF_ATOM_SITE):
+                return
+            yield line
+        elif stripped.startswith("data_"):
+            yield line
+        elif stripped.startswith(MMCIF_ATOM_SITE) and previous.strip() == "loop_":
+            inLoop = True
+            yield previous
+            yield line
+        if stripped:
+            previous = line
+
+
+def getAtomSiteColumns(mmcifdata):
+    """
+    Return the (positions, elements, chains, residuenumbers) of the ATOM records of the
+    first model of an mmCIF file, read from its _atom_site loop.
+
+    The rows are streamed from getAtomSiteRows, and converted to NumPy arrays every
+    MMCIF_CHUNK_ROWS rows, so that only a chunk of the values is ever held as strings.
+    As for PDB files, each element is the first character of the atom name.
+    """
+
+    def getChunk(rows):
+        x, y, z, atomNames, chains, residueNumbers = zip(*rows)
+        return (np.array([x, y, z], dtype=float).T, np.array(atomNames).astype("U1"),
+                np.array(chains), np.array(residueNumbers, dtype=int))
+
+    chunks = [(np.zeros((0, 3)), np.zeros(0, dtype=str), np.zeros(0, dtype=str),
+               np.zeros(0, dtype=int))]
+    rows = []
+    for row in getAtomSiteRows(mmcifdata):
+        rows.append(row)
+        if len(rows) == MMCIF_CHUNK_ROWS:
+            chunks.append(getChunk(rows))
+            rows = []
+    if rows:
+        chunks.append(getChunk(rows))
+    return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+
+
+def getAtomSiteRows(mmcifdata):
+    """
+    Yield the values of MMCIF_ITEMS for each ATOM record of the first model of an mmCIF
+    file, as tuples of strings.
+
+    The file is streamed: the columns of the items are found from the loop header, and
+    only their values kept from each row. Where an item is missing, its alternatives (the
+    label_ rather than the author's IDs) are used.
+    """
+    lines = getAtomSiteLines(mmcifdata)
+    names = []
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith(MMCIF_ATOM_SITE):
+            names.append(stripped.split()[0][len(MMCIF_ATOM_SITE):])
+        elif names:
+            lines = itertools.chain([line], lines)
+            break
+    if not names:
+        return
+
+    def getColumn(alternatives):
+        for name in alternatives:
+            if name in names:
+                return names.index(name)
+        raise ValueError("mmCIF _atom_site loop has no item", alternatives[0])
+
+    getValues = operator.itemgetter(*[getColumn(item) for item in MMCIF_ITEMS])
+    group = names.index("group_PDB") if "group_PDB" in names else None
+    model = names.index("pdbx_PDB_model_num") if "pdbx_PDB_model_num" in names else None
+
+    firstModel = None
+    for row in getLoopRows(lines, len(names)):
+        if model is not None:
+            if firstModel is None:
+                firstModel = row[model]
+            elif row[model] != firstModel:
+                return
+        if group is None or row[group] == "ATOM":
+            yield getValues(row)
+
+
+def getReducedAtomSiteLines(mmcifdata):
+    """
+    Return an mmCIF file reduced to what Structure reads, as a list of lines.
+
+    Only the ATOM records of the first model are kept, and only the MMCIF_ITEMS of each,
+    so that large structures take as little space as possible when stored.
+    """
+    lines = iter(mmcifdata)
+    reduced = [next((line.strip() for line in lines if line.strip()), "data_"), "loop_"]
+    reduced.extend(MMCIF_ATOM_SITE + alternatives[0] for alternatives in MMCIF_ITEMS)
+    reduced.extend(" ".join(map(quoteCIFValue, row)) for row in getAtomSiteRows(lines))
+    return reduced
+
+
+def quoteCIFValue(value):
+    """Return a CIF value as a token, quoted if it can't be written bare."""
+    if value and not value.startswith(CIF_QUOTED_STARTS) and value.split() == [value]:
+        return value
+    return '"{}"'.format(value) if "'" in value else "'{}'".format(value)
+
+
+def getLoopRows(lines, numberOfItems):
+    """
+    Yield the rows of a CIF loop, as lists of values, from the lines following its header.
+
+    Rows normally take a line each, but may be split across lines, or share them, and
+    hold quoted values and semicolon-delimited text fields.
+    """
+    values = []
+    lines = iter(lines)
+    for line in lines:
+        if line.startswith(";"):
+            text = [line[1:].rstrip("\r\n")]
+            for line in lines:
+                if line.startswith(";"):
+                    break
+                text.append(line.rstrip("\r\n"))
+            values.append("\n".join(text))
+            line = line[1:]
+        if line.lstrip().startswith("#"):
+            continue
+        if "'" in line or '"' in line:
+            fields = [a or b or c for a, b, c in CIF_TOKEN.findall(line)]
+        else:
+            fields = line.split()
+        if not values and len(fields) == numberOfItems:
+            yield fields
+            continue
+        values.extend(fields)
+        while len(values) >= numberOfItems:
+            yield values[:numberOfItems]
+            values = values[numberOfItems:]
+
+
+def getResidueCounters(residueNumbers):
+    """
+    Number the residues from 1 in order of appearance.
+
+    A new residue starts whenever the residue number changes from the previous atom's.
+    """
+    residueNumbers = np.asarray(residueNumbers, dtype=int)
+    return np.cumsum(residueNumbers != np.concatenate(([0], residueNumbers[:-1])))
@@ -7,6 +7,7 @@ from pymongo.errors import DuplicateKeyError
 # Necessary to ensure the matplotlib testing succeeds even without Xwindows backend
 import matplotlib
 matplotlib.use('Agg')
+import proteinnetworks.structure
 
 
 data = [{
@@ -687,6 +688,18 @@ def mock_database(monkeypatch):
                                 self.inserted_id = ObjectId("58dbe045ef677d54224a01d2")
                         return Result()
 
+                def insert_many(docs):
+                    """Pretend to add several documents, returning a class with "inserted_ids"."""
+                    ids = []
+                    for doc in docs:
+                        Garry.proteinnetworks.proteinnetworks.insert_one(doc)
+                        ids.append(ObjectId())
+
+                    class Result:
+                        def __init__(self):
+                            self.inserted_ids = ids
+                    return Result()
+
                 def find_one(doc):
                     """Return the document matching the given query."""
                     global data
@@ -836,6 +849,14 @@ def mock_matplotlib(monkeypatch):
     monkeypatch.setattr("matplotlib.pyplot.show", show)
 
 
+@pytest.fixture(autouse=True)
+def clear_structure_cache():
+    """Empty the process-wide structure cache, so that tests can't see each other's PDB files."""
+    proteinnetworks.structure.structureCache.clear()
+    yield
+    proteinnetworks.structure.structureCache.clear()
+
+
 
 # @pytest.fixture(autouse=True)
 # def mock_osremove(monkeypatch):
@@ -5,6 +5,7 @@ Functions:
 __init__ x
 extractEdgelist
 depositEdgelist x
+depositEdgelists x
 extractPDBFile x
 fetchPDBFileFromWeb
 extractPartition x
@@ -17,6 +18,11 @@ extractMappings
 extractSuperNetwork
 depositSuperNetwork
 extractAllSuperNetworks
+depositWeakIsomorphs
+getSuperNetworkFingerprint
+LocalCollection.create_index
+LocalCollection.update_one
+LocalCollection.bulk_write
 """
 
 import proteinnetworks.database
@@ -590,6 +596,69 @@ def test_database_fetchpdbfilefromweb_success(mock_database, mock_urlopen):
     assert len(pdbfile) == 11
 
 
+def mockCIFUrlopen(monkeypatch, cif, urls):
+    """Monkeypatch urlopen to serve no PDB file, and the given mmCIF file."""
+    import urllib.error
+
+    class mockurlopen:
+        def __init__(self, url):
+            urls.append(url)
+            if url.endswith(".pdb"):
+                raise urllib.error.HTTPError(url, 404, "Not Found", None, None)
+
+        def readlines(self):
+            return cif
+
+    monkeypatch.setattr("urllib.request.urlopen", mockurlopen)
+
+
+CIF_HEADER = [b"data_3RTY\n", b"loop_\n", b"_citation.id\n", b"primary\n", b"#\n", b"loop_\n"] + [
+    b"_atom_site." + item + b"\n" for item in [
+        b"group_PDB", b"id", b"label_atom_id", b"Cartn_x", b"Cartn_y", b"Cartn_z",
+        b"auth_seq_id", b"auth_asym_id", b"auth_atom_id", b"pdbx_PDB_model_num"]]
+
+
+def test_database_fetchpdbfilefromweb_mmcif(mock_database, monkeypatch):
+    """Assert that a structure without a PDB file is fetched as mmCIF, and reduced."""
+    cif = CIF_HEADER + [b"ATOM 1 N 1.0 2.0 3.0 1 A N 1\n",
+                        b"HETATM 2 FE 1.0 2.0 3.0 2 A FE 1\n",
+                        b"ATOM 3 \"O5'\" 1.0 2.0 3.0 1 AB O5' 1\n",
+                        b"ATOM 4 N 1.0 2.0 3.0 1 A N 2\n", b"#\n"]
+    urls = []
+    mockCIFUrlopen(monkeypatch, cif, urls)
+    db = proteinnetworks.database.Database(password="bla")
+    pdbfile = db.fetchPDBFileFromWeb("3rty")
+    assert urls[-1].endswith("3rty.cif")
+    assert pdbfile == ["data_3RTY", "loop_", "_atom_site.Cartn_x", "_atom_site.Cartn_y",
+                       "_atom_site.Cartn_z", "_atom_site.auth_atom_id", "_atom_site.auth_asym_id",
+                       "_atom_site.auth_seq_id", "1.0 2.0 3.0 N A 1", "1.0 2.0 3.0 O5' AB 1"]
+
+
+def test_database_fetchpdbfilefromweb_mmcif_document_size(mock_database, monkeypatch):
+    """
+    Assert that reduced mmCIF files of ribosome-sized structures (300,000 atoms) fit in a
+    MongoDB document, and that larger ones are returned without being deposited.
+    """
+    import bson
+    rows = [("ATOM {} CA 123.456 -12.345 1.234 1234 AB CA 1\n".format(i)).encode()
+            for i in range(1000)]
+    urls = []
+    mockCIFUrlopen(monkeypatch, CIF_HEADER + rows, urls)
+    db = proteinnetworks.database.Database(password="bla")
+    inserted = []
+    monkeypatch.setattr(db.collection, "insert_one", inserted.append, raising=False)
+    pdbfile = db.fetchPDBFileFromWeb("3rty")
+    assert len(inserted) == 1
+    assert len(bson.encode(inserted[0])) * 300 < proteinnetworks.database.MONGO_MAX_DOCUMENT_BYTES
+
+    monkeypatch.setattr(proteinnetworks.database, "MONGO_MAX_DOCUMENT_BYTES",
+                        len(bson.encode(inserted[0])) - 1)
+    assert db.fetchPDBFileFromWeb("3rty") == pdbfile
+    assert len(inserted) == 1
+    structure = proteinnetworks.structure.Structure(pdbfile)
+    assert len(structure.positions) == 1000
+
+
 def test_database_fetchpdbfilefromweb_error(mock_database, mock_urlopen):
     """Assert that a malformed PDB reference will cause an IOError."""
     db = proteinnetworks.database.Database(password="bla")
@@ -654,6 +723,49 @@ def test_database_depositedgelist_already_present(mock_database):
         db.depositEdgelist(**depositionArgs)
 
 
+def test_database_depositedgelists_normal(mock_database):
+    """Test that a batch of edgelists is deposited, returning an id for each."""
+    db = proteinnetworks.database.Database(password="bla")
+    depositionArgs = {
+        'pdbref': '2vc5',
+        'edgelists': [[[2, 1, 44], [3, 1, 40]], [[2, 1, 50], [3, 1, 42], [3, 2, 1]]],
+        'edgelisttype': 'residue',
+        'hydrogenstatus': 'noH',
+        'scalings': [4.0, 4.5]
+    }
+    resultIds = db.depositEdgelists(**depositionArgs)
+    assert len(resultIds) == 2
+    assert all(type(resultId) == ObjectId for resultId in resultIds)
+
+
+def test_database_depositedgelists_already_present(mock_database):
+    """Test that if any edgelist in the batch is already present, an exception is thrown."""
+    db = proteinnetworks.database.Database(password="bla")
+    depositionArgs = {
+        'pdbref': '2vcr',
+        'edgelists': [[[2, 1, 44], [3, 1, 40]], [[2, 1, 50], [3, 1, 42], [3, 2, 1]]],
+        'edgelisttype': 'residue',
+        'hydrogenstatus': 'noH',
+        'scalings': [4.0, 4.5]
+    }
+    with pytest.raises(IOError):
+        db.depositEdgelists(**depositionArgs)
+
+
+def test_database_depositedgelists_invalid_edges(mock_database):
+    """Test that every edgelist in the batch is validated."""
+    db = proteinnetworks.database.Database(password="bla")
+    depositionArgs = {
+        'pdbref': '2vc5',
+        'edgelists': [[[2, 1, 44], [3, 1, 40]], [[2, 2, 50]]],
+        'edgelisttype': 'residue',
+        'hydrogenstatus': 'noH',
+        'scalings': [4.0, 4.5]
+    }
+    with pytest.raises(IOError):
+        db.depositEdgelists(**depositionArgs)
+
+
 def test_database_depositedgelist_pdbref_invalid(mock_database):
     """Test that a malformed PDB reference is rejected."""
     db = proteinnetworks.database.Database(password="bla")
@@ -1046,6 +1158,40 @@ def test_local_database_depositpartition_doc_already_present(mock_database):
 # """
 
 
+def test_local_database_extractedgelist_without_chainref(mock_database):
+    """Check that an edgelist deposited without a chainref can be found again."""
+    db = proteinnetworks.database.Database(local=True)
+    depositionArgs = {
+        'pdbref': '2vc5',
+        'edges':
+        [[2, 1, 44], [3, 1, 40], [3, 2, 56], [4, 2, 56], [4, 3, 70], [5, 3, 23]],
+        'edgelisttype': 'residue',
+        'hydrogenstatus': 'noH',
+        'scaling': 4.5
+    }
+    edgelistId = db.depositEdgelist(**depositionArgs)
+    doc = db.extractEdgelist('2vc5', 'residue', 'noH', 4.5)
+    assert doc['_id'] == edgelistId
+    assert db.extractEdgelist('2vc5', 'residue', 'noH', 4.5, chainref='A') is None
+
+
+def test_local_database_depositedgelists(mock_database):
+    """Check a batch deposit stores every edgelist, and refuses to store them twice."""
+    db = proteinnetworks.database.Database(local=True)
+    depositionArgs = {
+        'pdbref': '2vc5',
+        'edgelists': [[[2, 1, 44], [3, 1, 40]], [[2, 1, 50], [3, 1, 42], [3, 2, 1]]],
+        'edgelisttype': 'residue',
+        'hydrogenstatus': 'noH',
+        'scalings': [4.0, 4.5]
+    }
+    resultIds = db.depositEdgelists(**depositionArgs)
+    assert db.getNumberOfDocuments() == 2
+    assert db.extractEdgelist('2vc5', 'residue', 'noH', 4.5)['_id'] == resultIds[1]
+    with pytest.raises(IOError):
+        db.depositEdgelists(**depositionArgs)
+
+
 def test_local_database_extractdocumentgivenid_normal(mock_database):
     """Assert that the database returns the right document given an id."""
     db = proteinnetworks.database.Database(local=True)
@@ -1062,6 +1208,84 @@ def test_local_database_extractdocumentgivenid_normal(mock_database):
     assert doc
 
 
+def test_getsupernetworkfingerprint_isomorphic():
+    """Relabelled and reweighted copies of a supernetwork share a fingerprint."""
+    data = [[1, 2, 1], [2, 3, 4], [3, 4, 1], [4, 2, 2]]
+    relabelled = [[7, 5, 3], [5, 6, 1], [6, 8, 1], [8, 5, 9]]
+    fingerprint = proteinnetworks.database.getSuperNetworkFingerprint(data)
+    assert fingerprint == proteinnetworks.database.getSuperNetworkFingerprint(relabelled)
+    assert fingerprint.startswith("3,2,2,1:")
+
+
+def test_getsupernetworkfingerprint_not_isomorphic():
+    """Graphs with the same degree sequence but different structure are told apart."""
+    triangle = [[1, 2, 1], [1, 3, 1], [1, 4, 1], [2, 5, 1], [2, 6, 1], [3, 4, 1]]
+    square = [[1, 3, 1], [1, 4, 1], [1, 5, 1], [2, 3, 1], [2, 4, 1], [2, 6, 1]]
+    fingerprint1 = proteinnetworks.database.getSuperNetworkFingerprint(triangle)
+    fingerprint2 = proteinnetworks.database.getSuperNetworkFingerprint(square)
+    assert fingerprint1.split(":")[0] == fingerprint2.split(":")[0]
+    assert fingerprint1 != fingerprint2
+
+
+def test_local_database_extractallsupernetworks_fingerprint(mock_database):
+    """Only supernetworks sharing the fingerprint (and not the given pdbref) are returned."""
+    db = proteinnetworks.database.Database(local=True)
+    triangle = [[1, 2, 1], [2, 3, 1], [1, 3, 1]]
+    db.depositSuperNetwork("1abc", ObjectId(), 0, triangle)
+    db.depositSuperNetwork("2abc", ObjectId(), 0, [[4, 5, 2], [5, 6, 1], [4, 6, 1]])
+    db.depositSuperNetwork("3abc", ObjectId(), 0, [[1, 2, 1], [2, 3, 1]])
+    fingerprint = proteinnetworks.database.getSuperNetworkFingerprint(triangle)
+    cursor = db.extractAllSuperNetworks(pdbref="1abc", fingerprint=fingerprint)
+    assert [doc['pdbref'] for doc in cursor] == ["2abc"]
+    assert db.extractAllSuperNetworks(pdbref="1abc").count() == 2
+
+
+def test_local_database_depositweakisomorphs(mock_database):
+    """Weak isomorphs are deposited in bulk, one document per pair, upserted on the pair."""
+    db = proteinnetworks.database.Database(local=True)
+    id1, id2, id3 = sorted([ObjectId(), ObjectId(), ObjectId()])
+    resultIds = db.depositWeakIsomorphs([(id1, id2, 0.75, False), (id3, id2, 1, True)])
+    assert len(resultIds) == 2
+    doc = db.extractDocumentGivenId(resultIds[0])
+    assert doc['doctype'] == "weakisomorph"
+    assert doc['supernetworkids'] == [id1, id2]
+    assert doc['similarity'] == 0.75
+    assert doc['optimal'] is False
+    assert db.extractDocumentGivenId(resultIds[1])['supernetworkids'] == [id2, id3]
+
+    # Depositing the pairs again, either way round, updates rather than duplicates them
+    assert db.depositWeakIsomorphs([(id2, id1, 0.8, True), (id2, id3, 1, True)]) == {}
+    assert db.collection.find({"doctype": "weakisomorph"}).count() == 2
+    assert db.extractDocumentGivenId(resultIds[0])['similarity'] == 0.8
+    assert db.extractDocumentGivenId(resultIds[0])['optimal'] is True
+
+
+def test_localcollection_update_one():
+    """Records are updated in place, or inserted from the query and update with upsert."""
+    collection = proteinnetworks.database.LocalCollection()
+    assert collection.update_one({"doctype": "a", "x": 1}, {"$set": {"y": 2}}) is None
+    assert collection.find({}).count() == 0
+    id = collection.update_one({"doctype": "a", "x": 1, "z": {"$exists": False}},
+                               {"$set": {"y": 2}}, upsert=True)
+    assert collection.find_one({"_id": id}) == {"doctype": "a", "x": 1, "y": 2, "_id": id}
+    assert collection.update_one({"doctype": "a", "x": 1}, {"$set": {"y": 3}}) is None
+    assert collection.find_one({"_id": id})["y"] == 3
+
+
+def test_localcollection_create_index():
+    """Records are indexed by value on insertion, and on creating the index."""
+    collection = proteinnetworks.database.LocalCollection()
+    collection.insert_one({"doctype": "supernetwork", "fingerprint": "a"})
+    collection.create_index("fingerprint")
+    collection.insert_one({"doctype": "supernetwork", "fingerprint": "b"})
+    collection.insert_one({"doctype": "supernetwork", "fingerprint": "a"})
+    collection.insert_one({"doctype": "edgelist"})
+    assert len(collection.indices["fingerprint"]["a"]) == 2
+    assert collection.find({"fingerprint": "a"}).count() == 2
+    assert collection.find({"fingerprint": "c"}).count() == 0
+    assert collection.find({"doctype": "supernetwork"}).count() == 3
+
+
 # def test_local_database_extractdocumentgivenid_missing(mock_database):
 #     """Assert that the database returns None if the document to be found is missing."""
 #     db = proteinnetworks.database.Database(local=True)
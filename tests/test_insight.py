@@ -4,6 +4,10 @@ import pytest
 import numpy as np
 import networkx as nx
 import math
+import time
+import itertools
+import collections
+import scipy.sparse
 
 from scipy.linalg import block_diag
 
@@ -12,26 +16,53 @@ Unit tests for the Insight module.
 
 Units
 
+BaseSuperNetwork (via SuperNetwork)
+    data, graph, fingerprint, numberOfNodes
+
 SuperNetwork
     __init__
     fromPartitionId (classmethod, weird)
+    fromAllLevels (classmethod)
     draw
     getIsomorphs
     getWeakIsomorphs
 
 SuperNetworkNullModel
 
+SuperNetworkNullEnsemble
+    __init__
+    getNullEdgeList
+    getIsomorphClassFrequencies
+    getIsomorphPValue
+
+getCommunityEdgeList
+getCommunityEdgeLists
+getCommunityEdgeArrays
 getModifiedJaccard
+getModifiedJaccardBatch
+getContingencyTable
 getZScore
+getNullJaccards
 generateNullModel
+generateNullModels
 getMCS
+getWeakIsomorphSimilarity
+weakIsomorphMatrix
+getWeakIsomorphSimilarities
+clusterIsomorphs
+getIsomorphClasses
+validateCommunityLabels
 getShannonEntropy
 getMutualInfo
 getNMI
 getConductanceFromPartition
 getConductanceFromNodeSubset
+getConductancesFromAdjacencyMatrix
 getModularityFromPartition
 getModularityFromAdjacencyMatrix
+getModularitiesFromAdjacencyMatrix
+getAdjacencyEntries
+validateAdjacencyMatrix
 edgelistToGraph
 """
 
@@ -155,6 +186,37 @@ def test_supernetwork_init_invalid_level(mock_database):
         superNetwork = proteinnetworks.insight.SuperNetwork(partition, level=10)
 
 
+def test_supernetwork_fromalllevels(mock_database):
+    """Every level gets a supernetwork, matching those generated one at a time"""
+    db = proteinnetworks.database.Database(password="bla")
+    partitionArgs = {
+        'pdbref': '1ubq',
+        'N': 10,
+        'edgelistid': ObjectId('58dbe03fef677d54224a01da'),
+        'detectionmethod': 'Infomap',
+        'r': -1,
+        "database": db
+    }
+    partition = proteinnetworks.partition.Partition(**partitionArgs)
+    requests = []
+    extractDocumentGivenId = db.extractDocumentGivenId
+
+    def countingExtractDocumentGivenId(documentid):
+        requests.append(documentid)
+        return extractDocumentGivenId(documentid)
+
+    db.extractDocumentGivenId = countingExtractDocumentGivenId
+    superNetworks = proteinnetworks.insight.SuperNetwork.fromAllLevels(partition)
+    # The edgelist is extracted once for all the levels
+    assert requests == [partition.edgelistid]
+    db.extractDocumentGivenId = extractDocumentGivenId
+    assert len(superNetworks) == len(partition.data)
+    for level, superNetwork in enumerate(superNetworks):
+        assert superNetwork.level == level
+        assert superNetwork.data == proteinnetworks.insight.SuperNetwork(
+            partition, level=level).data
+
+
 def test_supernetwork_retrieved_from_database(mock_database):
     """
     Test that if a supernetwork has been stored in the database it can be retrieved correctly.
@@ -372,7 +434,7 @@ tests for supernetwork.getWeakIsomorphs()
 
 inputs -> supernetwork, optional subset of proteins
 
-output -> a list of [self.pdbref, otherpdbref, simscore] 
+output -> a list of [self.pdbref, otherpdbref, simscore, optimal]
 """
 
 
@@ -449,6 +511,187 @@ def test_getweakisomorphs_multipleisomorphsindatabase_given_empty_subset(mock_da
         isomorphs = superNetwork.getWeakIsomorphs(subset=subset)
 
 
+def test_supernetwork_graph_cached(mock_database):
+    """The graph and fingerprint are built once, and rebuilt only when the data changes"""
+    db = proteinnetworks.database.Database(password="bla")
+    partitionArgs = {
+        'pdbref': '1iso',
+        'N': 10,
+        'edgelistid': ObjectId('58abe03fef677d54224a01da'),
+        'detectionmethod': 'Infomap',
+        'r': -1,
+        "database": db
+    }
+    partition = proteinnetworks.partition.Partition(**partitionArgs)
+    superNetwork = proteinnetworks.insight.SuperNetwork(partition, level=0)
+    G = superNetwork.graph
+    fingerprint = superNetwork.fingerprint
+    superNetwork.getIsomorphs()
+    superNetwork.getWeakIsomorphs()
+    assert superNetwork.graph is G and superNetwork.fingerprint is fingerprint
+    assert all(G[i][j]["weight"] == w for i, j, w in superNetwork.data)
+    assert superNetwork.numberOfNodes == G.number_of_nodes()
+
+    superNetwork.data = [[1, 2, 3], [2, 3, 1]]
+    assert superNetwork.src.tolist() == [1, 2] and superNetwork.weight.tolist() == [3, 1]
+    assert superNetwork.graph is not G
+    assert superNetwork.numberOfNodes == 3
+    assert superNetwork.fingerprint == proteinnetworks.database.getSuperNetworkFingerprint(
+        [[1, 2, 3], [2, 3, 1]])
+
+    # Integer-valued floats are taken as integers; anything else is refused, not truncated
+    superNetwork.data = [[1., 2., 3.]]
+    assert superNetwork.data == [[1, 2, 3]]
+    with pytest.raises(ValueError):
+        superNetwork.data = [[1, 2, 0.5]]
+    assert superNetwork.data == [[1, 2, 3]]
+
+
+def test_getisomorphs_wrongtype_in_subset(mock_database):
+    """Subsets can only hold dicts and supernetworks"""
+    db = proteinnetworks.database.Database(password="bla")
+    partitionArgs = {
+        'pdbref': '1iso',
+        'N': 10,
+        'edgelistid': ObjectId('58abe03fef677d54224a01da'),
+        'detectionmethod': 'Infomap',
+        'r': -1,
+        "database": db
+    }
+    partition = proteinnetworks.partition.Partition(**partitionArgs)
+    superNetwork = proteinnetworks.insight.SuperNetwork(partition, level=0)
+    with pytest.raises(TypeError):
+        superNetwork.getIsomorphs(subset=[[[1, 2, 1]]])
+    with pytest.raises(TypeError):
+        superNetwork.getWeakIsomorphs(subset=[[[1, 2, 1]]])
+
+
+def test_getisomorphs_dict_subset():
+    """Dicts are matched with or without a stored fingerprint"""
+    superNetwork = proteinnetworks.insight.SuperNetwork.__new__(
+        proteinnetworks.insight.SuperNetwork)
+    superNetwork.pdbref = "1abc"
+    superNetwork.chainref = None
+    superNetwork.data = [[1, 2, 1], [2, 3, 1], [1, 3, 1]]
+    triangle = [[4, 5, 2], [5, 6, 1], [4, 6, 1]]
+    subset = [
+        {'pdbref': '2abc', 'data': triangle},
+        {'pdbref': '3abc', 'data': triangle,
+         'fingerprint': proteinnetworks.database.getSuperNetworkFingerprint(triangle)},
+        {'pdbref': '4abc', 'data': [[1, 2, 1], [2, 3, 1]]},
+    ]
+    assert superNetwork.getIsomorphs(subset=subset) == ['2abc', '3abc']
+    weakIsomorphs = superNetwork.getWeakIsomorphs(subset=subset)
+    assert [x[1] for x in weakIsomorphs] == ['2abc', '3abc', '4abc']
+    assert all(x[3] is True for x in weakIsomorphs)
+
+
+def test_getisomorphs_empty_database():
+    """With no other supernetworks in the database there is nothing to compare against"""
+    db = proteinnetworks.database.Database(local=True)
+    superNetwork = proteinnetworks.insight.SuperNetwork.__new__(
+        proteinnetworks.insight.SuperNetwork)
+    superNetwork.pdbref = "1abc"
+    superNetwork.database = db
+    superNetwork.data = [[1, 2, 1], [2, 3, 1], [1, 3, 1]]
+    with pytest.raises(ValueError):
+        superNetwork.getIsomorphs()
+    # Supernetworks of other shapes make the answer an empty list instead
+    db.depositSuperNetwork("2abc", ObjectId(), 0, [[1, 2, 1], [2, 3, 1]])
+    assert superNetwork.getIsomorphs() == []
+
+
+"""
+SuperNetworkNullEnsemble Tests
+"""
+
+
+@pytest.mark.parametrize("modelsperblock", [64, 7, 1])
+def test_nullensemble(mock_database, monkeypatch, modelsperblock):
+    """The stacked null supernetworks match those built one at a time, whatever the blocks"""
+    monkeypatch.setattr(proteinnetworks.insight, "NULL_ENSEMBLE_MODELS_PER_BLOCK",
+                        modelsperblock)
+    db = proteinnetworks.database.Database(password="bla")
+    partitionArgs = {
+        'pdbref': '1ubq',
+        'N': 10,
+        'edgelistid': ObjectId('58dbe03fef677d54224a01da'),
+        'detectionmethod': 'Infomap',
+        'r': -1,
+        "database": db
+    }
+    partition = proteinnetworks.partition.Partition(**partitionArgs)
+    ensemble = proteinnetworks.insight.SuperNetworkNullEnsemble(partition, 50, level=0, seed=1)
+    edgelist = db.extractDocumentGivenId(partition.edgelistid)['data']
+    assert ensemble.data == proteinnetworks.insight.getCommunityEdgeList(
+        edgelist, partition.data[0])
+    assert ensemble.nullmodels.shape == (50, len(partition.data[0]))
+    assert len(ensemble.nulloffsets) == 51 and ensemble.nulloffsets[-1] == len(ensemble.nullsrc)
+    for i in range(50):
+        assert ensemble.getNullEdgeList(i) == proteinnetworks.insight.getCommunityEdgeList(
+            edgelist, ensemble.nullmodels[i])
+
+    again = proteinnetworks.insight.SuperNetworkNullEnsemble(partition, 50, level=0, seed=1)
+    assert np.array_equal(again.nullmodels, ensemble.nullmodels)
+    assert np.array_equal(again.nullweight, ensemble.nullweight)
+
+
+def test_nullensemble_isomorphclassfrequencies(mock_database):
+    db = proteinnetworks.database.Database(password="bla")
+    partitionArgs = {
+        'pdbref': '1ubq',
+        'N': 10,
+        'edgelistid': ObjectId('58dbe03fef677d54224a01da'),
+        'detectionmethod': 'Infomap',
+        'r': -1,
+        "database": db
+    }
+    partition = proteinnetworks.partition.Partition(**partitionArgs)
+    ensemble = proteinnetworks.insight.SuperNetworkNullEnsemble(partition, 100, level=0, seed=2)
+    representatives, frequencies = ensemble.getIsomorphClassFrequencies()
+    assert math.isclose(frequencies.sum(), 1)
+    assert np.all(np.diff(frequencies) <= 0)
+    # Representatives of different classes are never isomorphic
+    graphs = [proteinnetworks.insight.edgelistToGraph(ensemble.getNullEdgeList(i))
+              for i in representatives]
+    for i in range(len(graphs)):
+        for j in range(i):
+            assert not nx.is_isomorphic(graphs[i], graphs[j])
+
+    # The p-value counts the null models in the class of the supernetwork itself
+    isomorphs = sum(round(frequency * 100) for graph, frequency in zip(graphs, frequencies)
+                    if nx.is_isomorphic(ensemble.graph, graph))
+    assert math.isclose(ensemble.getIsomorphPValue(), (isomorphs + 1) / 101)
+
+
+"""
+getCommunityEdgeList tests
+"""
+
+
+def test_getcommunityedgelist():
+    edgelist = [[1, 2, 0.5], [2, 3, 1], [3, 1, 2], [3, 4, 1], [4, 3, 1], [1, 4, 1]]
+    partition = [1, 1, 2, 3]
+    assert proteinnetworks.insight.getCommunityEdgeList(edgelist, partition) == [
+        [1, 2, 2], [1, 3, 1], [2, 3, 2]]
+
+
+def test_getcommunityedgelists():
+    """All levels at once match each level alone"""
+    edgelist = [[1, 2, 0.5], [2, 3, 1], [3, 1, 2], [3, 4, 1], [4, 3, 1], [1, 4, 1]]
+    partitions = [[1, 1, 2, 3], [5, 5, 5, 5], [4, 3, 2, 1]]
+    communityEdgeLists = proteinnetworks.insight.getCommunityEdgeLists(edgelist, partitions)
+    assert communityEdgeLists == [
+        proteinnetworks.insight.getCommunityEdgeList(edgelist, partition)
+        for partition in partitions]
+    assert communityEdgeLists[1] == []
+    assert communityEdgeLists[2] == [[1, 2, 2], [1, 4, 1], [2, 3, 1], [2, 4, 1], [3, 4, 1]]
+
+
+def test_getcommunityedgelist_one_community():
+    assert proteinnetworks.insight.getCommunityEdgeList([[1, 2, 1]], [1, 1]) == []
+
+
 """
 SuperNetworkNullModel Tests
 -----------------------------------------------------------------------------------------
@@ -697,7 +940,7 @@ tests for supernetwork.getWeakIsomorphs()
 
 inputs -> supernetwork, optional subset of proteins
 
-output -> a list of [self.pdbref, otherpdbref, simscore] 
+output -> a list of [self.pdbref, otherpdbref, simscore, optimal]
 """
 
 
@@ -888,6 +1131,72 @@ def test_getmodifiedjaccard_nopfamdomain():
         jaccard = proteinnetworks.insight.getModifiedJaccard(expected, generated)
 
 
+"""
+Tests for getModifiedJaccardBatch
+
+given an expected array and a 2d array of generated partitions, return the modified Jaccard of
+each row.
+"""
+
+def test_getmodifiedjaccardbatch_invalidinputs():
+    """Check that lists and rows of the wrong length are rejected."""
+    expected = np.asarray([1]*40 + [2]*20 + [1]*40)
+    with pytest.raises(TypeError):
+        jaccards = proteinnetworks.insight.getModifiedJaccardBatch(expected, [list(expected)])
+    with pytest.raises(ValueError):
+        jaccards = proteinnetworks.insight.getModifiedJaccardBatch(expected,
+                                                                   np.ones((3, 99), dtype=int))
+
+
+def test_getmodifiedjaccardbatch_known_values():
+    """Check the batch reproduces the single-partition cases worked out by hand."""
+    expected = np.asarray([1]*40 + [2]*20 + [1]*40)
+    generated = np.asarray([[1]*40 + [2]*20 + [3]*20 + [4]*20,
+                            [1]*40 + [2]*30 + [3]*10 + [4]*20,
+                            [1]*40 + [2]*10 + [3]*10 + [4]*40])
+    jaccards = proteinnetworks.insight.getModifiedJaccardBatch(expected, generated)
+    assert np.allclose(jaccards, [1, 2/3, 1/2])
+
+
+def test_getmodifiedjaccardbatch_matches_single():
+    """Check every row of a random batch matches getModifiedJaccard."""
+    expected = np.asarray([1]*30 + [2]*20 + [1]*10 + [3]*30 + [1]*10)
+    generated = np.random.randint(1, 8, (50, 100))
+    jaccards = proteinnetworks.insight.getModifiedJaccardBatch(expected, generated)
+    assert len(jaccards) == 50
+    for jaccard, row in zip(jaccards, generated):
+        assert math.isclose(jaccard, proteinnetworks.insight.getModifiedJaccard(expected, row))
+
+
+"""
+Tests for getContingencyTable
+
+given two partitions, return the labels of each and the sparse table of overlaps.
+"""
+
+def test_getcontingencytable_counts():
+    """Check the table against overlaps counted by hand, with arbitrary labels."""
+    partitionA = np.asarray([0, 0, 5, 5, 5, 7])
+    partitionB = np.asarray([2, 3, 3, 3, 2, 2])
+    labelsA, labelsB, table = proteinnetworks.insight.getContingencyTable(partitionA, partitionB)
+    assert np.array_equal(labelsA, [0, 5, 7])
+    assert np.array_equal(labelsB, [2, 3])
+    assert np.array_equal(table.toarray(), [[1, 1], [1, 2], [1, 0]])
+    # only nonzero cells are stored
+    assert table.nnz == 5
+
+
+def test_getcontingencytable_random_partitions():
+    """Check the table sums to the number of nodes, and its marginals are the community sizes."""
+    partitionA = np.random.randint(1, 10, 200)
+    partitionB = np.random.randint(1, 30, 200)
+    labelsA, labelsB, table = proteinnetworks.insight.getContingencyTable(partitionA, partitionB)
+    dense = table.toarray()
+    assert dense.sum() == 200
+    assert np.array_equal(dense.sum(axis=1), [np.count_nonzero(partitionA == i) for i in labelsA])
+    assert np.array_equal(dense.sum(axis=0), [np.count_nonzero(partitionB == i) for i in labelsB])
+
+
 """
 Tests for generateNullModel
 
@@ -988,6 +1297,57 @@ def test_generatenullmodel_invalidinput_communities_start_from_one():
         array = proteinnetworks.insight.generateNullModel(expected)
 
 
+
+"""
+Tests for generateNullModels
+
+given a test partition, generate an (n x N) array of null models, each with the same number of
+boundaries and the same communities as the test partition.
+"""
+
+
+def test_generatenullmodels_shape_and_boundaries():
+    """Check every null model keeps the number of boundaries and the set of communities."""
+    expected = np.asarray([1]*10 + [2]*5 + [1]*5 + [3]*20 + [2]*3)
+    numBoundaries = np.count_nonzero(np.diff(expected))
+    nullModels = proteinnetworks.insight.generateNullModels(expected, 200)
+    assert nullModels.shape == (200, len(expected))
+    for nullModel in nullModels:
+        assert np.count_nonzero(np.diff(nullModel)) == numBoundaries
+        assert set(nullModel) == {1, 2, 3}
+
+
+def test_generatenullmodels_two_communities_many_boundaries():
+    """Check the case that hung the old rejection sampler: two communities, many repeats."""
+    expected = np.asarray([1, 2, 1, 1, 2, 1, 2, 2, 1])
+    nullModels = proteinnetworks.insight.generateNullModels(expected, 100)
+    for nullModel in nullModels:
+        assert np.count_nonzero(np.diff(nullModel)) == 6
+        assert set(nullModel) == {1, 2}
+
+
+def test_generatenullmodels_seeded():
+    """Check that the same generator seed gives the same null models."""
+    expected = np.asarray([1]*20 + [2]*20 + [3]*20)
+    nullModels1 = proteinnetworks.insight.generateNullModels(expected, 10, np.random.default_rng(1))
+    nullModels2 = proteinnetworks.insight.generateNullModels(expected, 10, np.random.default_rng(1))
+    assert np.array_equal(nullModels1, nullModels2)
+
+
+def test_generatenullmodels_every_labelling_reachable():
+    """Check that every valid labelling of the segments is drawn, e.g. [1, 2, 1, 3, 1, 4]."""
+    expected = np.asarray([1, 2, 3, 4, 1, 2])
+    nullModels = proteinnetworks.insight.generateNullModels(expected, 20000,
+                                                            np.random.default_rng(0))
+    labellings = {labelling for labelling in itertools.product(range(1, 5), repeat=6)
+                  if set(labelling) == {1, 2, 3, 4} and all(np.diff(labelling))}
+    drawn = collections.Counter(map(tuple, nullModels.tolist()))
+    assert (1, 2, 1, 3, 1, 4) in drawn
+    assert set(drawn) == labellings
+    # Uniform over the labellings: no count strays far from the mean
+    mean = len(nullModels) / len(labellings)
+    assert all(abs(count - mean) < 6 * np.sqrt(mean) for count in drawn.values())
+
 """
 tests for getMCS.
 
@@ -1003,6 +1363,9 @@ Test:
 - Graphs of different sizes
 - Graphs with only one node
 - Disconnected graphs
+- Graphs with more than 35 nodes
+- Running out of time
+- Sparse non-isomorphic graphs of 30-50 nodes, within the time given
 """
 
 
@@ -1056,6 +1419,166 @@ def test_getmcs_disconnected_graphs():
     assert nx.is_isomorphic(mcs, input1) and not nx.is_isomorphic(mcs, input2)
 
 
+
+def test_getmcs_large_graphs():
+    """Test graphs too large for the old brute-force search: a cycle and a path of 50 nodes."""
+    mcs = proteinnetworks.insight.getMCS(nx.cycle_graph(50), nx.path_graph(50))
+    assert mcs.number_of_nodes() == 49
+    assert nx.is_isomorphic(mcs, nx.path_graph(49))
+    assert mcs.graph['optimal']
+
+
+def test_getmcs_large_isomorphic_graphs():
+    """Test a relabelled copy of a 60-node graph is matched in full."""
+    G1 = nx.gnp_random_graph(60, 0.1, seed=60)
+    G2 = nx.relabel_nodes(G1, {i: (i * 7) % 60 for i in range(60)})
+    mcs = proteinnetworks.insight.getMCS(G1, G2)
+    assert mcs.number_of_nodes() == 60
+    assert nx.is_isomorphic(mcs, G1)
+
+
+def test_getmcs_lowerbound():
+    """Test that only subgraphs larger than the lower bound are searched for."""
+    mcs = proteinnetworks.insight.getMCS(nx.cycle_graph(10), nx.path_graph(10), lowerbound=8)
+    assert mcs.number_of_nodes() == 9
+    mcs = proteinnetworks.insight.getMCS(nx.cycle_graph(10), nx.path_graph(10), lowerbound=9)
+    assert mcs.number_of_nodes() == 0
+    assert mcs.graph['optimal']
+
+
+def test_getmcs_timeout():
+    """Test that running out of time returns a common subgraph, marked as not optimal."""
+    G1 = nx.gnp_random_graph(50, 0.1, seed=1)
+    G2 = nx.gnp_random_graph(50, 0.1, seed=2)
+    mcs = proteinnetworks.insight.getMCS(G1, G2, timeout=0.2)
+    assert not mcs.graph['optimal']
+    assert 0 < mcs.number_of_nodes() < 50
+
+
+@pytest.mark.parametrize("numberOfNodes", [30, 40, 50])
+def test_getmcs_sparse_graphs_within_timeout(numberOfNodes):
+    """Test sparse graphs, like supernetworks, return a common subgraph in the time given."""
+    G1 = nx.gnp_random_graph(numberOfNodes, 3 / numberOfNodes, seed=numberOfNodes)
+    G2 = nx.gnp_random_graph(numberOfNodes, 3 / numberOfNodes, seed=numberOfNodes + 1)
+    assert not nx.is_isomorphic(G1, G2)
+    start = time.monotonic()
+    mcs = proteinnetworks.insight.getMCS(G1, G2, timeout=1)
+    assert time.monotonic() - start < 2
+    assert mcs.number_of_nodes() > numberOfNodes / 2
+    assert mcs.graph['optimal'] in (True, False)
+
+"""
+Tests for clusterIsomorphs and getIsomorphClasses
+
+Input -> a database of supernetworks (or a list of edge arrays)
+Output -> the isomorphism classes, as lists of ids (or indices)
+
+Tests:
+- a database with isomorphic and non-isomorphic supernetworks, serially and in parallel
+- supernetworks sharing a fingerprint that aren't isomorphic
+"""
+
+def getLocalDatabaseWithSuperNetworks():
+    """Return a local database holding three triangles, two paths and a square."""
+    db = proteinnetworks.database.Database(local=True)
+    supernetworks = {
+        "1tri": [[1, 2, 1], [2, 3, 1], [3, 1, 1]],
+        "2tri": [[4, 5, 2], [5, 6, 1], [6, 4, 3]],
+        "3tri": [[2, 1, 1], [3, 2, 1], [1, 3, 1]],
+        "1pth": [[1, 2, 1], [2, 3, 1]],
+        "2pth": [[3, 1, 1], [1, 2, 5]],
+        "1sqr": [[1, 2, 1], [2, 3, 1], [3, 4, 1], [4, 1, 1]],
+    }
+    ids = {}
+    for pdbref, data in supernetworks.items():
+        ids[pdbref] = db.depositSuperNetwork(pdbref, ObjectId(), 0, data)
+    return db, ids
+
+
+def test_getweakisomorphsimilarity():
+    """Check similarities above the threshold, and those ruled out by the threshold."""
+    triangle = nx.cycle_graph(3)
+    square = nx.cycle_graph(4)
+    path = nx.path_graph(3)
+    assert proteinnetworks.insight.getWeakIsomorphSimilarity(square, path) == (3/4, True)
+    # the largest common subgraph is an edge, half the square
+    assert proteinnetworks.insight.getWeakIsomorphSimilarity(square, triangle) == (0, True)
+    assert proteinnetworks.insight.getWeakIsomorphSimilarity(square, triangle, 0.4) == (1/2, True)
+    # too few nodes to pass the threshold
+    assert proteinnetworks.insight.getWeakIsomorphSimilarity(nx.path_graph(10), path) == (0, True)
+    # running out of time gives a lower bound
+    G1 = nx.gnp_random_graph(50, 0.1, seed=1)
+    G2 = nx.gnp_random_graph(50, 0.1, seed=2)
+    similarity, optimal = proteinnetworks.insight.getWeakIsomorphSimilarity(G1, G2, 0.5, 0.2)
+    assert not optimal
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_weakisomorphmatrix(workers):
+    """Check the matrix of similarities, and that they are deposited."""
+    db, ids = getLocalDatabaseWithSuperNetworks()
+    matrixIds, matrix = proteinnetworks.insight.weakIsomorphMatrix(db, workers=workers)
+    assert set(matrixIds) == set(ids.values())
+    index = {pdbref: matrixIds.index(ids[pdbref]) for pdbref in ids}
+    assert (matrix != matrix.T).nnz == 0
+    assert matrix[index["1tri"], index["2tri"]] == 1
+    assert matrix[index["1pth"], index["2tri"]] == 2/3
+    assert matrix[index["1sqr"], index["2pth"]] == 3/4
+    assert matrix[index["1sqr"], index["3tri"]] == 0
+    # 3 triangle pairs, 1 path pair, 6 triangle-path pairs, 2 square-path pairs
+    assert matrix.nnz == 2 * 12
+    assert db.collection.find({"doctype": "weakisomorph"}).count() == 12
+    assert all(doc['optimal'] for doc in db.collection.find({"doctype": "weakisomorph"}))
+    # Running again doesn't duplicate the deposited pairs
+    proteinnetworks.insight.weakIsomorphMatrix(db, workers=workers)
+    assert db.collection.find({"doctype": "weakisomorph"}).count() == 12
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_weakisomorphmatrix_many_chunks(monkeypatch, workers):
+    """Check the similarities are the same when the pairs are split over many chunks."""
+    db, ids = getLocalDatabaseWithSuperNetworks()
+    expectedIds, expected = proteinnetworks.insight.weakIsomorphMatrix(db, deposit=False)
+    monkeypatch.setattr(proteinnetworks.insight, "WEAK_ISOMORPH_PAIRS_PER_CHUNK", 1)
+    monkeypatch.setattr(proteinnetworks.insight, "WEAK_ISOMORPH_CHUNKS_PER_WORKER", 2)
+    matrixIds, matrix = proteinnetworks.insight.weakIsomorphMatrix(db, workers=workers,
+                                                                   deposit=False)
+    assert matrixIds == expectedIds
+    assert (matrix != expected).nnz == 0
+
+
+def test_weakisomorphmatrix_timeout():
+    """Check pairs whose search runs out of time are deposited as lower bounds."""
+    db = proteinnetworks.database.Database(local=True)
+    for pdbref, seed in [("1abc", 1), ("2abc", 2)]:
+        G = nx.gnp_random_graph(50, 0.1, seed=seed)
+        db.depositSuperNetwork(pdbref, ObjectId(), 0, [[i + 1, j + 1, 1] for i, j in G.edges])
+    ids, matrix = proteinnetworks.insight.weakIsomorphMatrix(db, timeout=0.2)
+    docs = list(db.collection.find({"doctype": "weakisomorph"}))
+    assert len(docs) == 1
+    assert docs[0]['optimal'] is False
+    assert matrix[0, 1] == docs[0]['similarity']
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_clusterisomorphs(workers):
+    """Check the classes are the triangles, the paths and the square, largest first."""
+    db, ids = getLocalDatabaseWithSuperNetworks()
+    classes = proteinnetworks.insight.clusterIsomorphs(db, workers=workers)
+    assert [len(x) for x in classes] == [3, 2, 1]
+    assert set(classes[0]) == {ids["1tri"], ids["2tri"], ids["3tri"]}
+    assert set(classes[1]) == {ids["1pth"], ids["2pth"]}
+    assert classes[2] == [ids["1sqr"]]
+
+
+def test_getisomorphclasses_same_fingerprint():
+    """Check graphs that share a fingerprint (a hexagon, two triangles) are split apart."""
+    hexagon = np.asarray([[1, 2], [2, 3], [3, 4], [4, 5], [5, 6], [6, 1]])
+    triangles = np.asarray([[1, 2], [2, 3], [3, 1], [4, 5], [5, 6], [6, 4]])
+    classes = proteinnetworks.insight.getIsomorphClasses([hexagon, triangles, hexagon + 10])
+    assert classes == [[0, 2], [1]]
+
+
 """
 Tests for getZscore
 
@@ -1115,6 +1638,42 @@ def test_getzscore_bad_communities():
     assert score < 0
 
 
+
+def test_getzscore_seeded():
+    """Test that a seed gives the same score, whether an int, SeedSequence or Generator."""
+    expected = np.asarray([1]*40 + [2]*20 + [1]*40)
+    generated = np.asarray([1]*40 + [2]*20 + [3]*20 + [4]*20)
+    score = proteinnetworks.insight.getZScore(expected, generated, seed=3)
+    assert score == proteinnetworks.insight.getZScore(expected, generated, seed=3)
+    assert score == proteinnetworks.insight.getZScore(expected, generated,
+                                                      seed=np.random.SeedSequence(3))
+    score = proteinnetworks.insight.getZScore(expected, generated,
+                                              seed=np.random.default_rng(3))
+    assert score == proteinnetworks.insight.getZScore(expected, generated,
+                                                      seed=np.random.default_rng(3))
+
+
+def test_getzscore_workers_deterministic():
+    """Test that the score for a seed doesn't depend on the number of workers."""
+    expected = np.asarray([1]*40 + [2]*20 + [1]*40)
+    generated = np.asarray([1]*40 + [2]*20 + [3]*20 + [4]*20)
+    numTrials = 2 * proteinnetworks.insight.ZSCORE_TRIALS_PER_CHUNK + 1
+    score = proteinnetworks.insight.getZScore(expected, generated, numTrials, seed=7)
+    parallelScore = proteinnetworks.insight.getZScore(expected, generated, numTrials, seed=7,
+                                                      workers=2)
+    assert score == parallelScore
+
+
+def test_getnulljaccards_seeded():
+    """Test the null Jaccards are reproducible from a seed, one per trial."""
+    expected = np.asarray([1]*40 + [2]*20 + [1]*40)
+    generated = np.asarray([1]*40 + [2]*20 + [3]*20 + [4]*20)
+    jaccards = proteinnetworks.insight.getNullJaccards(expected, generated, 20,
+                                                       np.random.SeedSequence(1))
+    assert len(jaccards) == 20
+    assert np.array_equal(jaccards, proteinnetworks.insight.getNullJaccards(
+        expected, generated, 20, np.random.SeedSequence(1)))
+
 """
 Tests for getShannonEntropy
 
@@ -1127,6 +1686,7 @@ Tests:
 - all nodes in their own community
 - all nodes in the same community
 - "normal" community structure
+- float-valued labels
 """
 
 def test_getshannonentropy_invalid_inputs():
@@ -1153,6 +1713,11 @@ def test_getshannonentropy_normal_community():
     H = proteinnetworks.insight.getShannonEntropy(testarray)
     assert math.isclose(H,-math.log(1/2))
 
+def test_getshannonentropy_float_labels():
+    """Test that float-valued labels give the same entropy as integer ones."""
+    H = proteinnetworks.insight.getShannonEntropy(np.array([1., 1., 2.]))
+    assert math.isclose(H, proteinnetworks.insight.getShannonEntropy(np.array([1, 1, 2])))
+
 
 
 """
@@ -1215,6 +1780,13 @@ input -> two partitions (invalid inputs will be caught by other functions)
 output -> a number that should always be between 0 and 1.
 """
 
+def test_getnmi_invalid_inputs():
+    """Test that improperly labelled or different length arrays are rejected."""
+    with pytest.raises(ValueError):
+        nmi = proteinnetworks.insight.getNMI([1]*5 + [3]*5, [1]*5 + [2]*5)
+    with pytest.raises(TypeError):
+        nmi = proteinnetworks.insight.getNMI([1]*5 + [2]*5, [1]*5 + [2]*4)
+
 def test_getnmi_perfect_match():
     """Test that perfectly matching communities have NMI=1."""
     testarray1 = [1]*10+[2]*10
@@ -1397,8 +1969,63 @@ def test_getconductancefromnodesubset_random_graphs():
         phi = proteinnetworks.insight.getConductanceFromNodeSubset(node_subset, adj)
         assert  phi >= 0
 
+def test_getconductancefromnodesubset_sparse_matches_dense():
+    """Test that a scipy.sparse adjacency matrix gives the same conductance as a dense one."""
+    numTrials = 10
+    for i in range(numTrials):
+        G = nx.relaxed_caveman_graph(np.random.randint(2,6), np.random.randint(5,20), 0.2)
+        adj = nx.convert_matrix.to_numpy_array(G)
+        node_subset = np.unique(np.random.randint(0, G.number_of_nodes(), 10))
+        phi = proteinnetworks.insight.getConductanceFromNodeSubset(node_subset, adj)
+        sparsePhi = proteinnetworks.insight.getConductanceFromNodeSubset(
+            node_subset, scipy.sparse.csr_matrix(adj))
+        assert math.isclose(phi, sparsePhi)
+
+def test_getconductancefromnodesubset_sparse_asymmetric_array():
+    adjacency  = scipy.sparse.csr_matrix(np.asarray([[0,0,0,1],[0,0,1,1],[0,1,0,0],[1,1,1,0]]))
+    node_subset = [0,1]
+    with pytest.raises(ValueError):
+        Q = proteinnetworks.insight.getConductanceFromNodeSubset(node_subset, adjacency)
+
+
 
 
+"""
+tests for getConductancesFromAdjacencyMatrix
+
+inputs -> a 2d adjacency matrix and a 2d array of community lists labelled from 1
+
+outputs -> a list of arrays of conductances, one array per level
+"""
+
+def test_getconductancesfromadjacencymatrix_wrong_dimensions():
+    """Check that levels of the wrong length are rejected."""
+    adjacency  = np.asarray([[0,0,0,1],[0,0,1,1],[0,1,0,0],[1,1,0,0]])
+    with pytest.raises(ValueError):
+        phis = proteinnetworks.insight.getConductancesFromAdjacencyMatrix(adjacency, [[1,1,2]])
+
+def test_getconductancesfromadjacencymatrix_disconnected_graph():
+    """Test that disconnected communities have zero conductance."""
+    arrays = [np.ones((5,5)), np.ones((5,5))]
+    adjacency = block_diag(*arrays)
+    np.fill_diagonal(adjacency,0)
+    phis = proteinnetworks.insight.getConductancesFromAdjacencyMatrix(adjacency, [[1]*5 + [2]*5])
+    assert len(phis) == 1
+    assert np.array_equal(phis[0], [0, 0])
+
+def test_getconductancesfromadjacencymatrix_matches_node_subsets():
+    """Test that every community of every level matches getConductanceFromNodeSubset."""
+    G = nx.relaxed_caveman_graph(4, 10, 0.3)
+    adj = nx.convert_matrix.to_numpy_array(G)
+    comlists = np.vstack([np.repeat(np.arange(4), 10) + 1,
+                          np.random.permutation(np.arange(40) % 3) + 1])
+    phis = proteinnetworks.insight.getConductancesFromAdjacencyMatrix(adj, comlists)
+    for comlist, levelPhis in zip(comlists, phis):
+        assert len(levelPhis) == len(set(comlist))
+        for j, phi in enumerate(levelPhis):
+            assert math.isclose(phi, proteinnetworks.insight.getConductanceFromNodeSubset(
+                np.where(comlist == j + 1)[0], adj))
+
 
 """
 tests for getModularityFromPartition.
@@ -1430,6 +2057,31 @@ def test_getmodularityfrompartition_success():
     Qs = proteinnetworks.insight.getModularityFromPartition(network,partition)
     assert len(Qs) == 2
 
+def test_getmodularityfrompartition_sparse_matches_dense():
+    """Test that the sparse adjacency matrix gives the same modularities as the dense one."""
+    db = proteinnetworks.database.Database(password="bla")
+
+    inputArgs = {
+        "scaling": 4.5,
+        "edgelisttype": "residue",
+        "hydrogenstatus": "noH",
+        "pdbref": "1ubq",
+        "database": db
+    }
+    network = proteinnetworks.network.Network(**inputArgs)
+    partitionArgs = {
+        'pdbref': '1ubq',
+        'N': 10,
+        'edgelistid': ObjectId('58dbe03fef677d54224a01da'),
+        'detectionmethod': 'Infomap',
+        'r': -1,
+        "database": db
+    }
+    partition = proteinnetworks.partition.Partition(**partitionArgs)
+    Qs = proteinnetworks.insight.getModularityFromPartition(network, partition)
+    sparseQs = proteinnetworks.insight.getModularityFromPartition(network, partition, sparse=True)
+    assert np.allclose(Qs, sparseQs)
+
 """
 tests for getModularityFromAdjacencyMatrix.
 
@@ -1491,6 +2143,54 @@ def test_getmodularityfromadjacencymatrix_disconnected_graph():
     assert math.isclose(Q,0.5)
 
 
+def test_getmodularityfromadjacencymatrix_sparse_matches_dense():
+    """test that a scipy.sparse adjacency matrix gives the same modularity as a dense one"""
+    numTrials = 10
+    for i in range(numTrials):
+        l = np.random.randint(1,10)
+        k = np.random.randint(10,50)
+        G = nx.relaxed_caveman_graph(l,k,np.random.random_sample())
+        adj = nx.convert_matrix.to_numpy_array(G)
+        comlist = []
+        for i in range(l):
+            comlist += [i]*k
+        Q = proteinnetworks.insight.getModularityFromAdjacencyMatrix(adj, comlist)
+        sparseQ = proteinnetworks.insight.getModularityFromAdjacencyMatrix(
+            scipy.sparse.csr_matrix(adj), comlist)
+        assert math.isclose(Q, sparseQ, abs_tol=1e-12)
+
+
+"""
+tests for getModularitiesFromAdjacencyMatrix.
+
+Input -> an adjacency matrix and a 2d array of community lists, one per level.
+Output -> the modularity of every level.
+"""
+
+def test_getmodularitiesfromadjacencymatrix_wrong_dimensions():
+    """tests that levels of the wrong length are rejected"""
+    adjacency  = np.asarray([[0,0,0,1],[0,0,1,1],[0,1,0,0],[1,1,0,0]])
+    comlists = [[1,1,0],[1,2,3]]
+    with pytest.raises(ValueError):
+        Qs = proteinnetworks.insight.getModularitiesFromAdjacencyMatrix(adjacency, comlists)
+
+def test_getmodularitiesfromadjacencymatrix_matches_single_levels():
+    """test that every level of the batch matches the modularity of that level alone"""
+    G = nx.relaxed_caveman_graph(4, 10, 0.3)
+    adj = nx.convert_matrix.to_numpy_array(G)
+    comlists = np.vstack([np.repeat(np.arange(4), 10),
+                          np.repeat(np.arange(2), 20),
+                          np.random.randint(1, 6, 40),
+                          np.ones(40, dtype=int)])
+    Qs = proteinnetworks.insight.getModularitiesFromAdjacencyMatrix(adj, comlists)
+    assert len(Qs) == 4
+    for Q, comlist in zip(Qs, comlists):
+        assert math.isclose(
+            Q, proteinnetworks.insight.getModularityFromAdjacencyMatrix(adj, comlist))
+    # A single community has zero modularity
+    assert math.isclose(Qs[-1], 0, abs_tol=1e-12)
+
+
 def test_getmodularityfromadjacencymatrix_normal_communities():
     """test the modularity of random graphs, assert it is [-1, 1]"""
     numTrials = 100
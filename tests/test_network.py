@@ -7,13 +7,24 @@ Network()
     __init__.
     getAdjacencyMatrix
     generateEdgelist
+    sweep
     draw x
 extractAtomicData
+getEdgelists
+getAtomicRadii
+getContactsInBlock
+getNeighbourPairs
+getTiledPairs
+getKDTreePairs
+getContactPairs
+selectBackend
+getResidueEdges
 """
 import proteinnetworks.network
 import proteinnetworks.database
 from bson.objectid import ObjectId
 import numpy as np
+import scipy.sparse
 import pytest
 """Test the __init__() function in the network.py module.
 
@@ -152,6 +163,23 @@ def test_network_init_edgelist_and_pdb_not_in_database(mock_database):
     assert type(pn.edgelistid) == ObjectId
 
 
+def test_network_init_edgelist_not_in_database_tiled(mock_database):
+    """Test that a memory ceiling gives the same edgelist as the default search."""
+    db = proteinnetworks.database.Database(password="bla")
+    inputArgs = {
+        "scaling": 4.5,
+        "edgelisttype": "residue",
+        "hydrogenstatus": "noH",
+        "pdbref": "2bla",
+        "database": db,
+        "chainref": "H",
+        "maxmemorybytes": 50000,
+        "backend": "dense"
+    }
+    pn = proteinnetworks.network.Network(**inputArgs)
+    assert pn.edgelist == [[2, 1, 44], [3, 1, 20], [3, 2, 47], [4, 2, 11], [4, 3, 36], [5, 3, 29], [5, 4, 50], [6, 4, 17], [6, 5, 35], [7, 5, 6], [7, 6, 23], [8, 6, 9], [8, 7, 27], [9, 6, 1], [9, 7, 11], [9, 8, 28], [10, 7, 1], [10, 8, 36], [10, 9, 27], [11, 8, 25], [11, 9, 12], [11, 10, 50]]
+
+
 def test_network_init_edgelist_and_pdb_not_in_database_atomic(mock_database):
     """Test the pathway in which the pdb file must be fetched, with atomic networks."""
     db = proteinnetworks.database.Database(password="bla")
@@ -166,6 +194,62 @@ def test_network_init_edgelist_and_pdb_not_in_database_atomic(mock_database):
     assert type(pn.edgelistid) == ObjectId
 
 
+"""
+Tests for Network.sweep()
+
+Inputs: as for __init__, but with a list of scalings.
+Output: a list of Networks, one per scaling.
+
+Tests:
+- missing edgelists come from a single neighbour search, and match one-at-a-time generation
+- edgelists already in the database aren't regenerated
+"""
+
+
+def getLocalDatabaseWithPDBFile(pdbref):
+    """Return a local database holding the (mocked) PDB file for pdbref."""
+    pdbdata = proteinnetworks.database.Database(password="bla").extractPDBFile(pdbref)
+    db = proteinnetworks.database.Database(local=True)
+    db.collection.insert_one({"pdbref": pdbref, "doctype": "pdbfile", "data": pdbdata})
+    return db
+
+
+@pytest.mark.parametrize("edgelisttype", ["atomic", "residue"])
+def test_network_sweep_single_neighbour_search(mock_database, monkeypatch, edgelisttype):
+    """Check that one neighbour search serves every scaling, and the edgelists are unchanged."""
+    db = getLocalDatabaseWithPDBFile("1ubq")
+    searches = []
+    getNeighbourPairs = proteinnetworks.network.getNeighbourPairs
+
+    def countingGetNeighbourPairs(*args):
+        searches.append(args)
+        return getNeighbourPairs(*args)
+
+    monkeypatch.setattr("proteinnetworks.network.getNeighbourPairs", countingGetNeighbourPairs)
+    scalings = [2.0, 3.5, 5.0, 4.5]
+    networks = proteinnetworks.network.Network.sweep("1ubq", edgelisttype, "noH", scalings,
+                                                     database=db, backend="grid")
+    assert len(searches) == 1
+    assert searches[0][2] == 5.0
+    assert db.getNumberOfDocuments() == 5
+    assert [network.scaling for network in networks] == scalings
+    for network in networks:
+        assert network.edgelist == network.generateEdgelist("1ubq", edgelisttype, "noH",
+                                                            network.scaling)
+
+
+def test_network_sweep_existing_edgelists_reused(mock_database):
+    """Check that edgelists already present are neither regenerated nor redeposited."""
+    db = getLocalDatabaseWithPDBFile("1ubq")
+    first = proteinnetworks.network.Network.sweep("1ubq", "residue", "noH", [4.0, 4.5],
+                                                  database=db)
+    second = proteinnetworks.network.Network.sweep("1ubq", "residue", "noH", [4.0, 4.5, 5.0],
+                                                   database=db)
+    assert db.getNumberOfDocuments() == 4
+    assert [network.edgelistid for network in second[:2]] == [
+        network.edgelistid for network in first]
+
+
 """
 Tests for the Network.draw() method.
 
@@ -240,6 +324,26 @@ def test_network_getadjacencymatrix(mock_database):
     assert np.array_equal(adj, expected_adj)
 
 
+def test_network_getadjacencymatrix_sparse(mock_database):
+    """
+    Test that the sparse adjacency matrix matches the dense one and keeps float weights.
+    """
+    db = proteinnetworks.database.Database(password="bla")
+    inputArgs = {
+        "scaling": 4.5,
+        "edgelisttype": "residue",
+        "hydrogenstatus": "noH",
+        "pdbref": "2vcr",
+        "database": db
+    }
+    pn = proteinnetworks.network.Network(**inputArgs)
+    adj = pn.getAdjacencyMatrix(sparse=True)
+    assert scipy.sparse.issparse(adj)
+    assert adj.dtype == float
+    assert adj.nnz == 2 * len(pn.edgelist)
+    assert np.array_equal(adj.toarray(), pn.getAdjacencyMatrix())
+
+
 """
 Tests for Network.getNetwork()
 
@@ -268,3 +372,254 @@ def test_network_getnetwork_wellformededgelist(mock_database):
     G = pn.getNetwork()
     assert G.number_of_nodes() == 11
     assert G.number_of_edges() == 24
+
+
+"""
+Tests for extractAtomicData
+
+extractAtomicData: PDB lines and an optional chainref -> (positions, elements, residues)
+
+Tests:
+- only ATOM records of the first model (and the given chain) are read
+- elements are taken from the atom name, residues counted in order of appearance
+- records shorter than 80 columns are padded
+- a missing chain raises a RuntimeError, malformed coordinates a ValueError
+"""
+PDB_LINES = [
+    "HEADER    TEST\n",
+    "ATOM      1  N   MET A   1      27.340  24.430   2.614  1.00  9.67           N\n",
+    "ATOM      2  CA  MET A   1      26.266  25.413   2.842  1.00 10.38           C",
+    "HETATM    3 FE   HEM A   2       1.000   2.000   3.000  1.00 10.38          FE\n",
+    "ATOM      4  OG1 THR B   7      -1.500   0.000  10.250",
+    "ATOM      5 FE   FEX B  -3       0.001  -0.010 100.000  1.00 10.38          FE\n",
+    "ENDMDL\n",
+    "ATOM      6  N   MET A   1      27.340  24.430   2.614  1.00  9.67           N\n",
+]
+
+
+def test_extractatomicdata_all_chains():
+    positions, elements, residues = proteinnetworks.network.extractAtomicData(PDB_LINES)
+    assert np.array_equal(positions, [[27.34, 24.43, 2.614], [26.266, 25.413, 2.842],
+                                      [-1.5, 0, 10.25], [0.001, -0.01, 100]])
+    assert list(elements) == ["N", "C", "O", "F"]
+    assert list(residues) == [1, 1, 2, 3]
+
+
+def test_extractatomicdata_chain():
+    positions, elements, residues = proteinnetworks.network.extractAtomicData(PDB_LINES, "B")
+    assert np.array_equal(positions, [[-1.5, 0, 10.25], [0.001, -0.01, 100]])
+    assert list(elements) == ["O", "F"]
+    assert list(residues) == [1, 2]
+
+
+def test_extractatomicdata_missing_chain():
+    with pytest.raises(RuntimeError):
+        proteinnetworks.network.extractAtomicData(PDB_LINES, "C")
+
+
+def test_extractatomicdata_malformed_coordinates():
+    with pytest.raises(ValueError):
+        proteinnetworks.network.extractAtomicData(
+            ["ATOM      1  N   MET A   1      27.340  2x.430   2.614"])
+
+
+"""
+Tests for getAtomicRadii, getContactsInBlock and getNeighbourPairs
+
+getAtomicRadii: a list of element symbols -> an array of radii.
+getNeighbourPairs: positions, radii and a scaling -> three arrays (i, j, distance_squared)
+    for all pairs with i > j closer than s(r_i + r_j), sorted by i and then j.
+
+Tests:
+- radii looked up correctly, unknown elements rejected
+- agrees with a brute-force search over all pairs (uniform and mixed radii)
+- fewer than two atoms gives no pairs
+- generateEdgelist gives the same edges as a brute-force double loop.
+"""
+
+
+def test_getatomicradii_known_elements():
+    """Check each element is mapped to its radius."""
+    radii = proteinnetworks.network.getAtomicRadii(["C", "N", "C", "S"])
+    assert np.array_equal(radii, [0.76, 0.71, 0.76, 1.05])
+
+
+def test_getatomicradii_unknown_element():
+    """Check that an element without a radius raises a KeyError."""
+    with pytest.raises(KeyError):
+        proteinnetworks.network.getAtomicRadii(["C", "Q"])
+
+
+def test_getcontactsinblock_diagonal_block_lower_triangle():
+    """Check a block compared against itself only gives each pair once, with i > j."""
+    positions = np.asarray([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    atoms = np.arange(3)
+    i, j, distance_squared = proteinnetworks.network.getContactsInBlock(
+        positions, np.ones(3), 1.0, atoms, atoms)
+    assert sorted(zip(i.tolist(), j.tolist())) == [(1, 0), (2, 0), (2, 1)]
+    assert sorted(distance_squared.tolist()) == [1.0, 1.0, 2.0]
+
+
+def bruteForcePairs(positions, radii, scaling):
+    """Return the pairs a dense search over the lower triangle would find."""
+    allDistances = np.sum((positions[:, np.newaxis, :] - positions[np.newaxis, :, :])**2,
+                          axis=-1)
+    cutoffs = (radii[:, np.newaxis] + radii[np.newaxis, :]) * scaling
+    i, j = np.nonzero(np.tril(allDistances < cutoffs**2, -1))
+    return i, j, allDistances[i, j]
+
+
+@pytest.mark.parametrize("mixedradii", [False, True])
+def test_getneighbourpairs_matches_brute_force(mixedradii):
+    """Check the cell-list search finds exactly the pairs a dense search does."""
+    positions = np.random.uniform(-20, 20, (500, 3))
+    if mixedradii:
+        radii = np.random.choice([0.66, 0.71, 0.76, 1.05], size=500)
+    else:
+        radii = np.full(500, 0.75)
+    found = proteinnetworks.network.getNeighbourPairs(positions, radii, 3.0)
+    expected = bruteForcePairs(positions, radii, 3.0)
+    for foundArray, expectedArray in zip(found, expected):
+        assert np.array_equal(foundArray, expectedArray)
+
+
+def test_getneighbourpairs_too_few_atoms():
+    """Check that no pairs are returned for a single atom."""
+    i, j, distance_squared = proteinnetworks.network.getNeighbourPairs(
+        np.zeros((1, 3)), np.ones(1), 4.5)
+    assert len(i) == len(j) == len(distance_squared) == 0
+
+
+@pytest.mark.parametrize("maxmemorybytes", [10000, 10**9])
+def test_gettiledpairs_matches_brute_force(maxmemorybytes):
+    """Check the tiled search agrees with a dense one, whether or not it needs many tiles."""
+    positions = np.random.uniform(-20, 20, (500, 3))
+    radii = np.random.choice([0.66, 0.71, 0.76, 1.05], size=500)
+    found = proteinnetworks.network.getTiledPairs(positions, radii, 3.0, maxmemorybytes)
+    expected = bruteForcePairs(positions, radii, 3.0)
+    for foundArray, expectedArray in zip(found, expected):
+        assert np.array_equal(foundArray, expectedArray)
+
+
+def test_gettiledpairs_tiny_memory_ceiling():
+    """Check that a ceiling too small for even one pair still works, one atom at a time."""
+    positions = np.random.uniform(-5, 5, (50, 3))
+    radii = np.full(50, 0.76)
+    found = proteinnetworks.network.getTiledPairs(positions, radii, 3.0, 1)
+    expected = bruteForcePairs(positions, radii, 3.0)
+    for foundArray, expectedArray in zip(found, expected):
+        assert np.array_equal(foundArray, expectedArray)
+
+
+@pytest.mark.parametrize("scaling", [0.5, 2.0, 4.5])
+def test_getkdtreepairs_matches_brute_force(scaling):
+    """Check the tree search finds exactly the pairs a dense search does."""
+    positions = np.random.uniform(-20, 20, (500, 3))
+    radii = np.random.choice([0.66, 0.71, 0.76, 1.05], size=500)
+    found = proteinnetworks.network.getKDTreePairs(positions, radii, scaling)
+    expected = bruteForcePairs(positions, radii, scaling)
+    for foundArray, expectedArray in zip(found, expected):
+        assert np.array_equal(foundArray, expectedArray)
+
+
+def test_getcontactpairs_invalid_backend():
+    """Check that an unknown backend is rejected."""
+    with pytest.raises(ValueError):
+        proteinnetworks.network.getContactPairs(np.zeros((2, 3)), np.ones(2), 4.5,
+                                                backend="octree")
+
+
+def test_selectbackend():
+    """Check the tree search is chosen except for large structures at long cutoffs."""
+    assert proteinnetworks.network.selectBackend(500, 4.5) == "kdtree"
+    assert proteinnetworks.network.selectBackend(50000, 2.0) == "kdtree"
+    assert proteinnetworks.network.selectBackend(50000, 4.5) == "grid"
+    assert proteinnetworks.network.selectBackend(50000, 4.5, 10**6) == "dense"
+
+
+def test_getcontactpairs_maxmemorybytes_selects_tiled_search(monkeypatch):
+    """Check a memory ceiling alone selects the tiled search, and clashes with the others."""
+    calls = []
+    getTiledPairs = proteinnetworks.network.getTiledPairs
+
+    def recordingGetTiledPairs(*args):
+        calls.append(args[-1])
+        return getTiledPairs(*args)
+
+    monkeypatch.setattr(proteinnetworks.network, "getTiledPairs", recordingGetTiledPairs)
+    positions = np.random.uniform(-5, 5, (50, 3))
+    radii = np.full(50, 0.76)
+    found = proteinnetworks.network.getContactPairs(positions, radii, 3.0,
+                                                    maxMemoryBytes=10000)
+    assert calls == [10000]
+    for foundArray, expectedArray in zip(found, bruteForcePairs(positions, radii, 3.0)):
+        assert np.array_equal(foundArray, expectedArray)
+    for backend in ["grid", "kdtree"]:
+        with pytest.raises(ValueError):
+            proteinnetworks.network.getContactPairs(positions, radii, 3.0, backend,
+                                                    maxMemoryBytes=10000)
+
+
+def test_network_init_maxmemorybytes_selects_tiled_search(mock_database, monkeypatch):
+    """Check Network(..., maxmemorybytes=X) with the default backend applies the ceiling."""
+    calls = []
+    getTiledPairs = proteinnetworks.network.getTiledPairs
+
+    def recordingGetTiledPairs(*args):
+        calls.append(args[-1])
+        return getTiledPairs(*args)
+
+    monkeypatch.setattr(proteinnetworks.network, "getTiledPairs", recordingGetTiledPairs)
+    db = proteinnetworks.database.Database(password="bla")
+    pn = proteinnetworks.network.Network("2bla", "residue", "noH", 4.5, chainref="H",
+                                         database=db, maxmemorybytes=50000)
+    assert calls == [50000]
+    assert pn.edgelist[:3] == [[2, 1, 44], [3, 1, 20], [3, 2, 47]]
+
+
+def test_getresidueedges_counts_and_sorts():
+    """Check contacts are counted per residue pair, sorted, and intra-residue ones dropped."""
+    residues = [1, 1, 2, 2, 3]
+    i = np.asarray([4, 3, 2, 4, 1, 3])
+    j = np.asarray([0, 2, 0, 2, 0, 1])
+    edges = proteinnetworks.network.getResidueEdges(residues, i, j)
+    assert edges == [[2, 1, 2], [3, 1, 1], [3, 2, 1]]
+    assert all(type(x) == int for edge in edges for x in edge)
+
+
+def test_getresidueedges_no_contacts():
+    """Check that contacts only within residues give an empty edgelist."""
+    edges = proteinnetworks.network.getResidueEdges([1, 1, 2], np.asarray([1]),
+                                                    np.asarray([0]))
+    assert edges == []
+
+
+@pytest.mark.parametrize("backend,maxmemorybytes", [("auto", None), ("grid", None),
+                                                    ("kdtree", None), ("dense", None),
+                                                    ("dense", 20000)])
+@pytest.mark.parametrize("edgelisttype", ["atomic", "residue"])
+def test_network_generateedgelist_matches_brute_force(mock_database, edgelisttype, backend,
+                                                      maxmemorybytes):
+    """Check generateEdgelist agrees edge-for-edge with a double loop over all atom pairs."""
+    db = proteinnetworks.database.Database(password="bla")
+    pn = proteinnetworks.network.Network("2vcr", "residue", "noH", 4.5, database=db)
+    edgelist = pn.generateEdgelist("1ubq", edgelisttype, "noH", 4.0,
+                                   maxmemorybytes=maxmemorybytes, backend=backend)
+
+    positions, elements, residues = proteinnetworks.network.extractAtomicData(
+        db.extractPDBFile("1ubq"))
+    radii = proteinnetworks.atomicradii.atomicRadii
+    expected = []
+    contacts = {}
+    for i in range(len(positions)):
+        for j in range(i):
+            cutoff = (radii[elements[i]] + radii[elements[j]]) * 4.0
+            distance_squared = np.sum((positions[i] - positions[j])**2)
+            if distance_squared < cutoff * cutoff:
+                expected.append([i + 1, j + 1, (cutoff - np.sqrt(distance_squared)) / cutoff])
+                if residues[i] != residues[j]:
+                    key = (residues[i], residues[j])
+                    contacts[key] = contacts.get(key, 0) + 1
+    if edgelisttype == "residue":
+        expected = sorted([i, j, weight] for (i, j), weight in contacts.items())
+    assert edgelist == expected
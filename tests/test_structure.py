@@ -0,0 +1,444 @@
+"""
+Unit tests for the structure module.
+
+Units to be tested:
+
+Structure
+    __init__
+    fromFile
+    lockArrays
+    getAtomicData
+    getPDBLines
+StructureStore
+    extractStructure
+    depositStructure
+StructureCache
+    getStructure
+    clear
+getStructure
+useStructureStore
+writeStructureFile
+openStructureFile
+getPDBRef
+getAtomRecords
+getAtomSiteLines
+getAtomSiteColumns
+getAtomSiteRows
+getReducedAtomSiteLines
+quoteCIFValue
+getLoopRows
+getResidueCounters
+"""
+import proteinnetworks.structure
+import proteinnetworks.network
+import proteinnetworks.partition
+from bson.objectid import ObjectId
+import numpy as np
+import pytest
+import bz2
+import gzip
+
+PDB_LINES = [
+    "HEADER    TEST\n",
+    "ATOM      1  N   MET A   1      27.340  24.430   2.614  1.00  9.67           N\n",
+    "ATOM      2  CA  MET A   1      26.266  25.413   2.842  1.00 10.38           C",
+    "HETATM    3 FE   HEM A   2       1.000   2.000   3.000  1.00 10.38          FE\n",
+    "ATOM      4  OG1 THR B   7      -1.500   0.000  10.250",
+    "ATOM      5 FE   FEX B  -3       0.001  -0.010 100.000  1.00 10.38          FE\n",
+    "ENDMDL\n",
+    "ATOM      6  N   MET A   1      27.340  24.430   2.614  1.00  9.67           N\n",
+]
+
+# The same atoms as PDB_LINES, as an mmCIF file, with a row split over two lines, quoted
+# values and a residue number too long for the PDB format
+MMCIF_LINES = [
+    "data_1ABC\n",
+    "#\n",
+    "loop_\n",
+    "_atom_type.symbol\n",
+    "N\n",
+    "#\n",
+    "loop_\n",
+    "_atom_site.group_PDB\n",
+    "_atom_site.id\n",
+    "_atom_site.label_atom_id\n",
+    "_atom_site.label_asym_id\n",
+    "_atom_site.label_seq_id\n",
+    "_atom_site.Cartn_x\n",
+    "_atom_site.Cartn_y\n",
+    "_atom_site.Cartn_z\n",
+    "_atom_site.auth_seq_id\n",
+    "_atom_site.auth_asym_id\n",
+    "_atom_site.auth_atom_id\n",
+    "_atom_site.pdbx_PDB_model_num\n",
+    "ATOM   1 N  A 1 27.340  24.430   2.614 1 A N 1\n",
+    "ATOM   2 CA A 1 26.266  25.413   2.842 1 A CA 1\n",
+    "HETATM 3 FE C . 1.000   2.000   3.000 2 A FE 1\n",
+    "ATOM   4 OG1 B 2 -1.500\n",
+    "0.000  10.250 7 B OG1 1\n",
+    "ATOM   5 \"FE\" B 3 0.001 -0.010 100.000 -3 B 'FE' 1\n",
+    "ATOM   6 N  A 1 27.340  24.430   2.614 1 A N 2\n",
+    "#\n",
+    "loop_\n",
+    "_atom_site_anisotrop.id\n",
+    "1\n",
+]
+
+
+class CountingDatabase:
+    """Serves PDB_LINES for any pdbref, counting the requests."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def extractPDBFile(self, pdbref):
+        self.requests += 1
+        return PDB_LINES
+
+    def fetchPDBFileFromWeb(self, pdbref):
+        raise AssertionError("the PDB file is in the database")
+
+
+"""
+Tests for Structure, getAtomRecords and getResidueCounters
+
+Structure: PDB lines -> the arrays of the ATOM records of the first model
+
+Tests:
+- every field is parsed, and residues counted over all chains
+- getAtomicData with a chain counts the residues within the chain
+- the arrays returned by getAtomicData can't be changed in place
+- the ATOM records are returned as lines for PyMol
+"""
+
+
+def test_structure_init():
+    structure = proteinnetworks.structure.Structure(PDB_LINES)
+    assert np.array_equal(structure.positions,
+                          [[27.34, 24.43, 2.614], [26.266, 25.413, 2.842], [-1.5, 0, 10.25],
+                           [0.001, -0.01, 100]])
+    assert list(structure.elements) == ["N", "C", "O", "F"]
+    assert list(structure.chains) == ["A", "A", "B", "B"]
+    assert list(structure.residuenumbers) == [1, 1, 7, -3]
+    assert list(structure.residues) == [1, 1, 2, 3]
+    assert structure.nbytes > structure.records.nbytes
+
+
+def test_structure_getatomicdata_chain():
+    structure = proteinnetworks.structure.Structure(PDB_LINES)
+    positions, elements, residues = structure.getAtomicData("B")
+    assert np.array_equal(positions, [[-1.5, 0, 10.25], [0.001, -0.01, 100]])
+    assert list(elements) == ["O", "F"]
+    assert list(residues) == [1, 2]
+    with pytest.raises(RuntimeError):
+        structure.getAtomicData("C")
+
+
+@pytest.mark.parametrize("lines", [PDB_LINES, MMCIF_LINES])
+def test_structure_getatomicdata_read_only(lines):
+    structure = proteinnetworks.structure.Structure(lines)
+    positions, elements, residues = structure.getAtomicData()
+    with pytest.raises(ValueError):
+        positions[0, 0] = 0
+    with pytest.raises(ValueError):
+        residues += 1
+    assert list(structure.residues) == [1, 1, 2, 3]
+
+
+def test_structure_getpdblines():
+    structure = proteinnetworks.structure.Structure(PDB_LINES)
+    lines = structure.getPDBLines()
+    assert lines == [PDB_LINES[1].rstrip(), PDB_LINES[2], PDB_LINES[4], PDB_LINES[5].rstrip()]
+    reparsed = proteinnetworks.structure.Structure(lines)
+    assert np.array_equal(reparsed.positions, structure.positions)
+
+
+def test_getatomrecords():
+    records = proteinnetworks.structure.getAtomRecords(PDB_LINES)
+    assert records.shape == (4, 80) and records.dtype == np.uint8
+    assert bytes(records[2]).rstrip() == PDB_LINES[4].encode()
+    assert proteinnetworks.structure.getAtomRecords(["HEADER"]).shape == (0, 80)
+
+
+def test_getresiduecounters():
+    counters = proteinnetworks.structure.getResidueCounters([1, 1, 2, 5, 5, 2, 0])
+    assert list(counters) == [1, 1, 2, 3, 3, 4, 5]
+    assert list(proteinnetworks.structure.getResidueCounters([0, 0, 1])) == [0, 0, 1]
+
+
+"""
+Tests for the mmCIF reader: getAtomSiteLines, getAtomSiteColumns, getAtomSiteRows,
+getReducedAtomSiteLines, quoteCIFValue and getLoopRows
+
+Tests:
+- an mmCIF file gives the same arrays as the PDB file of the same atoms
+- the _atom_site loop is picked out of the file
+- rows may be split across lines or share them, and hold quoted values and text fields
+- a file without an _atom_site loop has no atoms
+- a file reduced to the values read gives the same structure
+"""
+
+
+def test_structure_init_mmcif():
+    structure = proteinnetworks.structure.Structure(MMCIF_LINES)
+    expected = proteinnetworks.structure.Structure(PDB_LINES)
+    assert structure.records is None
+    for name in ["positions", "elements", "chains", "residuenumbers", "residues"]:
+        assert np.array_equal(getattr(structure, name), getattr(expected, name))
+    for expectedArray, array in zip(expected.getAtomicData("B"), structure.getAtomicData("B")):
+        assert np.array_equal(expectedArray, array)
+    with pytest.raises(ValueError):
+        structure.getPDBLines()
+
+
+def test_structure_init_mmcif_large_residue_number():
+    lines = MMCIF_LINES[:19] + ["ATOM 1 CA AAAA 1 1.0 2.0 3.0 123456 AAAA CA 1\n"]
+    structure = proteinnetworks.structure.Structure(["\n"] + lines)
+    assert list(structure.residuenumbers) == [123456]
+    assert list(structure.chains) == ["AAAA"]
+
+
+def test_getatomsitelines():
+    lines = list(proteinnetworks.structure.getAtomSiteLines(MMCIF_LINES))
+    assert lines == MMCIF_LINES[:1] + MMCIF_LINES[6:27]
+
+
+def test_getatomsitecolumns_no_loop():
+    positions, elements, chains, residueNumbers = \
+        proteinnetworks.structure.getAtomSiteColumns(MMCIF_LINES[:6])
+    assert positions.shape == (0, 3)
+    assert len(elements) == len(chains) == len(residueNumbers) == 0
+
+
+def test_getatomsiterows():
+    rows = list(proteinnetworks.structure.getAtomSiteRows(MMCIF_LINES))
+    assert rows[0] == ("27.340", "24.430", "2.614", "N", "A", "1")
+    assert len(rows) == 4
+
+
+def test_getreducedatomsitelines():
+    reduced = proteinnetworks.structure.getReducedAtomSiteLines(MMCIF_LINES)
+    assert reduced[:3] == ["data_1ABC", "loop_", "_atom_site.Cartn_x"]
+    assert len(reduced) == 2 + 6 + 4
+    structure = proteinnetworks.structure.Structure(reduced)
+    expected = proteinnetworks.structure.Structure(MMCIF_LINES)
+    for name in ["positions", "elements", "chains", "residuenumbers", "residues"]:
+        assert np.array_equal(getattr(structure, name), getattr(expected, name))
+
+
+def test_quotecifvalue():
+    quoteCIFValue = proteinnetworks.structure.quoteCIFValue
+    assert quoteCIFValue("O5'") == "O5'"
+    assert quoteCIFValue("A B") == "'A B'"
+    assert quoteCIFValue("_x") == "'_x'"
+    assert quoteCIFValue("") == "''"
+    assert quoteCIFValue("'x y") == '"\'x y"'
+    values = ["a b", "_x", "", "O5'", "#1"]
+    line = " ".join(map(quoteCIFValue, values))
+    assert list(proteinnetworks.structure.getLoopRows([line], 5)) == [values]
+
+
+def test_getlooprows():
+    lines = ["a 'b c' d\n", "e\n", "# comment\n", "f\n", ";text\n", "more\n", ";\n",
+             "g \"O5'\" O5' ''\n"]
+    rows = list(proteinnetworks.structure.getLoopRows(lines, 3))
+    assert rows == [["a", "b c", "d"], ["e", "f", "text\nmore"], ["g", "O5'", "O5'"]]
+
+
+"""
+Tests for Structure.fromFile, openStructureFile and getPDBRef
+
+Tests:
+- plain, gzip- and bzip2-compressed PDB and mmCIF files all give the same structure
+- the pdbref is taken from file names as in the PDB archive
+"""
+
+
+@pytest.mark.parametrize("compress", [lambda x: x, gzip.compress, bz2.compress])
+@pytest.mark.parametrize("lines", [PDB_LINES, MMCIF_LINES])
+def test_structure_fromfile(tmp_path, compress, lines):
+    path = tmp_path / "pdb1abc.ent"
+    path.write_bytes(compress("".join(x if x.endswith("\n") else x + "\n"
+                                      for x in lines).encode()))
+    structure = proteinnetworks.structure.Structure.fromFile(str(path))
+    expected = proteinnetworks.structure.Structure(lines)
+    for name in ["positions", "elements", "chains", "residuenumbers", "residues"]:
+        assert np.array_equal(getattr(structure, name), getattr(expected, name))
+    with proteinnetworks.structure.openStructureFile(str(path)) as structureFile:
+        assert next(structureFile) == lines[0]
+
+
+def test_getpdbref():
+    getPDBRef = proteinnetworks.structure.getPDBRef
+    assert getPDBRef("/mirror/ab/pdb1ABC.ent.gz") == "1abc"
+    assert getPDBRef("1abc.cif.bz2") == "1abc"
+    assert getPDBRef("1abc.pdb") == "1abc"
+    assert getPDBRef("1abc.txt") is None
+    assert getPDBRef("pdb1abcd.ent.gz") is None
+
+
+"""
+Tests for StructureCache and getStructure
+
+Tests:
+- a second request is served from the cache
+- the least recently used structures are dropped beyond maxbytes
+- a structure bigger than maxbytes isn't held
+- Networks and Partitions share the process-wide cache
+"""
+
+
+def test_structurecache_hit():
+    database = CountingDatabase()
+    cache = proteinnetworks.structure.StructureCache()
+    structure = cache.getStructure("1abc", database)
+    assert cache.getStructure("1abc", database) is structure
+    assert database.requests == 1
+    assert cache.nbytes == structure.nbytes
+    cache.clear()
+    assert cache.nbytes == 0
+    assert cache.getStructure("1abc", database) is not structure
+
+
+def test_structurecache_evicts_least_recently_used():
+    database = CountingDatabase()
+    nbytes = proteinnetworks.structure.Structure(PDB_LINES).nbytes
+    cache = proteinnetworks.structure.StructureCache(maxbytes=2 * nbytes)
+    cache.getStructure("1abc", database)
+    cache.getStructure("2abc", database)
+    cache.getStructure("1abc", database)
+    cache.getStructure("3abc", database)
+    assert list(cache.structures) == ["1abc", "3abc"]
+    assert cache.nbytes == 2 * nbytes
+    assert database.requests == 3
+
+
+def test_structurecache_too_big():
+    database = CountingDatabase()
+    cache = proteinnetworks.structure.StructureCache(maxbytes=10)
+    assert len(cache.getStructure("1abc", database).positions) == 4
+    assert not cache.structures and cache.nbytes == 0
+
+
+def test_getstructure_shared_by_network_and_partition(mock_database, monkeypatch):
+    db = proteinnetworks.database.Database(password="bla")
+    requests = []
+    extractPDBFile = db.extractPDBFile
+
+    def countingExtractPDBFile(pdbref):
+        requests.append(pdbref)
+        return extractPDBFile(pdbref)
+
+    monkeypatch.setattr(db, "extractPDBFile", countingExtractPDBFile)
+    proteinnetworks.network.Network.sweep("1ubq", "residue", "noH", [3.0, 4.0, 5.0],
+                                          database=db)
+    proteinnetworks.network.Network.sweep("1ubq", "residue", "noH", [3.0, 4.0, 5.0],
+                                          chainref="A", database=db)
+    partition = proteinnetworks.partition.Partition(
+        '1ubq', ObjectId('58dbe03fef677d54224a01da'), 'Infomap', N=10, database=db)
+    partition.getPFAMDomainArray()
+    partition.getPFAMDomainArray()
+    assert requests == ["1ubq"]
+    assert "1ubq" in proteinnetworks.structure.structureCache.structures
+
+
+"""
+Tests for StructureStore and useStructureStore
+
+Tests:
+- a deposited structure is read back, memory mapped, with the same arrays
+- structures missing from the store give None, malformed pdbrefs an IOError
+- structures read from mmCIF files are stored without ATOM records
+- coordinates are stored exactly as parsed, however many decimals they have
+- a cache backed by a store deposits what it parses, and later reads from the store
+"""
+
+
+def test_structurestore_roundtrip(tmp_path):
+    store = proteinnetworks.structure.StructureStore(str(tmp_path / "store"))
+    assert store.extractStructure("1abc") is None
+    structure = proteinnetworks.structure.Structure(PDB_LINES)
+    store.depositStructure("1abc", structure)
+    stored = store.extractStructure("1abc")
+    for name in ["records", "positions", "elements", "chains", "residuenumbers", "residues"]:
+        # The mapped arrays are used as they are, rather than read in full and converted
+        assert isinstance(getattr(stored, name), np.memmap)
+        assert np.array_equal(getattr(stored, name), getattr(structure, name))
+    assert stored.getPDBLines() == structure.getPDBLines()
+    for chainref in [None, "A", "B"]:
+        for expected, actual in zip(structure.getAtomicData(chainref),
+                                    stored.getAtomicData(chainref)):
+            assert np.array_equal(expected, actual)
+    # Depositing again leaves the stored structure alone
+    store.depositStructure("1abc", proteinnetworks.structure.Structure(PDB_LINES[:2]))
+    assert len(store.extractStructure("1abc").positions) == 4
+    assert sorted(x.name for x in (tmp_path / "store").iterdir()) == ["1abc"]
+
+
+def test_structurestore_mmcif(tmp_path):
+    store = proteinnetworks.structure.StructureStore(str(tmp_path))
+    structure = proteinnetworks.structure.Structure(MMCIF_LINES)
+    store.depositStructure("1abc", structure)
+    stored = store.extractStructure("1abc")
+    assert stored.records is None
+    assert np.array_equal(stored.positions, structure.positions)
+    assert list(stored.chains) == list(structure.chains)
+
+
+def test_structurestore_keeps_precision(tmp_path):
+    # mmCIF coordinates may have more decimals than the PDB format's three
+    lines = [line.replace("27.340", "27.34012345") for line in MMCIF_LINES]
+    store = proteinnetworks.structure.StructureStore(str(tmp_path))
+    store.depositStructure("1abc", proteinnetworks.structure.Structure(lines))
+    assert store.extractStructure("1abc").positions[0, 0] == 27.34012345
+
+
+def test_structurestore_malformed_pdbref(tmp_path):
+    store = proteinnetworks.structure.StructureStore(str(tmp_path))
+    with pytest.raises(IOError):
+        store.extractStructure("../1abc")
+
+
+def test_usestructurestore(tmp_path):
+    database = CountingDatabase()
+    store = proteinnetworks.structure.useStructureStore(str(tmp_path))
+    try:
+        structure = proteinnetworks.structure.getStructure("1abc", database)
+        proteinnetworks.structure.structureCache.clear()
+        stored = proteinnetworks.structure.getStructure("1abc", database)
+    finally:
+        proteinnetworks.structure.useStructureStore(None)
+    assert database.requests == 1
+    assert isinstance(stored.records, np.memmap)
+    assert np.array_equal(stored.positions, structure.positions)
+    assert store.extractStructure("1abc") is not None
+    assert proteinnetworks.structure.structureCache.store is None
+
+
+"""
+Tests for writeStructureFile
+
+Tests:
+- the whole PDB file is written, HETATM records and all
+- mmCIF files are written whole, with a .cif extension
+- files missing from the database are fetched from the web
+"""
+
+
+def test_writestructurefile_pdb(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filename = proteinnetworks.structure.writeStructureFile("1abc", CountingDatabase())
+    assert filename == "temp.pdb"
+    with open(filename) as flines:
+        assert flines.read() == "\n".join(PDB_LINES)
+
+
+def test_writestructurefile_mmcif(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = CountingDatabase()
+    monkeypatch.setattr(database, "extractPDBFile", lambda pdbref: [])
+    monkeypatch.setattr(database, "fetchPDBFileFromWeb", lambda pdbref: MMCIF_LINES)
+    filename = proteinnetworks.structure.writeStructureFile("1abc", database)
+    assert filename == "temp.cif"
+    with open(filename) as flines:
+        assert flines.read() == "\n".join(MMCIF_LINES)